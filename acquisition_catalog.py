@@ -0,0 +1,229 @@
+"""Index of saved acquisitions in a local SQLite database.
+
+    python acquisition_catalog.py scan D:/Data
+    python acquisition_catalog.py query --axis defocus --wavelength 532 --since 2026-10-01
+
+The application adds every acquisition it saves; scan indexes older data and
+only reads acquisitions that changed since the last scan.
+"""
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from dataset_reader import base_path, data_files, open_file, sweep_values
+
+DEFAULT_DATABASE = Path.home() / '.experiment-control' / 'catalog.sqlite'
+# Tolerance when matching a wavelength, in nm
+WAVELENGTH_TOLERANCE = 0.5
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS acquisitions (
+    path TEXT PRIMARY KEY,
+    timestamp TEXT,
+    axes TEXT,
+    media TEXT,
+    defocus_start REAL,
+    defocus_stop REAL,
+    defocus_number INTEGER,
+    wavelength_start REAL,
+    wavelength_stop REAL,
+    wavelength_number INTEGER,
+    magnification INTEGER,
+    roi TEXT,
+    frames INTEGER,
+    size INTEGER,
+    modified REAL
+);
+CREATE INDEX IF NOT EXISTS acquisitions_timestamp ON acquisitions (timestamp);
+CREATE INDEX IF NOT EXISTS acquisitions_wavelength ON acquisitions (wavelength_start, wavelength_stop);
+'''
+
+COLUMNS = ('path', 'timestamp', 'axes', 'media', 'defocus_start', 'defocus_stop', 'defocus_number',
+           'wavelength_start', 'wavelength_stop', 'wavelength_number', 'magnification', 'roi',
+           'frames', 'size', 'modified')
+
+
+def sweep_range(setting):
+    """(start, stop, number) of a setting from generate_metadata, swept or not"""
+    values = sweep_values(setting)
+    if values is not None:
+        return float(values[0]), float(values[-1]), len(values)
+    if isinstance(setting, (int, float)):
+        return float(setting), float(setting), 1
+    return None, None, None
+
+
+def describe(path) -> dict:
+    """Catalog entry of a saved acquisition, from its metadata and the headers of its files"""
+    path = base_path(path)
+    metadata_path = path.with_name(path.name + '.yaml')
+    with open(metadata_path) as file:
+        metadata = yaml.safe_load(file)
+
+    files = list(data_files(path).values())
+    frames = 0
+    for data_path in files:
+        data = open_file(data_path)
+        frames += int(np.prod(data.shape[:-2]))
+        if hasattr(data, 'close'):
+            data.close()
+    modified = max(file.stat().st_mtime for file in [metadata_path, *files])
+
+    axes = []
+    media = metadata.get('Pump.media')
+    if media is not None:
+        axes.append('media')
+    defocus = sweep_range(metadata.get('Setup.defocus [um]'))
+    if isinstance(metadata.get('Setup.defocus [um]'), dict):
+        axes.append('defocus')
+    wavelength = sweep_range(metadata.get('Laser.wavelength [nm]'))
+    if isinstance(metadata.get('Laser.wavelength [nm]'), dict):
+        axes.append('wavelen')
+
+    timestamp = metadata.get('Acquisition.date')
+    if timestamp is None:
+        # Saved before the date was recorded
+        timestamp = datetime.fromtimestamp(modified).isoformat()
+    roi = metadata.get('Camera.roi')
+
+    return {
+        'path': str(path),
+        'timestamp': str(timestamp),
+        'axes': ','.join(axes),
+        'media': ','.join(str(medium) for medium in media) if media is not None else None,
+        'defocus_start': defocus[0],
+        'defocus_stop': defocus[1],
+        'defocus_number': defocus[2],
+        'wavelength_start': wavelength[0],
+        'wavelength_stop': wavelength[1],
+        'wavelength_number': wavelength[2],
+        'magnification': metadata.get('Setup.magnification'),
+        'roi': ','.join(str(value) for value in roi) if roi is not None else None,
+        'frames': frames,
+        'size': sum(file.stat().st_size for file in files),
+        'modified': modified}
+
+
+class AcquisitionCatalog:
+    def __init__(self, database):
+        self.database = Path(database)
+        self.database.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.database)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, path):
+        entry = describe(path)
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        with self.connection:
+            self.connection.execute(
+                f'INSERT OR REPLACE INTO acquisitions ({", ".join(COLUMNS)}) VALUES ({placeholders})',
+                [entry[column] for column in COLUMNS])
+        return entry
+
+    def remove(self, path):
+        with self.connection:
+            self.connection.execute('DELETE FROM acquisitions WHERE path = ?', (str(base_path(path)),))
+
+    def scan(self, directory):
+        """Index new and changed acquisitions under a directory, drop ones that are gone.
+
+        Returns the number of acquisitions that were (re)indexed.
+        """
+        directory = Path(directory)
+        # A plain prefix comparison, paths can contain the wildcards of LIKE
+        prefix = os.path.join(directory, '')
+        known = {row['path']: row['modified'] for row in self.connection.execute(
+            'SELECT path, modified FROM acquisitions WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+        seen = set()
+        updated = 0
+        for metadata_path in directory.rglob('*.yaml'):
+            path = base_path(metadata_path)
+            if path.name.endswith('_processed'):
+                continue
+            try:
+                files = list(data_files(path).values())
+            except FileNotFoundError:
+                continue
+            seen.add(str(path))
+            modified = max(file.stat().st_mtime for file in [metadata_path, *files])
+            if known.get(str(path)) == modified:
+                continue
+            try:
+                self.add(path)
+                updated += 1
+            except (OSError, ValueError, KeyError, yaml.YAMLError):
+                # Not an acquisition, or an unreadable one
+                continue
+        for path in set(known) - seen:
+            self.remove(path)
+        return updated
+
+    def query(self, axis=None, wavelength=None, since=None, until=None, magnification=None, path=None):
+        """Acquisitions matching all given conditions, newest first.
+
+        axis is a swept axis ('media', 'defocus' or 'wavelen'); wavelength matches
+        acquisitions at or sweeping over it; since and until are datetimes.
+        """
+        conditions = []
+        parameters = []
+        if axis is not None:
+            conditions.append("(',' || axes || ',') LIKE ?")
+            parameters.append(f'%,{axis},%')
+        if wavelength is not None:
+            conditions.append('MIN(wavelength_start, wavelength_stop) <= ? AND MAX(wavelength_start, wavelength_stop) >= ?')
+            parameters += [wavelength + WAVELENGTH_TOLERANCE, wavelength - WAVELENGTH_TOLERANCE]
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            parameters.append(since.isoformat())
+        if until is not None:
+            conditions.append('timestamp < ?')
+            parameters.append(until.isoformat())
+        if magnification is not None:
+            conditions.append('magnification = ?')
+            parameters.append(magnification)
+        if path is not None:
+            conditions.append('path LIKE ?')
+            parameters.append(f'%{path}%')
+        where = f'WHERE {" AND ".join(conditions)}' if len(conditions) > 0 else ''
+        return [dict(row) for row in self.connection.execute(
+            f'SELECT * FROM acquisitions {where} ORDER BY timestamp DESC', parameters)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index and search saved acquisitions')
+    parser.add_argument('--database', default=str(DEFAULT_DATABASE), help='catalog file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan = commands.add_parser('scan', help='index the acquisitions in directories')
+    scan.add_argument('directories', nargs='+')
+    query = commands.add_parser('query', help='list matching acquisitions')
+    query.add_argument('--axis', choices=['media', 'defocus', 'wavelen'])
+    query.add_argument('--wavelength', type=float)
+    query.add_argument('--since', type=datetime.fromisoformat)
+    query.add_argument('--until', type=datetime.fromisoformat)
+    query.add_argument('--magnification', type=int)
+    query.add_argument('--path')
+    args = parser.parse_args()
+
+    catalog = AcquisitionCatalog(args.database)
+    if args.command == 'scan':
+        for directory in args.directories:
+            print(f'{directory}: indexed {catalog.scan(directory)} acquisitions')
+    else:
+        rows = catalog.query(args.axis, args.wavelength, args.since, args.until, args.magnification, args.path)
+        for row in rows:
+            print(f"{row['timestamp'][:19]}  {row['axes'] or '-':<20} {row['frames']:>8} frames  {row['path']}")
+        print(f'{len(rows)} acquisitions')
+    catalog.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+from collections import namedtuple
+import os
+import shutil
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Seconds for a small stage move between background positions, on top of the 0.2 s settle
+STAGE_MOVE_TIME = 0.1
+# Size of camera frames over their size in a .rawz archive, on the low side of what the codecs reach
+ARCHIVE_RATIO = 2.0
+
+Estimate = namedtuple('Estimate', ['duration', 'frames', 'disk_bytes', 'peak_ram'])
+
+
+def capture_time(shot_count, background_positions, fps) -> float:
+    """Expected seconds for one grid photo when nothing has been measured yet"""
+    frame_time = 1/fps if fps > 0 else 0.1
+    moves = background_positions + 1
+    return shot_count*frame_time + background_positions*(frame_time + 0.2) + moves*STAGE_MOVE_TIME
+
+
+def estimate_acquisition(plan, frame_shape, bytes_per_pixel, frames_per_point, costs, buffered_points=1,
+                         completed=0, compression=1.0, export=False) -> Estimate:
+    """Runtime, data size and memory use of a sweep plan.
+
+    costs holds the measured seconds per setpoint change of each axis and per
+    grid photo ('capture'). buffered_points is the number of points that can be
+    waiting to be written besides the one being captured. A resumed plan only
+    takes its points after the completed ones; the raw data shrinks by
+    compression, while an OME-TIFF export is an uncompressed copy of all of it.
+    """
+    frame_bytes = int(np.prod(frame_shape))*bytes_per_pixel
+    point_bytes = frames_per_point*frame_bytes
+    remaining = max(plan.number_of_points - completed, 0)
+
+    duration = remaining*costs.get('capture', 0)
+    for axis, moves in plan.moves().items():
+        # Moves are spread over the plan, the remaining points need their share
+        duration += moves*remaining/max(plan.number_of_points, 1)*costs.get(axis, 0)
+
+    frames = remaining*frames_per_point
+    disk_bytes = frames*frame_bytes/compression
+    if export:
+        disk_bytes += plan.number_of_points*point_bytes
+
+    # Points are written out as they are taken, a frame list and its array copy
+    peak_ram = (buffered_points + 2)*point_bytes
+    return Estimate(duration, frames, disk_bytes, peak_ram)
+
+
+def available_memory():
+    """Free physical memory in bytes, None when unknown"""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    if hasattr(os, 'sysconf') and 'SC_AVPHYS_PAGES' in os.sysconf_names:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    return None
+
+
+def free_disk(path) -> int:
+    return shutil.disk_usage(path).free
+
+
+def format_bytes(size) -> str:
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if size < 1000:
+            return f'{size:.0f} {unit}'
+        size /= 1000
+    return f'{size:.1f} TB'
+
+
+def format_duration(seconds) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
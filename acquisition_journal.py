@@ -0,0 +1,119 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+from datetime import datetime
+
+import yaml
+
+from sweep_plan import SweepPlan
+
+
+class AcquisitionJournal:
+    """Durable record of a running acquisition.
+
+    A journal is a directory with the plan and settings (plan.yaml), including the
+    destination the data files are written to, and an append-only log of everything
+    that has been completed. Log lines are only written after the data they refer
+    to has been flushed, so after a crash the log never claims more than is on disk.
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        with open(self.directory / 'plan.yaml') as file:
+            self.state = yaml.safe_load(file)
+
+        self.completed = set()
+        self.chunks = set()
+        self.origins = {}
+        self.exchange_volumes = {}
+        # Why earlier runs stopped before the plan was complete
+        self.stops = []
+        log = self.directory / 'journal.log'
+        if log.exists():
+            with open(log) as file:
+                for line in file:
+                    self.parse(line.split())
+
+    def parse(self, fields):
+        if len(fields) == 0:
+            return
+        kind, values = fields[0], fields[1:]
+        try:
+            if kind == 'point':
+                self.completed.add(tuple(int(v) for v in values))
+            elif kind == 'chunk':
+                self.chunks.add(int(values[0]))
+            elif kind == 'origin':
+                self.origins[values[0]] = float(values[1])
+            elif kind == 'exchange':
+                self.exchange_volumes[int(values[0])] = int(values[1])
+            elif kind == 'stopped':
+                self.stops.append(' '.join(values))
+        except (IndexError, ValueError):
+            # A line cut off by a crash
+            pass
+
+    @classmethod
+    def create(cls, root, plan: SweepPlan, state: dict):
+        directory = Path(root) / datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        directory.mkdir(parents=True)
+        state = dict(state, plan=plan.to_dict(), started=datetime.now().isoformat())
+        with open(directory / 'plan.yaml', 'w') as file:
+            yaml.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        return cls(directory)
+
+    @staticmethod
+    def unfinished(root):
+        """Journal directories of acquisitions that have not been saved"""
+        root = Path(root)
+        if not root.exists():
+            return []
+        return sorted(path for path in root.iterdir() if (path / 'plan.yaml').exists())
+
+    def plan(self) -> SweepPlan:
+        return SweepPlan.from_dict(self.state['plan'])
+
+    @property
+    def complete(self) -> bool:
+        return len(self.completed) >= self.plan().number_of_points
+
+    @property
+    def destination(self):
+        """Path of the data files without extension, None for journals of older versions"""
+        destination = self.state.get('destination')
+        return Path(destination) if destination is not None else None
+
+    def write(self, *fields):
+        # Points are recorded by the writer thread, the rest by the acquisition
+        with self.lock, open(self.directory / 'journal.log', 'a') as file:
+            file.write(' '.join(str(field) for field in fields) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def record_point(self, point):
+        self.write('point', *point)
+        self.completed.add(tuple(point))
+
+    def record_chunk(self, chunk):
+        self.write('chunk', chunk)
+        self.chunks.add(chunk)
+
+    def record_origin(self, axis, value):
+        self.write('origin', axis, float(value))
+        self.origins[axis] = float(value)
+
+    def record_exchange(self, index, volume):
+        self.write('exchange', index, int(volume))
+        self.exchange_volumes[index] = int(volume)
+
+    def record_stop(self, reason):
+        """Note why a run ended early, the journal is kept to resume from"""
+        reason = ' '.join(str(reason).split())
+        self.write('stopped', datetime.now().isoformat(timespec='seconds'), reason)
+        self.stops.append(reason)
+
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
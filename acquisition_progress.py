@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+import time
+
+from acquisition_estimate import format_duration
+
+PHASES = ('move', 'settle', 'expose', 'capture', 'save')
+
+
+class AcquisitionProgress:
+    """Keeps track of where a running sweep plan is and how long its phases take"""
+    def __init__(self, plan=None):
+        self.plan = plan
+        self.timings = {phase: 0.0 for phase in PHASES}
+        self.index = {}
+        self.completed = 0
+        self.total = plan.number_of_points if plan is not None else 0
+        self.remaining_moves = plan.moves() if plan is not None else {}
+        self.started = time.monotonic()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.monotonic() - start
+
+    def moved(self, axis, index):
+        self.index[axis] = index
+        self.remaining_moves[axis] = max(self.remaining_moves.get(axis, 0) - 1, 0)
+
+    def captured(self, number=1):
+        self.completed += number
+
+    def eta(self, costs) -> float:
+        """Seconds left, from the current cost per grid photo and per setpoint change"""
+        remaining = (self.total - self.completed)*costs.get('capture', 0)
+        for axis, moves in self.remaining_moves.items():
+            remaining += moves*costs.get(axis, 0)
+        return remaining
+
+    def text(self, costs) -> str:
+        parts = [f'Point {self.completed}/{self.total}']
+        if self.plan is not None and len(self.plan.names) > 0:
+            indices = ', '.join(f'{name} {self.index.get(name, 0) + 1}/{len(self.plan.values(name))}' for name in self.plan.names)
+            parts.append(f'({indices})')
+        parts.append(f'ETA {format_duration(self.eta(costs))}')
+        return ' '.join(parts)
+
+    def tooltip(self) -> str:
+        elapsed = time.monotonic() - self.started
+        lines = [f'Elapsed: {format_duration(elapsed)}']
+        lines += [f'{phase.capitalize()}: {self.timings[phase]:.1f} s' for phase in PHASES]
+        return '\n'.join(lines)
@@ -0,0 +1,82 @@
+import numpy as np
+from itertools import permutations
+
+PATTERNS = ('quadrant', 'square', 'ring')
+
+
+def background_grid(number: int, pattern: str = 'quadrant', spacing: float = 4) -> np.ndarray:
+    """Stage offsets in micron of the background photos around the anchor.
+
+    quadrant: lattice points on one side of the anchor (the original 3 point grid)
+    square: lattice points all around the anchor
+    ring: points evenly spaced on a circle
+    """
+    if number < 1:
+        raise ValueError('A background grid needs at least one position')
+
+    if pattern == 'ring':
+        angles = 2*np.pi*np.arange(number)/number
+        offsets = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+    elif pattern in ('quadrant', 'square'):
+        size = int(np.ceil(np.sqrt(number + 1))) + 1
+        low = 0 if pattern == 'quadrant' else -size
+        coords = np.arange(low, size + 1)
+        xx, yy = np.meshgrid(coords, coords)
+        points = np.stack((xx.ravel(), yy.ravel()), axis=1)
+        points = points[np.any(points != 0, axis=1)]
+        # Closest first, ties broken by angle so the result is deterministic
+        distance = np.hypot(points[:, 0], points[:, 1])
+        angle = np.mod(np.arctan2(points[:, 1], points[:, 0]), 2*np.pi)
+        offsets = points[np.lexsort((angle, distance))][:number].astype(np.float64)
+    else:
+        raise ValueError(f'Unknown background pattern {pattern}, expected one of {PATTERNS}')
+
+    return order_positions(offsets*spacing)
+
+
+def travel_cost(offsets, reversal_penalty: float = 0.5) -> float:
+    """Length of the tour anchor -> offsets -> anchor plus a penalty for sharp turns.
+
+    The penalty is a fraction of the mean step per turn of more than 90 degrees,
+    since direction reversals cost backlash and settling time.
+    """
+    path = np.concatenate((np.zeros((1, 2)), offsets, np.zeros((1, 2))))
+    steps = np.diff(path, axis=0)
+    lengths = np.hypot(steps[:, 0], steps[:, 1])
+    cost = lengths.sum()
+    if len(steps) > 1:
+        turns = np.sum(steps[1:]*steps[:-1], axis=1) < 0
+        cost += reversal_penalty*lengths.mean()*np.count_nonzero(turns)
+    return float(cost)
+
+
+def order_positions(offsets, reversal_penalty: float = 0.5) -> np.ndarray:
+    """Visit order of the offsets with the lowest travel cost"""
+    offsets = np.asarray(offsets, dtype=np.float64)
+    if len(offsets) <= 7:
+        # Small grids, try everything
+        best = min(permutations(range(len(offsets))), key=lambda order: travel_cost(offsets[list(order)], reversal_penalty))
+        return offsets[list(best)]
+
+    # Nearest neighbour tour improved with 2-opt
+    remaining = list(range(len(offsets)))
+    order = []
+    current = np.zeros(2)
+    while remaining:
+        distances = [np.hypot(*(offsets[i] - current)) for i in remaining]
+        index = remaining.pop(int(np.argmin(distances)))
+        order.append(index)
+        current = offsets[index]
+
+    best_cost = travel_cost(offsets[order], reversal_penalty)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 2, len(order) + 1):
+                candidate = order[:i] + order[i:j][::-1] + order[j:]
+                cost = travel_cost(offsets[candidate], reversal_penalty)
+                if cost < best_cost - 1e-9:
+                    order, best_cost = candidate, cost
+                    improved = True
+    return offsets[order]
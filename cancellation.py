@@ -0,0 +1,27 @@
+import threading
+
+
+class AcquisitionCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """Cancellation flag checked by the acquisition at step boundaries and inside waits"""
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise AcquisitionCancelled()
+
+    def sleep(self, seconds):
+        """Sleep that ends as soon as the acquisition is cancelled"""
+        if self._event.wait(seconds):
+            raise AcquisitionCancelled()
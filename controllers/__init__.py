@@ -1,10 +1,11 @@
-from .stage_controller import StageController
+from .stage_controller import StageController, StageMover
 from .pump_controller import PumpController
 from .laser_controller import LaserController
 from .camera_controller import CameraController
 
 __all__ = [
     "StageController",
+    "StageMover",
     "PumpController",
     "LaserController",
     "CameraController"
@@ -157,6 +157,15 @@ class CameraController(QObject):
         self.device_property_map.set_value(ic4.PropId.EXPOSURE_AUTO, 'Off')
         self.device_property_map.set_value(ic4.PropId.PIXEL_FORMAT, 'Mono16')
 
+        self.emit_geometry()
+
+        self.updateCameraLabel()
+
+        # if start_stream_on_open
+        self.startStopStream()
+
+    def emit_geometry(self):
+        """Announce the ROI and sensor size, e.g. to restore the view after showing something else"""
         self.roi_width = self.device_property_map.get_value_int(ic4.PropId.WIDTH)
         self.roi_height = self.device_property_map.get_value_int(ic4.PropId.HEIGHT)
         self.opened.emit(
@@ -166,11 +175,6 @@ class CameraController(QObject):
             self.device_property_map.get_value_int(ic4.PropId.HEIGHT_MAX),
             self.device_property_map.get_value_int(ic4.PropId.OFFSET_X),
             self.device_property_map.get_value_int(ic4.PropId.OFFSET_Y))
-
-        self.updateCameraLabel()
-
-        # if start_stream_on_open
-        self.startStopStream()
     
     def customEvent(self, ev: QEvent):
         if ev.type() == DEVICE_LOST_EVENT:
@@ -221,5 +225,10 @@ class CameraController(QObject):
         self.device_property_map.set_value(ic4.PropId.OFFSET_Y, int(roi.top()))
         self.startStopStream()
     
+    def get_roi(self):
+        """Offset x, offset y, width and height of the sensor region"""
+        return [self.device_property_map.get_value_int(prop) for prop in
+                (ic4.PropId.OFFSET_X, ic4.PropId.OFFSET_Y, ic4.PropId.WIDTH, ic4.PropId.HEIGHT)]
+
     def set_autoexposure(self, value: str):
         self.device_property_map.set_value(ic4.PropId.EXPOSURE_AUTO, value)
\ No newline at end of file
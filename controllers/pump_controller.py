@@ -1,22 +1,56 @@
 from amfTools import AMF, Device
 import amfTools
 import logging
-from PySide6.QtCore import QObject, Signal, QCoreApplication
+import queue
+from PySide6.QtCore import QObject, Signal, QCoreApplication, QThread, QMutex, QMutexLocker
+
+from .pump_program import plan_cleaning, estimate_duration
 
 
 def requires_open(method):
     def wrapper(self, *args, **kwargs):
-        if self.open and self.amf is not None:
-            if not self.amf.getHomeStatus():
-                    self.amf.home(block=True)
-            return method(self, *args, **kwargs)
-        else:
-            raise RuntimeError("Device is not open, cannot call this method.")
+        # Commands come from the GUI, the acquisition and the program worker
+        with QMutexLocker(self.mutex):
+            if self.open and self.amf is not None:
+                if not self.amf.getHomeStatus():
+                        self.amf.home(block=True)
+                return method(self, *args, **kwargs)
+            else:
+                raise RuntimeError("Device is not open, cannot call this method.")
     return wrapper
-            
+
+
+class PumpWorker(QThread):
+    """Runs queued pump programs step by step off the GUI thread"""
+    def __init__(self, pump):
+        super().__init__(pump)
+        self.pump = pump
+        self.programs = queue.Queue()
+
+    def run(self):
+        while True:
+            steps = self.programs.get()
+            if steps is None:
+                self.programs.task_done()
+                break
+            try:
+                # Manual commands do not block, let them finish first
+                self.pump.wait_for_motion()
+                for step in steps:
+                    self.pump.execute_step(step)
+            except Exception as e:
+                # Shown on the GUI thread
+                self.pump.program_failed.emit(f'Pump program failed: {e}')
+            finally:
+                self.programs.task_done()
+                self.pump.program_finished.emit()
+
 
 class PumpController(QObject):
     changedState = Signal(bool)
+    program_started = Signal(float)
+    program_finished = Signal()
+    program_failed = Signal(str)
     open = False
     def __init__(self, parent):
         super().__init__(parent=parent)
@@ -24,6 +58,11 @@ class PumpController(QObject):
         self.water = 1
         self.flowcell = 8
         self.waste = 10
+        self.syringe_size = 250
+        # Guards every access to the AMF
+        self.mutex = QMutex()
+        self.worker = PumpWorker(self)
+        self.worker.start()
         self.setup(warning=False)
 
     def setup(self, warning=True):
@@ -33,7 +72,7 @@ class PumpController(QObject):
             amf = AMF(product=device_list[0])
             if not amf.getHomeStatus():
                 amf.home(block=False)
-            amf.setSyringeSize(250)
+            amf.setSyringeSize(self.syringe_size)
 
             self.amf = amf
             self.open = True
@@ -45,6 +84,11 @@ class PumpController(QObject):
             return None
 
     def toggle(self):
+        with QMutexLocker(self.mutex):
+            self.toggle_connection()
+        self.changedState.emit(self.open)
+
+    def toggle_connection(self):
         if self.amf is not None:
             #  Reconnect
             if not self.open:
@@ -59,13 +103,14 @@ class PumpController(QObject):
                 logging.debug('Pump disconnected')
         else:
             self.setup()
-            
-        self.changedState.emit(self.open)
     
     def cleanup(self):
-        if self.open and self.amf is not None:
-            self.amf.disconnect()
-            logging.debug('Pump disconnected')
+        self.worker.programs.put(None)
+        self.worker.wait()
+        with QMutexLocker(self.mutex):
+            if self.open and self.amf is not None:
+                self.amf.disconnect()
+                logging.debug('Pump disconnected')
     
     @requires_open
     def pickup(self, port, volume=200):
@@ -91,24 +136,40 @@ class PumpController(QObject):
             raise RuntimeError('Cannot dispense in water!')
     
     def wait_till_ready(self):
-        if self.open and self.amf is not None:
-            self.amf.pullAndWait()
-    
+        # Let queued programs finish before waiting on the pump itself
+        self.worker.programs.join()
+        self.wait_for_motion()
+
+    def wait_for_motion(self):
+        with QMutexLocker(self.mutex):
+            if self.open and self.amf is not None:
+                self.amf.pullAndWait()
+
+    def execute_step(self, step):
+        command, value = step
+        with QMutexLocker(self.mutex):
+            if not self.open or self.amf is None:
+                raise RuntimeError('Pump is not open, cannot continue the program')
+            if command == 'valve':
+                self.amf.valveMove(value)
+            elif command == 'rate':
+                self.amf.setFlowRate(value, 2)
+            elif command == 'pickup':
+                self.amf.pumpPickupVolume(value, block=True)
+            elif command == 'dispense':
+                self.amf.pumpDispenseVolume(value, block=True)
+            else:
+                raise ValueError(f'Unknown pump command {command}')
+
+    def plan_clean(self, ports, volume=200):
+        if self.waste in ports or self.flowcell in ports or self.water in ports:
+            raise RuntimeError('Cannot clean water, waste or flowcell!')
+        return plan_cleaning(ports, volume, self.syringe_size, self.water, self.waste)
+
     @requires_open
     def clean_pump(self, ports, volume=200):
-        print(ports)
-        if self.waste not in ports and self.flowcell not in ports:
-            self.amf.pullAndWait()
-            self.amf.setFlowRate(1500,2)
-            for i in range(5):
-                for output in ports:
-                    print(output)
-                    self.amf.valveMove(self.water)
-                    self.amf.pumpPickupVolume(volume)
-                    self.amf.valveMove(output)
-                    self.amf.pumpDispenseVolume(volume)
-                    self.amf.pumpPickupVolume(volume)
-                    self.amf.valveMove(self.waste)
-                    self.amf.pumpDispenseVolume(volume)
-        else:
-            raise RuntimeError('Cannot pickup waste or flowcell!')
\ No newline at end of file
+        steps = self.plan_clean(ports, volume)
+        duration = estimate_duration(steps)
+        logging.info(f'Cleaning ports {ports}: {len(steps)} steps, about {duration:.0f} s')
+        self.worker.programs.put(steps)
+        self.program_started.emit(duration)
@@ -0,0 +1,86 @@
+"""Planning of fluidic programs for the AMF pump.
+
+A program is a list of (command, value) steps:
+    ('valve', port)       move the valve to a port
+    ('rate', flow_rate)   set the flow rate in uL/min
+    ('pickup', volume)    aspirate volume uL through the current port
+    ('dispense', volume)  dispense volume uL through the current port
+"""
+
+# Approximate time the valve needs to switch ports in seconds
+VALVE_TIME = 1.0
+# Number of syringe strokes per minute used for washing
+STROKES_PER_MINUTE = 6
+
+
+def wash_flow_rate(syringe_size: float) -> float:
+    """Flow rate in uL/min that moves a full syringe in a fixed time"""
+    return syringe_size*STROKES_PER_MINUTE
+
+
+def plan_cleaning(ports, volume, syringe_size, water, waste, rounds=5):
+    """Make a minimal-move program that flushes ports with water.
+
+    Water for several ports is picked up in one stroke and the dirty liquid
+    is pulled back in reverse order, so the valve is reused between the last
+    dispense and the first pickup and the waste is only visited once per group.
+    A group has to fit in one stroke in both directions, so ports are only
+    grouped when volume is at most half the syringe; larger volumes, like the
+    default 200uL in a 250uL syringe, clean one port per stroke.
+    """
+    if volume <= 0:
+        raise ValueError('Cleaning volume must be positive')
+    if volume > syringe_size:
+        raise RuntimeError(f'Cannot clean with {volume}uL, syringe only holds {syringe_size}uL')
+
+    ports = sorted(set(ports))
+    per_stroke = int(syringe_size // volume)
+    groups = [ports[i:i+per_stroke] for i in range(0, len(ports), per_stroke)]
+
+    steps = [('rate', wash_flow_rate(syringe_size))]
+    for _ in range(rounds):
+        for group in groups:
+            steps.append(('valve', water))
+            steps.append(('pickup', volume*len(group)))
+            for port in group:
+                steps.append(('valve', port))
+                steps.append(('dispense', volume))
+            for port in reversed(group):
+                steps.append(('valve', port))
+                steps.append(('pickup', volume))
+            steps.append(('valve', waste))
+            steps.append(('dispense', volume*len(group)))
+    return simplify(steps)
+
+
+def simplify(steps):
+    """Drop valve moves and flow rate changes that do not change anything"""
+    output = []
+    valve = None
+    rate = None
+    for command, value in steps:
+        if command == 'valve':
+            if value == valve:
+                continue
+            valve = value
+        elif command == 'rate':
+            if value == rate:
+                continue
+            rate = value
+        output.append((command, value))
+    return output
+
+
+def estimate_duration(steps, flow_rate=None) -> float:
+    """Estimated run time of a program in seconds"""
+    duration = 0.0
+    for command, value in steps:
+        if command == 'valve':
+            duration += VALVE_TIME
+        elif command == 'rate':
+            flow_rate = value
+        elif command in ('pickup', 'dispense'):
+            if flow_rate is None:
+                raise ValueError('Program moves liquid before setting a flow rate')
+            duration += 60*value/flow_rate
+    return duration
@@ -1,11 +1,20 @@
 # Stage
 from pymmcore_plus import CMMCorePlus
+from PySide6.QtCore import QObject, Signal, QThread, QMutex, QMutexLocker, QWaitCondition
+import numpy as np
 import logging
 from pathlib import Path
 
-class StageController():
-    def __init__(self):
+class StageController(QObject):
+    xy_position_changed = Signal(float, float)
+    z_position_changed = Signal(float)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
         self.open = False
+        # Last known positions, kept up to date by micromanager events and commanded targets
+        self._xy_position = None
+        self._z_position = None
         self.setup_micromanager()
 
     def setup_micromanager(self):
@@ -19,27 +28,153 @@ class StageController():
             self.open = True
             self.z_stage = self.mmc.getFocusDevice()
             self.xy_stage = self.mmc.getXYStageDevice()
+            self.mmc.events.XYStagePositionChanged.connect(self.on_xy_position_changed)
+            self.mmc.events.stagePositionChanged.connect(self.on_z_position_changed)
+            if self.xy_stage:
+                self.get_xy_position()
+            if self.z_stage:
+                self.get_z_position()
             logging.debug('Connected to micromanager')
 
+    def on_xy_position_changed(self, device, x, y):
+        if device == self.xy_stage:
+            self.update_xy_position((x, y))
+
+    def on_z_position_changed(self, device, pos):
+        if device == self.z_stage:
+            self.update_z_position(pos)
+
+    def update_xy_position(self, pos):
+        self._xy_position = (float(pos[0]), float(pos[1]))
+        self.xy_position_changed.emit(*self._xy_position)
+
+    def update_z_position(self, pos):
+        self._z_position = float(pos)
+        self.z_position_changed.emit(self._z_position)
+
+    @property
+    def xy_position(self):
+        """Cached xy position, only asks the hardware when nothing is known yet.
+
+        Good enough for display; anything that has to return to a position reads
+        the hardware with get_xy_position, manual moves may not have been reported.
+        """
+        if self._xy_position is None:
+            return self.get_xy_position()
+        return self._xy_position
+
+    @property
+    def z_position(self):
+        """Cached z position, only asks the hardware when nothing is known yet"""
+        if self._z_position is None:
+            return self.get_z_position()
+        return self._z_position
+
     def set_xy_position(self, pos):
         if self.open:
             self.mmc.setXYPosition(pos[0], pos[1])
             self.mmc.waitForDevice(self.xy_stage)
+            self.update_xy_position(pos)
 
     def get_xy_position(self):
         if self.open:
-            return self.mmc.getXYPosition()
+            pos = self.mmc.getXYPosition()
+            self.update_xy_position(pos)
+            return pos
     
     def set_z_position(self, pos):
         if self.open:
             self.mmc.setZPosition(pos)
             self.mmc.waitForDevice(self.z_stage)
+            self.update_z_position(pos)
 
     def get_z_position(self):
         if self.open:
-            return self.mmc.getZPosition()
+            pos = self.mmc.getZPosition()
+            self.update_z_position(pos)
+            return pos
+
+    def can_sequence_z(self, length):
+        """Whether the focus device can hold a sequence of this many positions"""
+        if not self.open or not self.z_stage:
+            return False
+        try:
+            if not self.mmc.isStageSequenceable(self.z_stage):
+                return False
+            maximum = self.mmc.getStageSequenceMaxLength(self.z_stage)
+            if length > maximum:
+                logging.info(f'Z stack of {length} positions is longer than the {maximum} the focus device can sequence, stepping z in software')
+                return False
+            return True
+        except Exception as e:
+            logging.debug(f'Z stage sequencing unavailable: {e}')
+            return False
+
+    def start_z_sequence(self, positions):
+        """Preload positions into the focus device, it advances on every trigger"""
+        self.mmc.loadStageSequence(self.z_stage, [float(pos) for pos in positions])
+        self.mmc.startStageSequence(self.z_stage)
+
+    def stop_z_sequence(self):
+        self.mmc.stopStageSequence(self.z_stage)
+        self.mmc.waitForDevice(self.z_stage)
     
+    def wait_for_xy(self):
+        if self.open:
+            self.mmc.waitForDevice(self.xy_stage)
+
     def move_stage(self, displacement):
         if self.open:
             displacement_micron = 3.45*displacement/60
-            self.mmc.setRelativeXYPosition(-float(displacement_micron[1]), -float(displacement_micron[0]))
\ No newline at end of file
+            # Where the relative move ends is only known once it is done
+            self._xy_position = None
+            self.mmc.setRelativeXYPosition(-float(displacement_micron[1]), -float(displacement_micron[0]))
+
+
+class StageMover(QThread):
+    """Moves the stage in the background for drag navigation.
+
+    Displacements that arrive while the stage is moving are summed, and only
+    the combined move is sent once the previous one has completed.
+    """
+    failed = Signal(str)
+    def __init__(self, stage: StageController, parent=None):
+        super().__init__(parent)
+        self.stage = stage
+        self.pending = np.zeros(2)
+        self.has_pending = False
+        self.running = True
+        self.mutex = QMutex()
+        self.condition = QWaitCondition()
+
+    def move(self, displacement):
+        with QMutexLocker(self.mutex):
+            self.pending = self.pending + displacement
+            self.has_pending = True
+            self.condition.wakeAll()
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.running = False
+            self.condition.wakeAll()
+        self.wait()
+
+    def run(self):
+        while True:
+            self.mutex.lock()
+            while self.running and not self.has_pending:
+                self.condition.wait(self.mutex)
+            if not self.running:
+                self.mutex.unlock()
+                break
+            displacement = self.pending
+            self.pending = np.zeros(2)
+            self.has_pending = False
+            self.mutex.unlock()
+
+            try:
+                self.stage.move_stage(displacement)
+                self.stage.wait_for_xy()
+                self.stage.get_xy_position()
+            except Exception as e:
+                self.failed.emit(f'Moving stage failed: {e}')
@@ -0,0 +1,180 @@
+"""Lazy access to saved acquisitions for analysis scripts.
+
+    with open_acquisition('D:/Data/run') as data:
+        data.shape                  # (medium, defocus, wavelength, shot, H, W)
+        data.coords['wavelength']   # nm
+        plane = data[0, 3, 5, 0]    # reads a single frame from disk
+        data.acquired               # which points hold data, after a cancelled run
+
+Axes that were not swept have length one. Only the frames that are indexed are
+read, from memory mapped .npy files or, for compressed acquisitions, from the
+.rawz archives.
+"""
+import re
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+AXES = ('medium', 'defocus', 'wavelength', 'shot')
+# Sweep axes as named in the plan, in the canonical order of the saved data
+SWEEP_AXES = {'media': 'medium', 'defocus': 'defocus', 'wavelen': 'wavelength'}
+SUFFIXES = ('.npy', '.rawz')
+
+
+def base_path(path):
+    """Path of an acquisition without extension, from any of its files"""
+    path = Path(path)
+    if path.suffix in (*SUFFIXES, '.yaml', '.tif'):
+        path = path.with_suffix('')
+    return path
+
+
+def sweep_values(setting):
+    if isinstance(setting, dict):
+        return np.linspace(setting['Start'], setting['Stop'], setting['Number'])
+    return None
+
+
+def data_files(path):
+    """Raw data files of an acquisition, by index of the split axis or None"""
+    for suffix in SUFFIXES:
+        single = path.with_name(path.name + suffix)
+        if single.exists():
+            return {None: single}
+        pattern = re.compile(re.escape(path.name) + r'_(\d+)' + re.escape(suffix))
+        split = {}
+        for file in path.parent.iterdir():
+            match = pattern.fullmatch(file.name)
+            if match is not None:
+                split[int(match.group(1))] = file
+        if len(split) > 0:
+            return split
+    raise FileNotFoundError(f'No data found for {path}')
+
+
+def open_file(path):
+    if path.suffix == '.rawz':
+        from raw_archive import RawArchive
+        return RawArchive(path)
+    return np.load(path, mmap_mode='r')
+
+
+class Acquisition:
+    """A saved acquisition as one lazy array of shape (medium, defocus, wavelength, shot, H, W)"""
+    def __init__(self, path):
+        self.path = base_path(path)
+        with open(self.path.with_name(self.path.name + '.yaml')) as file:
+            self.metadata = yaml.safe_load(file)
+
+        media = self.metadata.get('Pump.media')
+        defocus = sweep_values(self.metadata.get('Setup.defocus [um]'))
+        wavelengths = sweep_values(self.metadata.get('Laser.wavelength [nm]'))
+        swept = {'media': media, 'defocus': defocus, 'wavelen': wavelengths}
+        # Swept axes in the order they are stored
+        self.swept = [name for name in SWEEP_AXES if swept[name] is not None]
+
+        self.files = {chunk: open_file(file) for chunk, file in data_files(self.path).items()}
+        self.split = None not in self.files
+        first = next(iter(self.files.values()))
+        self.frames_per_point = first.shape[-3]
+        self.frame_shape = tuple(first.shape[-2:])
+        self.dtype = first.dtype
+
+        if media is not None:
+            media = np.asarray(media)
+        elif self.split:
+            # Split files of older versions have no Pump.media, number them by their suffix
+            media = np.arange(max(self.files) + 1)
+        else:
+            media = np.array([np.nan])
+
+        wavelength = self.metadata.get('Laser.wavelength [nm]')
+        self.coords = {
+            'medium': media,
+            'defocus': defocus if defocus is not None else np.array([0.0]),
+            'wavelength': wavelengths if wavelengths is not None else np.array([wavelength if wavelength is not None else np.nan], dtype=float),
+            'shot': np.arange(self.frames_per_point)}
+        # The first averaging shots are at the anchor, the rest are background positions
+        self.averaging = self.metadata.get('Camera.averaging', self.frames_per_point)
+
+    @property
+    def acquired(self):
+        """Mask over (medium, defocus, wavelength) of the points holding data.
+
+        Points of cancelled or failed runs that were never acquired are zeros in
+        the files; complete acquisitions have no list and are all acquired.
+        """
+        mask = np.ones(self.shape[:3], dtype=bool)
+        points = self.metadata.get('Acquisition.acquired_points')
+        if points is None:
+            return mask
+        mask[...] = False
+        axes = [SWEEP_AXES[name] for name in self.metadata['Acquisition.point_axes']]
+        for point in points:
+            index = dict(zip(axes, point))
+            mask[tuple(index.get(axis, 0) for axis in AXES[:3])] = True
+        return mask
+
+    @property
+    def shape(self):
+        return (*(len(self.coords[axis]) for axis in AXES), *self.frame_shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def close(self):
+        for file in self.files.values():
+            if hasattr(file, 'close'):
+                file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def frame(self, medium, defocus, wavelength, shot):
+        """Single frame by axis indices, zeros for points that were not acquired"""
+        indices = {'media': medium, 'defocus': defocus, 'wavelen': wavelength}
+        if self.split:
+            file = self.files.get(medium)
+            stored = [name for name in self.swept if name != 'media']
+        else:
+            file = self.files[None]
+            stored = self.swept
+        if file is None:
+            return np.zeros(self.frame_shape, self.dtype)
+        return file[(*(indices[name] for name in stored), shot)]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(self.ndim - len(key) + 1) + key[i+1:]
+        key = key + (slice(None),)*(self.ndim - len(key))
+        if len(key) > self.ndim:
+            raise IndexError(f'Too many indices for an acquisition of {self.ndim} dimensions')
+
+        # Index arrays of the sweep axes, integers drop their axis
+        selections = [np.arange(length)[k] for length, k in zip(self.shape[:4], key[:4])]
+        pixels = key[4:]
+        lengths = [np.size(selection) for selection in selections if np.ndim(selection) > 0]
+        out = None
+        for position in np.ndindex(*(np.size(selection) for selection in selections)):
+            indices = [int(np.ravel(selection)[i]) for selection, i in zip(selections, position)]
+            frame = np.asarray(self.frame(*indices)[pixels])
+            if out is None:
+                out = np.empty((*lengths, *frame.shape), frame.dtype)
+            target = tuple(i for selection, i in zip(selections, position) if np.ndim(selection) > 0)
+            out[target] = frame
+        if out is None:
+            # Empty selection
+            return np.empty((*lengths, *np.empty(self.frame_shape)[pixels].shape), self.dtype)
+        return out
+
+
+def open_acquisition(path) -> Acquisition:
+    return Acquisition(path)
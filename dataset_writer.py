@@ -0,0 +1,126 @@
+import queue
+
+import numpy as np
+from PySide6.QtCore import QThread, Signal
+
+# Points waiting to be written before the acquisition has to wait for the disk
+QUEUE_DEPTH = 4
+
+
+def open_dataset(path, shape, dtype):
+    """Memory map of a data file, keeping what an earlier run already wrote"""
+    if path.exists():
+        data = np.load(path, mmap_mode='r+')
+        if data.shape != tuple(shape) or data.dtype != dtype:
+            raise RuntimeError(f'Cannot resume: data in {path} has shape {data.shape}, expected {tuple(shape)}')
+        return data
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+class DatasetWriter(QThread):
+    """Writes the points of an acquisition into their final files off the acquisition thread.
+
+    Every file is a memory mapped .npy shaped (*data_shape, frames_per_point, H, W):
+    <destination>.npy, or <destination>_<i>.npy per index of the split axis.
+    A point is only recorded in the journal once its file has been flushed.
+    """
+    failed = Signal(str)
+    format = 'npy'
+
+    def __init__(self, destination, plan, journal=None, parent=None):
+        super().__init__(parent)
+        self.destination = destination
+        self.plan = plan
+        self.journal = journal
+        self.queue = queue.Queue(QUEUE_DEPTH)
+        self.files = {}
+        self.written = 0
+        # Points on disk in this run, as indices over all axes of the plan
+        self.points = set()
+        self.error = None
+
+    def path(self, chunk=None):
+        if chunk is None:
+            return self.destination.with_name(f'{self.destination.name}.npy')
+        return self.destination.with_name(f'{self.destination.name}_{chunk}.npy')
+
+    def write(self, chunk, point, frames):
+        """Queue the frames of a point, waits when the disk falls behind"""
+        if self.error is not None:
+            raise RuntimeError(f'Writing data failed: {self.error}')
+        self.queue.put(('point', chunk, point, frames))
+
+    def close_chunk(self, chunk):
+        self.queue.put(('close', chunk, None, None))
+
+    def finish(self):
+        """Write everything still queued and close the files"""
+        if self.isRunning():
+            self.queue.put(None)
+            self.wait()
+        if self.error is not None:
+            raise RuntimeError(f'Writing data failed: {self.error}')
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # Keep draining so the acquisition is never blocked
+                continue
+            kind, chunk, point, frames = item
+            try:
+                if kind == 'point':
+                    self.write_point(chunk, point, frames)
+                elif kind == 'close':
+                    self.close(chunk)
+            except Exception as e:
+                self.fail(f'Writing data failed: {e}', e)
+        for chunk in list(self.files):
+            try:
+                self.close(chunk, record=False)
+            except Exception as e:
+                self.fail(f'Closing data failed: {e}', e)
+
+    def fail(self, message, error):
+        # Only the first error, the acquisition stops at its next point anyway
+        if self.error is None:
+            self.failed.emit(message)
+        self.error = error
+
+    def write_point(self, chunk, point, frames):
+        if chunk not in self.files:
+            shape = (*self.plan.data_shape, *frames.shape)
+            self.files[chunk] = open_dataset(self.path(chunk), shape, frames.dtype)
+        data = self.files[chunk]
+        data[self.plan.data_index(point)] = frames
+        if self.journal is not None:
+            # Only claim points once their data is on disk
+            data.flush()
+            self.journal.record_point(point)
+        self.points.add(tuple(point))
+        self.written += 1
+
+    def close_file(self, data):
+        data.flush()
+
+    def close(self, chunk, record=True):
+        data = self.files.pop(chunk, None)
+        if data is not None:
+            self.close_file(data)
+            del data
+        if record and self.journal is not None and chunk not in self.journal.chunks:
+            self.journal.record_chunk(chunk)
+
+    def open_file(self, chunk=None):
+        """Read only view of a finished file, indexed as [*data_index, shot]"""
+        return np.load(self.path(chunk), mmap_mode='r')
+
+    def first_shots(self, chunk=None):
+        """First frame of every point of a finished file, shaped (*data_shape, H, W)"""
+        return np.load(self.path(chunk), mmap_mode='r')[..., 0, :, :]
+
+    def point(self, index, chunk=None):
+        """All frames of a point of a finished file"""
+        return np.load(self.path(chunk), mmap_mode='r')[index]
@@ -0,0 +1,290 @@
+"""Detection of landing particles in contrast frames.
+
+Candidates are found on a copy of the frame binned by DOWNSAMPLE: a difference
+of Gaussians (a band-pass close to a Laplacian of Gaussian) keeps features of
+about the particle size, and every local extreme of it above the threshold is
+a candidate. Each candidate is then refined on the full resolution frame to
+the extreme pixel near it, with a 3x3 centroid for the position.
+
+A landing stays visible in the rolling ratio for about 2N frames, so
+detections within LINK_DISTANCE pixels of each other in frames at most
+LINK_GAP apart are linked into a track, and every track becomes one event at
+its peak contrast. Events go into an EventTable, one growing array per
+column, saved as <name>_events.npz next to the data they were found in.
+"""
+from PySide6.QtCore import QThread, QMutex, QMutexLocker, Signal
+
+import queue
+import time
+import numpy as np
+import cv2
+
+DOWNSAMPLE = 2
+# Contrast histogram, bins over -HISTOGRAM_RANGE to HISTOGRAM_RANGE
+HISTOGRAM_BINS = 200
+HISTOGRAM_RANGE = 0.1
+QUEUE_DEPTH = 4
+COLUMNS = {'frame': np.int64, 'x': np.float32, 'y': np.float32, 'contrast': np.float32}
+# Detections closer than this many pixels in frames at most LINK_GAP apart are one particle
+LINK_DISTANCE = 3.0
+LINK_GAP = 2
+
+
+def bin_frame(frame, factor=DOWNSAMPLE):
+    """Mean of factor x factor blocks"""
+    height, width = frame.shape[0]//factor*factor, frame.shape[1]//factor*factor
+    blocks = frame[:height, :width].reshape(height//factor, factor, width//factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def window(frame, x, y, offsets):
+    """Pixels around every (x, y), shaped (len(x), len(offsets), len(offsets)), clamped at the edges"""
+    rows = np.clip(y[:, None, None] + offsets[None, :, None], 0, frame.shape[0] - 1)
+    columns = np.clip(x[:, None, None] + offsets[None, None, :], 0, frame.shape[1] - 1)
+    return frame[rows, columns]
+
+
+def refine(contrast, x, y, sign, radius):
+    """Extreme pixel within radius of every candidate, and its 3x3 centroid"""
+    offsets = np.arange(-radius, radius + 1)
+    size = len(offsets)
+    peak = (window(contrast, x, y, offsets)*sign[:, None, None]).reshape(len(x), size*size).argmax(axis=1)
+    x = np.clip(x + offsets[peak % size], 0, contrast.shape[1] - 1)
+    y = np.clip(y + offsets[peak // size], 0, contrast.shape[0] - 1)
+
+    around = np.arange(-1, 2)
+    weights = np.clip(window(contrast, x, y, around)*sign[:, None, None], 0, None)
+    total = weights.sum(axis=(1, 2))
+    total[total == 0] = 1
+    centroid_x = x + (weights*around[None, None, :]).sum(axis=(1, 2))/total
+    centroid_y = y + (weights*around[None, :, None]).sum(axis=(1, 2))/total
+    return centroid_x.astype(np.float32), centroid_y.astype(np.float32), contrast[y, x]
+
+
+def detect_spots(contrast: np.ndarray, sigma=1.5, threshold=0.01, factor=DOWNSAMPLE):
+    """Positions (x, y) in frame pixels and contrasts of the spots in a contrast frame.
+
+    sigma is the spot size in binned pixels. Both bright and dark spots are found.
+    """
+    binned = bin_frame(contrast, factor)
+    band = cv2.GaussianBlur(binned, (0, 0), sigma) - cv2.GaussianBlur(binned, (0, 0), 2*sigma)
+    strength = np.abs(band)
+    peaks = (strength == cv2.dilate(strength, np.ones((3, 3), np.uint8))) & (strength > threshold)
+    y, x = np.nonzero(peaks)
+    # Dark spots are minima, bright spots maxima
+    sign = np.sign(band[y, x])
+    return refine(contrast, x*factor + factor//2, y*factor + factor//2, sign, factor)
+
+
+class TrackLinker:
+    """Joins detections of one particle in nearby frames, reporting each once at its peak"""
+    def __init__(self, distance=LINK_DISTANCE, gap=LINK_GAP):
+        self.distance = distance
+        self.gap = gap
+        self.reset()
+
+    def reset(self):
+        # Per open track: last position and frame, and frame, position and contrast of its peak
+        self.tracks = {name: np.empty(0, dtype=dtype) for name, dtype in
+                       {'x': np.float32, 'y': np.float32, 'last': np.int64, **{f'peak_{name}': dtype for name, dtype in COLUMNS.items()}}.items()}
+
+    def add(self, frame, x, y, contrast):
+        """Link the detections of a frame, returns the tracks that ended as (frame, x, y, contrast)"""
+        tracks = self.tracks
+        matched = np.full(len(x), -1)
+        if len(tracks['x']) > 0 and len(x) > 0:
+            distance = np.hypot(x[:, None] - tracks['x'][None, :], y[:, None] - tracks['y'][None, :])
+            distance[:, frame - tracks['last'] > self.gap] = np.inf
+            # Greedy, closest pairs first
+            taken = np.zeros(len(tracks['x']), dtype=bool)
+            for detection, track in zip(*np.unravel_index(np.argsort(distance, axis=None), distance.shape)):
+                if distance[detection, track] > self.distance:
+                    break
+                if matched[detection] < 0 and not taken[track]:
+                    matched[detection] = track
+                    taken[track] = True
+
+        linked = matched >= 0
+        track = matched[linked]
+        tracks['x'][track] = x[linked]
+        tracks['y'][track] = y[linked]
+        tracks['last'][track] = frame
+        stronger = np.abs(contrast[linked]) > np.abs(tracks['peak_contrast'][track])
+        for name, values in (('frame', frame), ('x', x[linked]), ('y', y[linked]), ('contrast', contrast[linked])):
+            tracks[f'peak_{name}'][track[stronger]] = values if np.ndim(values) == 0 else values[stronger]
+
+        new = ~linked
+        count = np.count_nonzero(new)
+        for name, values in (('x', x[new]), ('y', y[new]), ('last', np.full(count, frame)),
+                             ('peak_frame', np.full(count, frame)), ('peak_x', x[new]), ('peak_y', y[new]),
+                             ('peak_contrast', contrast[new])):
+            tracks[name] = np.concatenate([tracks[name], values.astype(tracks[name].dtype)])
+
+        return self.take(frame - tracks['last'] > self.gap)
+
+    def take(self, ended):
+        """Remove the tracks in the mask, returning their peaks"""
+        peaks = tuple(self.tracks[f'peak_{name}'][ended] for name in COLUMNS)
+        for name in self.tracks:
+            self.tracks[name] = self.tracks[name][~ended]
+        return peaks
+
+    def peaks(self):
+        """Peaks of the tracks that are still open"""
+        return tuple(self.tracks[f'peak_{name}'] for name in COLUMNS)
+
+
+class EventTable:
+    """Columns of detected events, grown by doubling"""
+    def __init__(self, capacity=1024):
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.columns[name][:self.length]
+
+    def append(self, frame, x, y, contrast):
+        count = len(x)
+        if self.length + count > len(self.columns['x']):
+            capacity = max(2*len(self.columns['x']), self.length + count)
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.length] = column[:self.length]
+                self.columns[name] = grown
+        end = self.length + count
+        self.columns['frame'][self.length:end] = frame
+        self.columns['x'][self.length:end] = x
+        self.columns['y'][self.length:end] = y
+        self.columns['contrast'][self.length:end] = contrast
+        self.length = end
+
+    def clear(self):
+        self.length = 0
+
+    def save(self, path):
+        np.savez(path, **{name: self[name] for name in COLUMNS})
+
+
+def load_events(path) -> dict:
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def contrast_histogram(contrast):
+    counts, _ = np.histogram(contrast, HISTOGRAM_BINS, (-HISTOGRAM_RANGE, HISTOGRAM_RANGE))
+    return counts
+
+
+class EventDetector(QThread):
+    """Finds events in the live contrast frames on a worker thread.
+
+    Frame numbers count from the first frame after the table was last cleared.
+    When detection falls behind, frames are skipped and counted as dropped.
+    While suspended, e.g. when the stage moves, no frames are used, and after
+    resuming the frames that still contain the motion are skipped too.
+    """
+    updated = Signal(int, np.ndarray)
+    # Once per run of failing frames, handled on the GUI thread
+    failed = Signal(str)
+    enabled_changed = Signal(bool)
+    def __init__(self, parent=None, sigma=1.5, threshold=0.01, rate=5):
+        super().__init__(parent)
+        self.sigma = sigma
+        self.threshold = threshold
+        self.rate = rate
+        self.table = EventTable()
+        self.linker = TrackLinker()
+        self.histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        self.first_frame = None
+        self.dropped = 0
+        self.last_update = 0
+        self.failing = False
+
+        self.enabled = False
+        self.suspended = False
+        self.latest_frame = 0
+        self.resume_frame = 0
+        self.frames = queue.Queue(QUEUE_DEPTH)
+        self.mutex = QMutex()
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.enabled_changed.emit(enabled)
+
+    def suspend(self):
+        self.suspended = True
+
+    def resume(self, settle_frames=0):
+        """Use frames again, starting settle_frames after the newest one"""
+        self.resume_frame = self.latest_frame + settle_frames
+        self.suspended = False
+
+    def clear(self):
+        with QMutexLocker(self.mutex):
+            self.table.clear()
+            self.linker.reset()
+            self.histogram[:] = 0
+            self.first_frame = None
+            self.dropped = 0
+        self.updated.emit(0, self.histogram.copy())
+
+    def add_frame(self, contrast: np.ndarray, index: int):
+        self.latest_frame = index
+        if not self.enabled or self.suspended or index <= self.resume_frame:
+            return
+        try:
+            self.frames.put_nowait((contrast, index))
+        except queue.Full:
+            self.dropped += 1
+
+    def save(self, path):
+        """Write the table with the tracks that are still open, returns the number of events"""
+        with QMutexLocker(self.mutex):
+            columns = {name: np.concatenate([self.table[name], open.astype(dtype)])
+                       for (name, dtype), open in zip(COLUMNS.items(), self.linker.peaks())}
+        order = np.argsort(columns['frame'], kind='stable')
+        np.savez(path, **{name: values[order] for name, values in columns.items()})
+        return len(order)
+
+    def metadata(self) -> dict:
+        with QMutexLocker(self.mutex):
+            return {'Events.count': len(self.table) + len(self.linker.tracks['x']),
+                    'Events.sigma [px]': self.sigma*DOWNSAMPLE,
+                    'Events.threshold': self.threshold,
+                    'Events.position': f'refined on full resolution frames, {DOWNSAMPLE}x binned pre-pass',
+                    'Events.link_distance [px]': LINK_DISTANCE,
+                    'Events.link_gap [frames]': LINK_GAP,
+                    'Events.dropped_frames': self.dropped}
+
+    def stop(self):
+        self.frames.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            contrast, index = item
+            try:
+                x, y, values = detect_spots(contrast, self.sigma, self.threshold)
+                self.failing = False
+            except Exception as e:
+                if not self.failing:
+                    self.failed.emit(f'Event detection failed: {e}')
+                self.failing = True
+                continue
+            with QMutexLocker(self.mutex):
+                if self.first_frame is None:
+                    self.first_frame = index
+                ended = self.linker.add(index - self.first_frame, x, y, values)
+                self.table.append(*ended)
+                self.histogram += contrast_histogram(ended[3])
+                count = len(self.table)
+            now = time.monotonic()
+            if now - self.last_update > 1/self.rate:
+                self.last_update = now
+                self.updated.emit(count, self.histogram.copy())
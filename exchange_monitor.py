@@ -0,0 +1,83 @@
+from PySide6.QtCore import QObject, QMutex, QMutexLocker
+
+from collections import deque
+import time
+import numpy as np
+
+
+class ExchangeMonitor(QObject):
+    """Watches the live frames during a medium exchange.
+
+    Every frame is reduced to one number (mean intensity or contrast) on a
+    subsampled grid. The first frame after start is the baseline of the old
+    medium. Because of the dead volume of the tubing the old medium stays
+    flat for a while, so the exchange only counts as complete once the number
+    has departed from the baseline by more than departure (relative) and then
+    stayed within a relative tolerance for a full window of time.
+    """
+    def __init__(self, parent=None, metric='mean', window=3.0, tolerance=0.01, departure=0.03, subsample=8):
+        super().__init__(parent)
+        self.metric = metric
+        self.window = window
+        self.tolerance = tolerance
+        self.departure = departure
+        self.subsample = subsample
+
+        self.samples = deque()
+        self.started = None
+        self.baseline = None
+        # Time the signal first left the baseline
+        self.departed = None
+        self.mutex = QMutex()
+
+    def start(self):
+        with QMutexLocker(self.mutex):
+            self.samples.clear()
+            self.started = time.monotonic()
+            self.baseline = None
+            self.departed = None
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.started = None
+
+    def add_frame(self, frame: np.ndarray):
+        if self.started is None:
+            return
+        data = frame[::self.subsample, ::self.subsample]
+        if self.metric == 'contrast':
+            mean = data.mean()
+            value = data.std()/mean if mean > 0 else 0.0
+        else:
+            value = data.mean()
+
+        now = time.monotonic()
+        with QMutexLocker(self.mutex):
+            if self.baseline is None:
+                self.baseline = float(value)
+            elif self.departed is None and abs(value - self.baseline) > self.departure*max(abs(self.baseline), 1e-12):
+                self.departed = now
+            self.samples.append((now, float(value)))
+            # Only keep a little more than one window
+            while self.samples and self.samples[0][0] < now - 2*self.window:
+                self.samples.popleft()
+
+    def has_signal(self) -> bool:
+        with QMutexLocker(self.mutex):
+            return len(self.samples) > 1
+
+    def is_stable(self) -> bool:
+        with QMutexLocker(self.mutex):
+            if self.started is None or self.departed is None or len(self.samples) < 2:
+                # The new medium has not arrived yet
+                return False
+            now = time.monotonic()
+            if now - self.departed < self.window:
+                return False
+            values = np.array([value for t, value in self.samples if t >= now - self.window])
+        if len(values) < 2:
+            return False
+        reference = np.abs(values).mean()
+        if reference == 0:
+            return True
+        return (values.max() - values.min())/reference < self.tolerance
@@ -0,0 +1,112 @@
+from PySide6.QtCore import QThread, QMutex, QMutexLocker, QWaitCondition, Signal
+
+import time
+import numpy as np
+
+LEVELS = 65536
+# Values this close to the top count as saturated
+SATURATION_MARGIN = 16
+
+
+class LiveAnalyzer(QThread):
+    """Histogram and line profile of the live frames, computed off the GUI thread.
+
+    Only the newest frame is kept and at most rate frames per second are
+    analysed, frames arriving in between are skipped. The histogram of every
+    subsample-th pixel is binned with bincount and blended into a running
+    histogram, so the display changes smoothly instead of jumping from frame to
+    frame.
+    """
+    histogram_ready = Signal(np.ndarray, int, float)
+    profile_ready = Signal(np.ndarray)
+    # Once per run of failing frames, handled on the GUI thread
+    failed = Signal(str)
+    def __init__(self, parent=None, bins=512, rate=10, subsample=4, smoothing=0.5):
+        super().__init__(parent)
+        self.bins = bins
+        self.rate = rate
+        self.subsample = subsample
+        self.smoothing = smoothing
+        self.shift = int(np.log2(LEVELS//bins))
+        self.histogram = np.zeros(bins, dtype=np.float64)
+        self.line = None
+
+        self.enabled = False
+        self.running = True
+        self.frame = None
+        self.last_time = 0
+        self.failing = False
+        self.mutex = QMutex()
+        self.new_frame = QWaitCondition()
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if enabled:
+            # The worker may still be blending in a frame
+            with QMutexLocker(self.mutex):
+                self.histogram[:] = 0
+
+    def set_line(self, line):
+        """Profile from (x0, y0) to (x1, y1) in frame pixels, None for no profile"""
+        with QMutexLocker(self.mutex):
+            self.line = None if line is None else np.asarray(line, dtype=np.float64)
+
+    def add_frame(self, frame: np.ndarray):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self.last_time < 1/self.rate:
+            return
+        self.last_time = now
+        with QMutexLocker(self.mutex):
+            self.frame = frame
+            self.new_frame.wakeAll()
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.running = False
+            self.new_frame.wakeAll()
+        self.wait()
+
+    def run(self):
+        while True:
+            with QMutexLocker(self.mutex):
+                while self.running and self.frame is None:
+                    self.new_frame.wait(self.mutex)
+                if not self.running:
+                    break
+                frame, self.frame = self.frame, None
+                line = self.line
+            try:
+                if frame.ndim == 3:
+                    frame = frame[..., 0]
+                self.update_histogram(frame)
+                if line is not None:
+                    self.profile_ready.emit(self.profile(frame, line))
+                self.failing = False
+            except Exception as e:
+                if not self.failing:
+                    self.failed.emit(f'Live analysis failed: {e}')
+                self.failing = True
+
+    def update_histogram(self, frame):
+        data = frame[::self.subsample, ::self.subsample].ravel()
+        if data.dtype == np.uint8:
+            data = data.astype(np.uint16) << 8
+        counts = np.bincount(data >> self.shift, minlength=self.bins)
+        with QMutexLocker(self.mutex):
+            self.histogram *= self.smoothing
+            self.histogram += (1 - self.smoothing)*counts
+            # A copy, the buffer keeps changing while the display draws
+            histogram = self.histogram.copy()
+        maximum = int(data.max())
+        saturated = np.count_nonzero(data >= LEVELS - SATURATION_MARGIN)/len(data)
+        self.histogram_ready.emit(histogram, maximum, saturated)
+
+    def profile(self, frame, line):
+        """Values under the line, one sample per pixel of length"""
+        x0, y0, x1, y1 = line
+        count = int(np.hypot(x1 - x0, y1 - y0)) + 1
+        x = np.clip(np.round(np.linspace(x0, x1, count)).astype(np.intp), 0, frame.shape[1] - 1)
+        y = np.clip(np.round(np.linspace(y0, y1, count)).astype(np.intp), 0, frame.shape[0] - 1)
+        return frame[y, x]
@@ -12,41 +12,64 @@ import yaml
 
 from pathlib import Path
 from datetime import datetime
-import shutil
 
 import logging
+from contextlib import contextmanager
 
 import processing as pc
+from background_grid import background_grid
+from exchange_monitor import ExchangeMonitor
+from sweep_plan import SweepPlan
+from acquisition_journal import AcquisitionJournal
+from dataset_writer import DatasetWriter, QUEUE_DEPTH
+from raw_archive import ArchiveWriter, default_codec
+from ome_export import OmeTiffExporter
+from video_playback import VideoRecorder, VideoSource, RAW_SUFFIX, move_file
+from tone_mapping import ToneMapper
+from ratiometric import RatiometricProcessor
+from event_detection import EventDetector, EventTable, detect_spots
+from acquisition_catalog import AcquisitionCatalog, DEFAULT_DATABASE
+from cancellation import CancelToken, AcquisitionCancelled
+from acquisition_progress import AcquisitionProgress
+from acquisition_estimate import estimate_acquisition, ARCHIVE_RATIO, capture_time, available_memory, free_disk, format_bytes, format_duration
 
 from controllers import StageController, PumpController, LaserController, CameraController
 from widgets import PropertiesDialog
 
-class PersistentWorkerThread(QThread):
-    def __init__(self, func):
-        super().__init__()
-        self.func = func
+class FrameLost(Exception):
+    """A hardware triggered frame did not arrive and cannot be triggered again"""
 
 
 class acquisitionWorkerThread(QThread):
         done = Signal()
+        progress = Signal(str, str)
         def __init__(self, parent, func, *args):
             super().__init__(parent)
             self.args = args
-            self.photos = []
             self.func = func
             self.parent = parent
-            
-            parent.cancel_acquisition.connect(self.terminate)
+            self.token = CancelToken()
+            # None when the function returned, otherwise why it did not
+            self.stop_reason = None
 
         def run(self):
-            self.func(*self.args)
+            try:
+                self.func(*self.args)
+            except AcquisitionCancelled:
+                logging.info('Acquisition cancelled')
+                self.stop_reason = 'cancelled'
+            except Exception as e:
+                # Reported by the controller on the GUI thread
+                logging.debug(f'Acquisition failed: {e}')
+                self.stop_reason = f'failed: {e}'
             self.done.emit()
 
 
 class MainController(QObject):
     update_controls = Signal()
     update_background = Signal(np.ndarray)
-    cancel_acquisition = Signal()
+    acquisition_estimate = Signal(str)
+    acquisition_progress = Signal(str, str)
     def __init__(self, ):
         super().__init__()
 
@@ -59,17 +82,53 @@ class MainController(QObject):
 
         # 99th percentile of exposure
         self.exposure = 0
+
+        # Medium exchange detection
+        self.exchange_monitor = ExchangeMonitor(self)
+        self.camera.new_frame.connect(self.exchange_monitor.add_frame)
+
+        # Live ratiometric contrast, shown and recorded instead of the raw frames when enabled
+        self.ratiometric = RatiometricProcessor(self)
+        self.camera.new_frame.connect(self.ratiometric.add_frame)
+        self.ratiometric.failed.connect(self.report_error)
+        self.ratiometric.start()
+        self.event_detector = EventDetector(self)
+        self.ratiometric.contrast.connect(self.event_detector.add_frame)
+        self.event_detector.enabled_changed.connect(self.ratiometric.set_contrast_enabled)
+        self.event_detector.failed.connect(self.report_error)
+        self.event_detector.start()
+        self.exchange_volume = 60 # Used when there are no frames to judge by
+        self.exchange_min_volume = 20
+        self.exchange_max_volume = 120
+        self.exchange_step = 10
+        # Volume used per medium index
+        self.exchange_volumes = {}
+
         # Routes
         self.pump.changedState.connect(self.update_controls)
+        self.pump.program_failed.connect(self.report_error)
         self.laser.changedState.connect(self.update_controls)
 
 
         self.shot_count = 10 # Shoot 10 images to average over
-
-        # Storage for acquisition parameters
-        self.media: list = []
-        self.z_positions: NDArray = np.array([])
-        self.wavelens: NDArray = np.array([])
+        # Stage offsets in micron of the background photos around the anchor, in visiting order
+        self.set_background_grid(3, 'quadrant', 4)
+
+        # Storage for acquisition state
+        self.plan = SweepPlan([])
+        self.progress = AcquisitionProgress()
+        self.point_indices = []
+        self.completed_points = set()
+        self.sweep_index = {}
+        self.sweep_origins = {}
+        self.journal = None
+        self.cancel_token = CancelToken()
+        # Data is written to its final files, chosen before the acquisition starts
+        self.destination = None
+        self.writer = None
+        self.export_ome_tiff = False
+        self.exporter = None
+        self.catalog = None
 
         self.got_image_mutex = QMutex()
         self.got_image = QWaitCondition()
@@ -81,6 +140,21 @@ class MainController(QObject):
         self.settings = QSettings('Casper', 'Monitor')
 
         self.data_directory = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.PicturesLocation)
+        self.video_directory = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.MoviesLocation)
+        self.recorder = None
+        self.recording_path = None
+        self.recording_signal = None
+        self.recording_events = False
+        self.acquisition_events = False
+        self.acquisition_started = None
+        # Shared with the display, 8 bit exports look like the live view
+        self.tone_mapper = ToneMapper()
+
+        # Measured seconds per setpoint change, used to put cheap axes innermost
+        self.axis_costs = {'media': 60.0, 'defocus': 1.0, 'wavelen': 0.5}
+        stored_costs = self.settings.value('axis_costs', {})
+        if isinstance(stored_costs, dict):
+            self.axis_costs.update({axis: float(cost) for axis, cost in stored_costs.items()})
 
 
         if self.settings.contains('magnification') and self.settings.contains('pxsize'):
@@ -92,6 +166,13 @@ class MainController(QObject):
             self.settings = QSettings('Casper', 'Monitor')
             self.set_setup_parameters()
 
+    def set_background_grid(self, number, pattern, spacing):
+        self.background_settings = {'Number': int(number), 'Pattern': pattern, 'Spacing': float(spacing)}
+        self.background_offsets = background_grid(number, pattern, spacing)
+
+    def frames_per_point(self):
+        return self.shot_count + len(self.background_offsets)
+
     def set_setup_parameters(self):
         dialog = PropertiesDialog(self.magnification, self.pxsize)
         if dialog.exec():
@@ -100,6 +181,8 @@ class MainController(QObject):
             self.settings.setValue('pxsize', self.pxsize)
     
     def cleanup(self):
+        self.ratiometric.stop()
+        self.event_detector.stop()
         self.camera.cleanup()
         self.pump.cleanup()
         self.laser.cleanup()
@@ -109,78 +192,346 @@ class MainController(QObject):
     # =====================================================
 
 
-    def take_z_sweep(self, actions):
-        """Move to different defocus then perform next action"""
-        z_zero = self.stage.get_z_position()
-        for i, z in enumerate(self.z_positions*10/1.4):
-            # Set position
-            pos = z_zero + z
-            self.z_position = i
-            self.stage.set_z_position(pos)
-            time.sleep(1)
-            # Next action
-            self.action(actions)
-
-        # Reset
-        self.stage.set_z_position(z_zero)
-
-
-    def take_laser_sweep(self, actions):
-        """Move to different wavelen then perform next action"""
-        init_wavelen = self.laser.wavelen
-        self.laser.set_wavelen(self.wavelens[0])
-        time.sleep(2)
-        self.laser_data_raw = []
-        for i, wavelen in enumerate(self.wavelens):
-            self.laser.set_wavelen(wavelen)
-            time.sleep(0.2)
+    def set_axis(self, step):
+        """Move the device of a sweep axis to a setpoint of the plan"""
+        start = time.monotonic()
+        previous = self.sweep_index.get(step.axis)
+        first = step.axis not in self.sweep_origins
+
+        if step.axis == 'media':
+            if first:
+                self.sweep_origins['media'] = None
+                self.pump.wait_till_ready()
+            with self.progress.phase('move'):
+                volume = self.exchange_medium(int(step.value))
+            self.exchange_volumes[step.index] = volume
+            if self.journal is not None:
+                self.journal.record_exchange(step.index, volume)
+            # Auto adjust exposure
+            with self.progress.phase('expose'):
+                self.auto_expose()
+
+        elif step.axis == 'defocus':
+            if first:
+                self.set_sweep_origin('defocus', self.stage.get_z_position())
+            with self.progress.phase('move'):
+                self.stage.set_z_position(self.sweep_origins['defocus'] + step.value*10/1.4)
+            self.settle(1)
+
+        elif step.axis == 'wavelen':
+            if first:
+                self.set_sweep_origin('wavelen', self.laser.wavelen)
+            with self.progress.phase('move'):
+                self.laser.set_wavelen(step.value)
+            # Jumps over more than one step need time to settle
+            if previous is None or abs(step.index - previous) > 1:
+                self.settle(2)
+            else:
+                self.settle(0.2)
             # Auto exposure
-            self.auto_expose()
-            time.sleep(0.2)
-            # Take next action
-            self.action(actions)
-        
-        # Reset laser
-        self.laser.set_wavelen(init_wavelen)
-    
-
-    def take_media_sweep(self, actions):
-        """Move to medium and then perform next action"""
-
-        input = self.media
+            with self.progress.phase('expose'):
+                self.auto_expose()
+            self.settle(0.2)
 
+        else:
+            raise ValueError(f'Unknown sweep axis {step.axis}')
+
+        self.sweep_index[step.axis] = step.index
+        self.progress.moved(step.axis, step.index)
+        self.update_axis_cost(step.axis, time.monotonic() - start)
+
+    def set_sweep_origin(self, axis, value):
+        """Remember where a device was before it was first swept"""
+        self.sweep_origins[axis] = value
+        if self.journal is not None:
+            self.journal.record_origin(axis, value)
+
+    @contextmanager
+    def stage_moving(self):
+        """No event detection while the stage moves, nor on the ratio frames that still show the move"""
+        self.event_detector.suspend()
+        try:
+            yield
+        finally:
+            self.event_detector.resume(2*self.ratiometric.n)
+
+    def settle(self, seconds):
+        with self.progress.phase('settle'):
+            self.cancel_token.sleep(seconds)
+
+    def report_progress(self):
+        costs = self.acquisition_costs()
+        self.acquisition_worker.progress.emit(self.progress.text(costs), self.progress.tooltip())
+
+    def update_axis_cost(self, axis, duration):
+        """Running estimate of the time a setpoint change of an axis takes"""
+        if axis in self.axis_costs:
+            self.axis_costs[axis] = 0.8*self.axis_costs[axis] + 0.2*duration
+        else:
+            self.axis_costs[axis] = duration
+
+    def restore_sweep_origins(self):
+        """Move swept devices back to where they were before the acquisition"""
+        if 'defocus' in self.sweep_origins:
+            self.stage.set_z_position(self.sweep_origins['defocus'])
+        if 'wavelen' in self.sweep_origins:
+            self.laser.set_wavelen(self.sweep_origins['wavelen'])
+        self.sweep_origins = {}
+
+    def sequenced_run(self, plan, start):
+        """Consecutive defocus setpoints each followed by one capture, starting at start"""
+        steps = plan.steps
+        run = []
+        i = start
+        while i + 1 < len(steps) and steps[i].kind == 'set' and steps[i].axis == 'defocus' and steps[i+1].kind == 'capture':
+            run.append((steps[i], steps[i+1]))
+            i += 2
+        return run
+
+    def apply_pending(self, plan, pending):
+        """Move axes whose setpoints were postponed, outermost first"""
+        for name in plan.order:
+            if name in pending:
+                self.set_axis(pending.pop(name))
+
+    def run_plan(self, plan):
+        """Execute the steps of a sweep plan.
+
+        Setpoints are only applied right before the next capture that still has to
+        be taken, so points completed in an earlier run are skipped without moving.
+        """
+        pending = {}
+        try:
+            self.run_steps(plan, pending)
+        except AcquisitionCancelled:
+            # Keep what was completed as a valid, truncated dataset
+            self.keep_complete_points()
+            self.store_points()
+            raise
+        finally:
+            try:
+                # Return the hardware to where it was
+                self.restore_sweep_origins()
+            finally:
+                # Flush what was taken even when the hardware fails
+                self.writer.finish()
+
+    def run_steps(self, plan, pending):
+        steps = plan.steps
+        i = 0
+        # Steps before this index are taken in software after a sequence lost a frame
+        software_until = 0
+        while i < len(steps):
+            self.cancel_token.check()
+            step = steps[i]
+            if step.kind == 'set':
+                # Only the innermost axis has a setpoint before every capture
+                if step.axis == 'defocus' and plan.order[-1] == 'defocus' and i >= software_until:
+                    run = self.sequenced_run(plan, i)
+                    todo = [(s, c) for s, c in run if c.point not in self.completed_points]
+                    if len(todo) > 1 and self.stage.can_sequence_z(len(todo)*self.shot_count):
+                        pending.pop('defocus', None)
+                        self.apply_pending(plan, pending)
+                        if self.take_z_stack_sequenced(plan, todo):
+                            with self.progress.phase('save'):
+                                self.store_points()
+                            self.report_progress()
+                            i += 2*len(run)
+                            continue
+                        # Lost a frame, step through this stack in software
+                        software_until = i + 2*len(run)
+                pending[step.axis] = step
+            elif step.kind == 'capture':
+                if step.point in self.completed_points:
+                    i += 1
+                    continue
+                self.apply_pending(plan, pending)
+                start = time.monotonic()
+                self.point_indices.append(step.point)
+                self.take_sequence_avg()
+                self.update_axis_cost('capture', time.monotonic() - start)
+                with self.progress.phase('save'):
+                    self.store_points()
+                self.progress.captured()
+                self.report_progress()
+            elif step.kind == 'flush':
+                with self.progress.phase('save'):
+                    self.store_medium_data(step.index)
+            i += 1
+
+    def keep_complete_points(self):
+        """Drop the frames of a point that was interrupted halfway"""
+        complete = len(self.photos)//self.frames_per_point()
+        del self.photos[complete*self.frames_per_point():]
+        del self.point_indices[complete:]
+
+    def take_z_stack_sequenced(self, plan, run):
+        """Grid photo at every z of a run, with the focus device stepping on camera triggers.
+
+        The stage advances one entry per exposure, so each grid position gets its own
+        sequence with every z repeated once per shot. Afterwards the frames are
+        reordered to the layout of the software sweep (z, shot).
+
+        Returns False without keeping any frames when a frame was lost; triggering
+        again would also advance the sequence and shift every later plane.
+        """
+        logging.debug(f'Hardware sequenced z stack of {len(run)} planes')
+        if 'defocus' not in self.sweep_origins:
+            self.set_sweep_origin('defocus', self.stage.get_z_position())
+        positions = np.array([self.sweep_origins['defocus'] + step.value*10/1.4 for step, _ in run])
+        anchor = np.array(self.stage.get_xy_position())
+        offsets = [np.zeros(2), *self.background_offsets]
+        counts = [self.shot_count] + [1]*len(self.background_offsets)
+
+        start = len(self.photos)
+        groups = []
+        self.camera.set_trigger_mode(True)
+        try:
+            with self.stage_moving():
+                for i, (offset, count) in enumerate(zip(offsets, counts)):
+                    with self.progress.phase('move'):
+                        self.stage.set_xy_position(anchor + offset)
+                    if i > 0:
+                        # Same settle as the background photos of the software path
+                        self.settle(0.2)
+                    sequence = np.repeat(positions, count)
+                    self.stage.start_z_sequence(sequence)
+                    first = len(self.photos)
+                    try:
+                        with self.progress.phase('capture'):
+                            for _ in sequence:
+                                self.take_triggered(sequenced=True)
+                    finally:
+                        self.stage.stop_z_sequence()
+                    groups.append((self.photos[first:], count))
+        except AcquisitionCancelled:
+            # A partial stack cannot be sorted into points
+            del self.photos[start:]
+            raise
+        except FrameLost:
+            # Not a warning, those open a message box and this runs on the acquisition thread
+            logging.info('Lost a frame of a hardware sequenced z stack, stepping z in software instead')
+            del self.photos[start:]
+            return False
+        finally:
+            self.camera.set_trigger_mode(False)
+            self.stage.set_xy_position(anchor)
+
+        ordered = []
+        for i in range(len(positions)):
+            for frames, count in groups:
+                ordered.extend(frames[i*count:(i+1)*count])
+        self.photos[start:] = ordered
+
+        for step, capture in run:
+            self.point_indices.append(capture.point)
+            self.progress.moved('defocus', step.index)
+        self.progress.captured(len(run))
+        self.sweep_index['defocus'] = run[-1][0].index
+        return True
+
+
+    def exchange_medium(self, medium) -> int:
+        """Flush medium through the flowcell until the image has settled"""
+        self.pump.pickup(medium, self.exchange_max_volume)
         self.pump.wait_till_ready()
-        for medium in input:
-            self.pump.pickup(medium, 60)
-            self.pump.wait_till_ready()
-            self.pump.dispense(self.pump.flowcell, 60)
-            self.pump.wait_till_ready()
 
-            # Auto adjust exposure
-            self.auto_expose()
-            self.action(actions)
-            self.store_medium_data()
-
-    def store_medium_data(self):
-        data = np.squeeze(self.photos)
-        shape = np.shape(data)
-        images = data.reshape(*self.shape, self.shot_count+3, *shape[1:])
-        folder = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.PicturesLocation)
-        filepath = Path(folder) / datetime.now().strftime("%Y%m%d_%H%M%S.npy")
-        np.save(filepath, images)
+        self.exchange_monitor.start()
+        dispensed = 0
+        try:
+            while dispensed < self.exchange_max_volume:
+                self.cancel_token.check()
+                self.pump.dispense(self.pump.flowcell, self.exchange_step)
+                self.pump.wait_till_ready()
+                dispensed += self.exchange_step
+
+                if dispensed < self.exchange_min_volume:
+                    continue
+                if self.exchange_monitor.is_stable():
+                    break
+                if dispensed >= self.exchange_volume and not self.exchange_monitor.has_signal():
+                    break
+            logging.debug(f'Exchanged medium {medium} with {dispensed}uL')
+        finally:
+            self.exchange_monitor.stop()
+            # Discard what is left in the syringe, also when cancelled
+            remaining = self.exchange_max_volume - dispensed
+            if remaining > 0:
+                self.pump.dispense(self.pump.waste, remaining)
+                self.pump.wait_till_ready()
+        return dispensed
+
+    def store_points(self):
+        """Hand the captured points to the writer, which puts them at their index on disk"""
+        if len(self.photos) == 0:
+            return
+        frames = np.asarray(self.photos)
+        if frames.ndim == 4:
+            # Mono frames have a channel axis
+            frames = frames[..., 0]
+        points = frames.reshape(-1, self.frames_per_point(), *frames.shape[1:])
+        for point, data in zip(self.point_indices, points):
+            self.writer.write(self.chunk_of(point), point, data)
         self.photos = []
-        self.temp_files.append(filepath)
+        self.point_indices = []
+
+    def chunk_of(self, point):
+        """Index of the split axis a point belongs to, None when the data is not split"""
+        if self.plan.split_axis is None:
+            return None
+        return point[self.plan.names.index(self.plan.split_axis)]
+
+    def store_medium_data(self, chunk):
+        self.store_points()
+        self.writer.close_chunk(chunk)
 
     # Image taking
 
+    def wait_for_image(self, retry):
+        """Wait until store_image got a frame, retrying every second and stopping on cancel"""
+        waited = 0
+        while not self.got_image.wait(self.got_image_mutex, 100):
+            waited += 100
+            if self.cancel_token.cancelled:
+                self.stop_waiting_for_image()
+                raise AcquisitionCancelled()
+            if waited % 1000 == 0:
+                try:
+                    retry()
+                except FrameLost:
+                    self.stop_waiting_for_image()
+                    raise
+        self.got_image_mutex.unlock()
+
+    def stop_waiting_for_image(self):
+        self.got_image_mutex.unlock()
+        try:
+            self.camera.new_frame.disconnect(self.store_image)
+        except (RuntimeError, TypeError):
+            pass
+
     def take_single(self):
         """Take a single photo and store it"""
         self.camera.new_frame.connect(self.store_image, Qt.ConnectionType.SingleShotConnection)
         self.got_image_mutex.lock()
         # Retry
-        while not self.got_image.wait(self.got_image_mutex, 1000):
+        self.wait_for_image(lambda: self.camera.new_frame.connect(self.store_image, Qt.ConnectionType.SingleShotConnection))
+
+    def take_triggered(self, sequenced=False):
+        """Software trigger a single photo and store it.
+
+        In a hardware sequence a missing frame raises FrameLost instead of triggering again.
+        """
+        def retry():
+            if sequenced:
+                raise FrameLost()
             self.camera.new_frame.connect(self.store_image, Qt.ConnectionType.SingleShotConnection)
-        self.got_image_mutex.unlock()
+            self.camera.trigger()
+        self.camera.new_frame.connect(self.store_image, Qt.ConnectionType.SingleShotConnection)
+        self.got_image_mutex.lock()
+        self.camera.trigger()
+        # Retry
+        self.wait_for_image(retry)
 
     def take_single_avg(self):
         """Take a single averaged photo and store it"""
@@ -190,37 +541,42 @@ class MainController(QObject):
 
     def take_sequence(self):
         """Take a grid photo and store it"""
-        distance = 4
-        positions = np.array([[1,0], [1,1], [0,1]])*distance
+        positions = self.background_offsets
         anchor = np.array(self.stage.get_xy_position())
 
-        self.take_single()
-            
-        for i, position in enumerate(positions):
-            pos = position + anchor
-            self.stage.set_xy_position(pos)
-            time.sleep(0.2)
+        with self.stage_moving():
             self.take_single()
-        
-        # Return to base
-        self.stage.set_xy_position(anchor)
+
+            for i, position in enumerate(positions):
+                pos = position + anchor
+                self.stage.set_xy_position(pos)
+                time.sleep(0.2)
+                self.take_single()
+
+            # Return to base
+            self.stage.set_xy_position(anchor)
 
     def take_sequence_avg(self):
         """Take a grid photo and store it"""
-        distance = 4
-        positions = np.array([[1,0], [1,1], [0,1]])*distance
+        positions = self.background_offsets
         anchor = np.array(self.stage.get_xy_position())
 
-        self.take_single_avg()
-            
-        for i, position in enumerate(positions):
-            pos = position + anchor
-            self.stage.set_xy_position(pos)
-            time.sleep(0.2)
-            self.take_single()
-        
-        # Return to base
-        self.stage.set_xy_position(anchor)
+        with self.stage_moving():
+            try:
+                with self.progress.phase('capture'):
+                    self.take_single_avg()
+
+                for i, position in enumerate(positions):
+                    pos = position + anchor
+                    with self.progress.phase('move'):
+                        self.stage.set_xy_position(pos)
+                    self.settle(0.2)
+                    with self.progress.phase('capture'):
+                        self.take_single()
+            finally:
+                # Return to base
+                with self.progress.phase('move'):
+                    self.stage.set_xy_position(anchor)
 
     
     
@@ -233,20 +589,81 @@ class MainController(QObject):
     # ===============   acquisitions   =====================
     # =====================================================
     
-    def action(self, actions):
-        """Define action chains"""
-        if len(actions) == 1:
-            # Final action
-            return actions[0]()
-        else:
-            return actions[0](actions[1:])
-    
-
-    def start_acquisition(self, finish, *actions):
-        actionsfunc = lambda: self.action(actions)
+    def acquisition_costs(self):
+        """Seconds per setpoint change of each axis and per grid photo"""
+        costs = dict(self.axis_costs)
+        if 'capture' not in costs:
+            fps = self.camera.get_fps() if self.camera.device_property_map is not None else 0
+            costs['capture'] = capture_time(self.shot_count, len(self.background_offsets), fps)
+        return costs
+
+    def check_resources(self, plan: SweepPlan, destination: Path, completed=0, archive=None, export=False):
+        """Estimate the acquisition and refuse it when it cannot fit on disk or in memory"""
+        frame_shape = (getattr(self.camera, 'roi_height', 0), getattr(self.camera, 'roi_width', 0))
+        estimate = estimate_acquisition(plan, frame_shape, 2, self.frames_per_point(), self.acquisition_costs(), QUEUE_DEPTH,
+                                        completed, ARCHIVE_RATIO if archive is not None else 1.0, export)
+        message = (f'Estimated {format_duration(estimate.duration)} for {estimate.frames} frames, '
+                   f'{format_bytes(estimate.disk_bytes)} on disk, {format_bytes(estimate.peak_ram)} memory')
+        logging.info(message)
+        self.acquisition_estimate.emit(message)
+
+        free = free_disk(destination.parent)
+        if estimate.disk_bytes > free:
+            raise RuntimeError(f'Not enough disk space: acquisition needs {format_bytes(estimate.disk_bytes)}, {format_bytes(free)} free')
+
+        memory = available_memory()
+        if memory is not None and estimate.peak_ram > 0.8*memory:
+            raise RuntimeError(f'Not enough memory: acquisition needs {format_bytes(estimate.peak_ram)}, {format_bytes(memory)} available')
+        return estimate
+
+    def start_acquisition(self, finish, plan: SweepPlan, destination: Path, journal=None, archive=None):
+        """Run a plan on the acquisition thread.
+
+        archive holds the codec and filter when the raw data is stored compressed.
+        """
+        logging.debug(f'Sweep plan with axes {plan.order}: {plan.number_of_points} points, moves {plan.moves()}')
+        try:
+            completed = len(journal.completed) if journal is not None else 0
+            # Only sweeps are exported when they finish
+            export = self.export_ome_tiff and finish == self.finish_sweeps
+            self.check_resources(plan, destination, completed, archive, export)
+        except RuntimeError:
+            if journal is not None and len(journal.completed) == 0:
+                journal.discard()
+            raise
+        self.plan = plan
+        self.progress = AcquisitionProgress(plan)
         # Clear photo buffer
         self.photos = []
-        self.acquisition_worker = acquisitionWorkerThread(self, actionsfunc)
+        # Events are only found in ratiometric frames, saved with the acquisition they were found during
+        self.acquisition_events = self.ratiometric.enabled and self.event_detector.enabled
+        if self.acquisition_events:
+            self.event_detector.clear()
+        self.point_indices = []
+        self.sweep_index = {}
+        self.journal = journal
+        # Resumed runs keep the date they were first started
+        self.acquisition_started = datetime.now().isoformat()
+        if journal is not None:
+            self.acquisition_started = journal.state.get('started', self.acquisition_started)
+            self.completed_points = set(journal.completed)
+            self.sweep_origins = dict(journal.origins)
+            self.exchange_volumes = dict(journal.exchange_volumes)
+            self.progress.captured(len(self.completed_points))
+        else:
+            self.completed_points = set()
+            self.sweep_origins = {}
+            self.exchange_volumes = {}
+        self.destination = destination
+        if archive is not None:
+            self.writer = ArchiveWriter(destination, plan, journal, self, archive['codec'], archive['filter'])
+        else:
+            self.writer = DatasetWriter(destination, plan, journal, self)
+        self.writer.failed.connect(self.report_error)
+        self.writer.start()
+        self.acquisition_worker = acquisitionWorkerThread(self, self.run_plan, plan)
+        self.cancel_token = self.acquisition_worker.token
+        self.acquisition_worker.progress.connect(self.acquisition_progress)
         self.acquisition_worker.done.connect(finish)
         self.acquisition_worker.done.connect(self.finish_acquisition)
 
@@ -257,84 +674,180 @@ class MainController(QObject):
 
         self.acquisition_worker.start()
 
+    def cancel(self):
+        """Ask the running acquisition to stop at the next step or wait"""
+        if self.acquiring:
+            logging.debug('Cancelling acquisition')
+            self.cancel_token.cancel()
+
+    def acquired_points(self):
+        """Indices of the points that are on disk, from earlier runs and this one"""
+        points = set(self.completed_points)
+        if self.writer is not None:
+            points |= self.writer.points
+        return points
+
+    def has_data(self) -> bool:
+        return len(self.completed_points) > 0 or (self.writer is not None and self.writer.written > 0)
+
+    def ask_destination(self, caption, name_filter):
+        """Ask where the data of an acquisition goes before it starts, None when cancelled"""
+        dialog = QFileDialog(caption=caption)
+        dialog.setNameFilter(name_filter)
+        dialog.setFileMode(QFileDialog.FileMode.AnyFile)
+        dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
+        dialog.setDirectory(self.data_directory)
+        destination = None
+        if dialog.exec():
+            filepath = dialog.selectedFiles()[0]
+            destination = Path(os.path.splitext(filepath)[0])
+        self.data_directory = dialog.directory()
+        return destination
+
+    def write_metadata(self, events=None):
+        """Metadata and, when given or detected live, the events of the acquisition"""
+        metadata = self.generate_metadata()
+        if events is not None:
+            events.save(f'{self.destination}_events.npz')
+            metadata['Events.count'] = len(events)
+        elif self.acquisition_events:
+            self.event_detector.save(f'{self.destination}_events.npz')
+        with open(f'{self.destination}.yaml', 'w') as file:
+            yaml.dump(metadata, file)
+        self.add_to_catalog()
+
+    def add_to_catalog(self):
+        try:
+            if self.catalog is None:
+                self.catalog = AcquisitionCatalog(DEFAULT_DATABASE)
+            self.catalog.add(self.destination)
+        except Exception as e:
+            logging.info(f'Could not add {self.destination} to the catalog: {e}')
+
     def finish_acquisition(self):
         logging.debug('Finished acquisition')
-        self.cancel_acquisition.emit()
         self.acquiring_mutex.lock()
         self.acquiring = False
         self.acquiring_mutex.unlock()
-        self.media = []
+        self.settings.setValue('axis_costs', self.axis_costs)
+        self.acquisition_progress.emit('', '')
         self.update_controls.emit()
+        reason = self.acquisition_worker.stop_reason
+        if reason is not None and reason.startswith('failed'):
+            self.report_error(f'Acquisition {reason}')
+
+    def report_error(self, message):
+        """Show an error from a worker thread, message boxes can only be opened here"""
+        logging.error(message)
     
 
     # =====================================================
     # =======   Complete measurement protocols   ==========
     # =====================================================
 
-    def acquire(self, params: dict):
-        logging.debug(f'starting acquisition with {params}')
-        """Accepts and parses requests"""
-        self.shape = []
-        self.temp_files = []
-        actions = []
+    def compile_plan(self, params: dict) -> SweepPlan:
+        """Turn acquisition parameters into a sweep plan"""
+        axes = []
         if 'media' in params.keys():
             if not self.pump.open:
                 raise RuntimeError('Pump is not open, cannot sweep media')
-            self.media = params['media']
-            actions.append(self.take_media_sweep)
+            axes.append(('media', params['media']))
         if 'defocus' in params.keys():
             if self.stage.z_stage is None:
                 raise RuntimeError('Z stage is not open, cannot sweep defocus')
-            self.shape.append(params['defocus'][2])
-            self.z_positions = np.linspace(*params['defocus'])
-            actions.append(self.take_z_sweep)
+            axes.append(('defocus', np.linspace(*params['defocus'])))
         if 'wavelen' in params.keys():
             if not self.laser.open:
                 raise RuntimeError('Laser is not open, cannot sweep media')
-            
-            start, stop, num = params['wavelen']
-            self.shape.append(num)
-
             # Sweep from long to short bc laser is more powerful with long
             # This helps with auto exposure bc overexposure is unlikely this way
-            self.wavelens = np.linspace(start, stop, num)
-            actions.append(self.take_laser_sweep)
-        
-        
-        actions.append(self.take_sequence_avg)
-        
+            axes.append(('wavelen', np.linspace(*params['wavelen'])))
 
-        self.start_acquisition(self.finish_sweeps, *actions)
+        # One file per medium keeps the memory use bounded
+        plan = SweepPlan(axes, serpentine=params.get('serpentine', False), split_axis='media')
+        if params.get('optimize_order', False):
+            plan = plan.reordered(self.axis_costs)
+        return plan
+
+    def acquire(self, params: dict):
+        """Accepts and parses requests"""
+        logging.debug(f'starting acquisition with {params}')
+        if 'background' in params.keys():
+            self.set_background_grid(*params['background'])
+        plan = self.compile_plan(params)
+        archive = None
+        if params.get('archive') is not None:
+            archive = {'codec': default_codec(), 'filter': params['archive']}
+        name_filter = 'Compressed Raw Data (*.rawz)' if archive is not None else 'Raw Data (*.npy)'
+        destination = self.ask_destination('Save Acquisition', name_filter)
+        if destination is None:
+            return
+        self.export_ome_tiff = params.get('ome_tiff', False)
+        state = {'shot_count': self.shot_count, 'background': self.background_settings,
+                 'destination': str(destination), 'archive': archive, 'ome_tiff': self.export_ome_tiff}
+        journal = AcquisitionJournal.create(self.journal_directory(), plan, state)
+        self.start_acquisition(self.finish_sweeps, plan, destination, journal, archive)
+
+    def journal_directory(self):
+        appdata = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.AppDataLocation)
+        return Path(appdata) / 'acquisitions'
+
+    def unfinished_acquisitions(self):
+        return AcquisitionJournal.unfinished(self.journal_directory())
+
+    def resume_acquisition(self, directory):
+        """Continue an interrupted acquisition from its first incomplete point"""
+        journal = AcquisitionJournal(directory)
+        logging.info(f'Resuming acquisition {directory.name}: {len(journal.completed)} points done')
+        self.shot_count = journal.state['shot_count']
+        background = journal.state['background']
+        self.set_background_grid(background['Number'], background['Pattern'], background['Spacing'])
+        self.export_ome_tiff = journal.state.get('ome_tiff', False)
+        destination = journal.destination
+        if destination is None:
+            name_filter = 'Compressed Raw Data (*.rawz)' if journal.state.get('archive') is not None else 'Raw Data (*.npy)'
+            destination = self.ask_destination('Save Acquisition', name_filter)
+            if destination is None:
+                return
+        self.start_acquisition(self.finish_sweeps, journal.plan(), destination, journal, journal.state.get('archive'))
     
     def finish_sweeps(self):
-        dialog = QFileDialog(caption='Save Acquisition')
-        dialog.setNameFilter('Raw Data (*.npy)')
-        dialog.setFileMode(QFileDialog.FileMode.AnyFile)
-        dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
-        dialog.setDirectory(self.data_directory)
-        if dialog.exec():
-            filepath = dialog.selectedFiles()[0]
-            filepath = os.path.splitext(filepath)[0]
-            
-            if len(self.temp_files) > 0:
-                # Saved in files
-                for i, file in enumerate(self.temp_files):
-                    shutil.move(file, f'{filepath}_{i}.npy')
-            else:
-                data = np.squeeze(self.photos)
-                shape = np.shape(data)
-                images = data.reshape(*self.shape, self.shot_count+3, *shape[1:])
-                np.save(filepath + '.npy', images)
-                if len(self.shape) == 1:
-                    tiff.imwrite(filepath + '.tif', images[:,0])
-
-            metadata = self.generate_metadata()
-            with open(filepath+'.yaml', 'w') as file:
-                yaml.dump(metadata, file)
-        self.data_directory = dialog.directory()
-        self.wavelens = np.array([])
-        self.z_positions = np.array([])
-
+        self.close_journal()
+        if not self.has_data():
+            logging.info('Nothing was acquired, not saving')
+            return
+        if self.plan.split_axis is None and len(self.plan.data_shape) == 1:
+            tiff.imwrite(f'{self.destination}.tif', self.writer.first_shots())
+        self.write_metadata()
+        if self.export_ome_tiff:
+            self.export_ome()
+
+    def close_journal(self):
+        """Discard the journal of a completed plan, keep it to resume from otherwise"""
+        journal, self.journal = self.journal, None
+        if journal is None:
+            return
+        if journal.complete:
+            journal.discard()
+            return
+        reason = self.acquisition_worker.stop_reason or 'stopped before the plan was complete'
+        journal.record_stop(reason)
+        logging.info(f'Acquisition {reason}, it can be resumed from {journal.directory}')
+
+
+    def export_ome(self):
+        """Write all planes to <destination>.ome.tif on a background thread"""
+        if self.plan.split_axis is None:
+            chunks = [None]
+        else:
+            chunks = range(len(self.plan.values(self.plan.split_axis)))
+        sources = {chunk: self.writer.open_file(chunk) if self.writer.path(chunk).exists() else None for chunk in chunks}
+        path = f'{self.destination}.ome.tif'
+        self.exporter = OmeTiffExporter(path, sources, self.plan, self.generate_metadata(), self)
+        self.exporter.progress.connect(lambda i, n: self.acquisition_progress.emit(f'Exporting plane {i}/{n}', path))
+        self.exporter.finished.connect(lambda: self.acquisition_progress.emit('', ''))
+        self.exporter.failed.connect(self.report_error)
+        self.exporter.start()
 
     # Snap and save one raw image
     def snap_photo(self):
@@ -359,85 +872,45 @@ class MainController(QObject):
     # Background subtracted photos
 
     def snap_processed_photo(self):
-        self.start_acquisition(self.save_processed_photo, self.take_sequence_avg)
+        destination = self.ask_destination('Save Photo', 'TIFF (*.tif)')
+        if destination is not None:
+            self.start_acquisition(self.save_processed_photo, SweepPlan([]), destination)
 
     def save_processed_photo(self):
-        dialog = QFileDialog(caption='Save Photo')
-        dialog.setNameFilter('TIFF (*.tif)')
-        dialog.setFileMode(QFileDialog.FileMode.AnyFile)
-        dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
-        dialog.setDirectory(self.data_directory)
-        if dialog.exec():
-            filepath = dialog.selectedFiles()[0]
-            filepath = os.path.splitext(filepath)[0]
-            
-            background = pc.common_background(self.photos[-4:])
-            data = np.mean(self.photos[:-3], axis=0)
-            diff = pc.background_subtracted(data, background)
-            
-            # also contains raw data
-            tiff.imwrite(filepath + '.tif', pc.float_to_mono(diff))
-            np.save(os.path.splitext(filepath)[0] + '.npy', self.photos)
-
-            metadata = self.generate_metadata()
-            with open(filepath+'.yaml', 'w') as file:
-                yaml.dump(metadata, file)
-        self.data_directory = dialog.directory()
+        if not self.has_data():
+            return
+        # Also contains raw data
+        photos = self.writer.point(())
+        n = len(self.background_offsets)
+        background = pc.common_background(photos[-(n+1):])
+        data = np.mean(photos[:-n], axis=0)
+        diff = pc.background_subtracted(data, background)
+        tiff.imwrite(f'{self.destination}.tif', pc.float_to_mono(diff))
+        events = None
+        if self.event_detector.enabled:
+            events = EventTable()
+            events.append(0, *detect_spots(diff, self.event_detector.sigma, self.event_detector.threshold))
+        self.write_metadata(events)
 
 
     def laser_sweep(self, start, stop, num):
-        self.wavelens = np.linspace(start, stop, num)
-        self.start_acquisition(self.save_laser_data, self.take_laser_sweep, self.take_sequence_avg)
-    
-    def save_laser_data(self):
-        dialog = QFileDialog(caption='Save Wavelength Sweep')
-        dialog.setNameFilter('TIFF image sequence (*.tif)')
-        dialog.setFileMode(QFileDialog.FileMode.AnyFile)
-        dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
-        dialog.setDirectory(self.data_directory)
-        if dialog.exec():
-            filepath = dialog.selectedFiles()[0]
-            filepath = os.path.splitext(filepath)[0]
-            
-            data = np.squeeze(self.photos)
-            shape = np.shape(data)
-            images = data.reshape(len(self.wavelens), self.shot_count+3, *shape[1:])
-            np.save(filepath + '.npy', images)
-            tiff.imwrite(filepath + '.tif', images[:,0])
-
-            metadata = self.generate_metadata()
-            with open(filepath+'.yaml', 'w') as file:
-                yaml.dump(metadata, file)
-        self.data_directory = dialog.directory()
-        self.wavelens = np.array([])
-    
+        destination = self.ask_destination('Save Wavelength Sweep', 'TIFF image sequence (*.tif)')
+        if destination is not None:
+            plan = SweepPlan([('wavelen', np.linspace(start, stop, num))])
+            self.start_acquisition(self.save_sweep_data, plan, destination)
 
     def z_sweep(self, start, stop, num):
-        self.z_positions = np.linspace(start, stop, num)
-        self.start_acquisition(self.save_z_data, self.take_z_sweep, self.take_sequence_avg)
-    
-    def save_z_data(self):
-        dialog = QFileDialog(caption='Save Z Sweep')
-        dialog.setNameFilter('TIFF image sequence (*.tif)')
-        dialog.setFileMode(QFileDialog.FileMode.AnyFile)
-        dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
-        dialog.setDirectory(self.data_directory)
-        if dialog.exec():
-            filepath = dialog.selectedFiles()[0]
-            filepath = os.path.splitext(filepath)[0]
-
-            data = np.squeeze(self.photos)
-            shape = np.shape(data)
-            images = data.reshape(len(self.z_positions), self.shot_count+3, *shape[1:])
-            np.save(filepath + '.npy', images)
-            tiff.imwrite(filepath + '.tif', images[:,0])
-
-            metadata = self.generate_metadata()
-            
-            with open(filepath +'.yaml', 'w') as file:
-                yaml.dump(metadata, file)
-        self.data_directory = dialog.directory()
-        self.z_positions = np.array([])
+        destination = self.ask_destination('Save Z Sweep', 'TIFF image sequence (*.tif)')
+        if destination is not None:
+            plan = SweepPlan([('defocus', np.linspace(start, stop, num))])
+            self.start_acquisition(self.save_sweep_data, plan, destination)
+
+    def save_sweep_data(self):
+        """TIFF of the first shot at every point next to the raw data"""
+        if not self.has_data():
+            return
+        tiff.imwrite(f'{self.destination}.tif', self.writer.first_shots())
+        self.write_metadata()
 
     def generate_metadata(self) -> dict:
         exposure_auto = self.camera.get_exposure_auto()
@@ -446,36 +919,69 @@ class MainController(QObject):
         else:
             exposure_time = self.camera.get_exposure_time()
         
-        if len(self.wavelens) > 0:
+        wavelens = self.plan.values('wavelen')
+        if wavelens is not None:
             exposure_time = 'auto'
             wavelen = {
-                'Start': int(self.wavelens[0]),
-                'Stop': int(self.wavelens[-1]),
-                'Number': len(self.wavelens)}
+                'Start': int(wavelens[0]),
+                'Stop': int(wavelens[-1]),
+                'Number': len(wavelens)}
         else:
             wavelen = self.laser.wavelen
         
-        if len(self.z_positions) > 0:
+        z_positions = self.plan.values('defocus')
+        if z_positions is not None:
             z_position = {
-                'Start': float(self.z_positions[0]),
-                'Stop': float(self.z_positions[-1]),
-                'Number': len(self.z_positions)}
+                'Start': float(z_positions[0]),
+                'Stop': float(z_positions[-1]),
+                'Number': len(z_positions)}
         else:
             z_position = 0
             
         
-        return {
+        metadata = {
+            'Acquisition.date': self.acquisition_started or datetime.now().isoformat(),
             'Camera.fps': self.camera.get_fps(),
+            'Camera.roi': self.camera.get_roi(),
             'Camera.exposure_time [us]': exposure_time,
             'Camera.pixel_size [um]': self.pxsize,
             'Camera.averaging': self.shot_count,
+            'Setup.background_grid': self.background_settings,
+            'Setup.background_offsets [um]': np.round(self.background_offsets, 3).tolist(),
             'Setup.magnification': self.magnification,
             'Setup.defocus [um]': z_position,
+            'Setup.sweep_order': 'serpentine' if self.plan.serpentine else 'raster',
+            'Setup.axis_order': self.plan.order,
+            'Stage.xy_position [um]': self.stage_position_metadata(self.stage.xy_position),
+            'Stage.z_position [um]': self.stage_position_metadata(self.stage.z_position),
             'Laser.wavelength [nm]': wavelen,
             'Laser.bandwith [nm]': self.laser.bandwith,
             'Laser.frequency [kHz]': self.laser.get_frequency()
         }
+        if self.writer is not None:
+            metadata['Acquisition.format'] = self.writer.format
+        metadata['Acquisition.completed_points'] = f'{self.progress.completed}/{self.progress.total}'
+        metadata['Acquisition.cancelled'] = self.cancel_token.cancelled
+        acquired = self.acquired_points()
+        if len(acquired) < self.plan.number_of_points:
+            # Unacquired points are zeros in the data, tell them apart from real ones
+            metadata['Acquisition.point_axes'] = list(self.plan.names)
+            metadata['Acquisition.acquired_points'] = [list(point) for point in sorted(acquired)]
+        if self.acquisition_events:
+            metadata.update(self.event_detector.metadata())
+
+        media = self.plan.values('media')
+        if media is not None:
+            metadata['Pump.media'] = [int(m) for m in media]
+        if len(self.exchange_volumes) > 0:
+            metadata['Pump.exchange_volumes [uL]'] = [int(self.exchange_volumes[i]) for i in sorted(self.exchange_volumes)]
+        return metadata
     
+    def stage_position_metadata(self, pos):
+        if pos is None:
+            return 'unknown'
+        return np.round(pos, 3).tolist()
+
     # =====================================================
     # =================   Video   =========================
     # =====================================================
@@ -487,46 +993,82 @@ class MainController(QObject):
             self.stop_video()
 
     def start_video(self):
-        self.photos = []
-        self.camera.new_frame.connect(self.write_frame)
+        # Frames go straight to disk, the format is chosen when the recording stops
+        self.recording_path = Path(self.video_directory) / f'recording_{datetime.now():%Y%m%d_%H%M%S}{RAW_SUFFIX}'
+        metadata = {}
+        self.recording_events = self.ratiometric.enabled and self.event_detector.enabled
+        if self.recording_events:
+            # Frame numbers of the events count from the start of the recording
+            self.event_detector.clear()
+        if self.ratiometric.enabled:
+            self.recording_signal = self.ratiometric.processed
+            metadata = {'Processing.mode': 'ratiometric', 'Processing.frames': self.ratiometric.n,
+                        'Processing.encoding': 'float_to_mono'}
+        else:
+            self.recording_signal = self.camera.new_frame
+        self.recorder = VideoRecorder(self.recording_path, self.camera.get_fps(), metadata, self)
+        self.recorder.failed.connect(self.report_error)
+        self.recorder.start()
+        self.recording_signal.connect(self.write_frame)
 
     def write_frame(self, frame: np.ndarray):
-        self.photos.append(frame)
+        self.recorder.write(frame)
     
     def stop_video(self):
-        self.camera.new_frame.disconnect(self.write_frame)
+        self.recording_signal.disconnect(self.write_frame)
+        frames = self.recorder.close()
+        if self.recorder.dropped > 0 or self.recorder.resized > 0:
+            logging.warning(f'Dropped {self.recorder.dropped} frames the disk could not keep up with '
+                            f'and {self.recorder.resized} frames of another size')
+        if frames == 0:
+            self.discard_recording(self.recording_path)
+            return
 
         dialog = QFileDialog(caption='Save Video')
-        dialog.setNameFilters(('Multi Page TIF (*.tif)', 'AVI Video (*.avi)'))
+        dialog.setNameFilters(('Raw Video (*.raw)', 'Multi Page TIF (*.tif)', '8 bit Multi Page TIF (*.tif)', 'AVI Video (*.avi)'))
         dialog.setFileMode(QFileDialog.FileMode.AnyFile)
         dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptSave)
-        dialog.setDirectory(self.save_videos_directory)
+        dialog.setDirectory(self.video_directory)
         if dialog.exec():
 
             filepath = dialog.selectedFiles()[0]
             filepath = os.path.splitext(filepath)[0]
             nameFilter = dialog.selectedNameFilter()
-            if '.tif' in nameFilter:
-                photos = np.array(self.photos)
-                if photos.dtype == np.uint16:
-                    photos = (photos/256).astype(np.uint8)
-                
-                tiff.imwrite(filepath + '.tif', np.array(self.photos))
-
-            elif '.avi' in nameFilter:
-                fps = int(self.camera.get_fps())
-                self.writer = cv2.VideoWriter(filepath + '.avi', cv2.VideoWriter_fourcc(*'XVID'), fps, (self.camera.roi_width, self.camera.roi_height), False)  # type: ignore
-
-                for photo in self.photos:
-                    # Image writer only support uint8
-                    if photo.dtype == np.uint16:
-                        self.writer.write((photo/256).astype(np.uint8))
-                    elif (photo.dtype ==np.uint8):
-                        self.writer.write(photo)
-
-                
-                self.writer.release()
-        self.save_videos_directory = dialog.directory()
+            if '.raw' in nameFilter:
+                move_file(self.recording_path, filepath + RAW_SUFFIX)
+                move_file(self.recording_path.with_suffix('.yaml'), filepath + '.yaml')
+            else:
+                source = VideoSource(self.recording_path)
+                # One window for the whole video, so auto contrast does not flicker
+                step = max(1, len(source)//32)
+                mapper = self.tone_mapper.fixed(source.frame(i) for i in range(0, len(source), step))
+                if '8 bit' in nameFilter:
+                    tiff.imwrite(filepath + '.tif', (mapper.apply(photo) for photo in source), shape=(len(source), *source.shape), dtype=np.uint8)
+                    move_file(self.recording_path.with_suffix('.yaml'), filepath + '.yaml')
+
+                elif '.tif' in nameFilter:
+                    tiff.imwrite(filepath + '.tif', iter(source), shape=(len(source), *source.shape), dtype=source.frames.dtype)
+                    move_file(self.recording_path.with_suffix('.yaml'), filepath + '.yaml')
+
+                elif '.avi' in nameFilter:
+                    height, width = source.shape
+                    writer = cv2.VideoWriter(filepath + '.avi', cv2.VideoWriter_fourcc(*'XVID'), int(source.fps), (width, height), False)  # type: ignore
+
+                    for photo in source:
+                        # Image writer only support uint8
+                        writer.write(mapper.apply(photo))
+
+                    writer.release()
+                source.close()
+            if self.recording_events:
+                self.event_detector.save(filepath + '_events.npz')
+            self.video_directory = dialog.directory().absolutePath()
+        self.discard_recording(self.recording_path)
+
+    def discard_recording(self, path):
+        for file in (path, path.with_suffix('.yaml')):
+            if file.exists():
+                file.unlink()
     
     def update_roi(self, roi):
         # Set ROI in camera
@@ -538,8 +1080,10 @@ class MainController(QObject):
     def auto_expose(self):
         if self.exposure > 55000:
             self.camera.set_autoexposure('Continuous')
-            time.sleep(2)
-            self.camera.set_autoexposure('Off')
+            try:
+                self.cancel_token.sleep(2)
+            finally:
+                self.camera.set_autoexposure('Off')
         
         self.camera.set_exposure(self.camera.get_exposure()*50000/self.exposure)
 
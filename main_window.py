@@ -6,17 +6,14 @@ import os
 import logging
 import numpy as np
 
-from widgets import VideoView, LaserWindow, SweepWindow, SweepDialog, PumpWindow
+from widgets import VideoView, LaserWindow, SweepWindow, SweepDialog, PumpWindow, DatasetBrowser, PlaybackBar, DisplayWindow, HistogramWindow, EventsWindow
 from main_controller import MainController
+from controllers import StageMover
+from video_playback import VideoPlayer
+from live_analysis import LiveAnalyzer
 import processing as pc
 
 
-class PersistentWorkerThread(QThread):
-    def __init__(self, func):
-        super().__init__()
-        self.func = func
-
-
 class MainWindow(QMainWindow):
     def __init__(self, controller: MainController):
         super().__init__()
@@ -56,7 +53,44 @@ class MainWindow(QMainWindow):
         self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.pump_window)
         self.pump_window.hide()
 
+        self.dataset_browser = DatasetBrowser(self)
+        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.dataset_browser)
+        self.dataset_browser.hide()
+
         self.video_view = VideoView(self)
+        # Recordings are exported with the tone mapping of the display
+        self.video_view.tone_mapper = self.controller.tone_mapper
+
+        self.display_window = DisplayWindow(self, self.controller.tone_mapper)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.display_window)
+        self.display_window.changed.connect(self.video_view.refresh)
+        self.display_window.hide()
+
+        self.histogram_window = HistogramWindow(self)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.histogram_window)
+        self.histogram_window.hide()
+        # Only analyse frames while the histogram is shown
+        self.analyzer = LiveAnalyzer(self)
+        self.analyzer.histogram_ready.connect(self.histogram_window.update_histogram)
+        self.analyzer.profile_ready.connect(self.histogram_window.update_profile)
+        self.analyzer.failed.connect(self.controller.report_error)
+        self.histogram_window.visibilityChanged.connect(self.analyzer.set_enabled)
+        self.histogram_window.draw_profile.connect(lambda: self.toggle_mode('profile'))
+        self.video_view.profile_set.connect(self.set_profile)
+        self.analyzer.start()
+
+        self.events_window = EventsWindow(self, self.controller.event_detector)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.events_window)
+        self.events_window.save_requested.connect(self.save_events)
+        self.events_window.hide()
+
+        # Recording shown instead of the live stream
+        self.player = None
+        self.playback_bar = PlaybackBar(self)
+        self.playback_bar.play_toggled.connect(lambda play: self.player.play() if play else self.player.pause())
+        self.playback_bar.seek.connect(lambda index: self.player.seek(index))
+        self.playback_bar.fps_changed.connect(lambda fps: self.player.set_fps(fps))
+        self.playback_bar.close_requested.connect(self.close_recording)
 
 
         # Routes
@@ -70,16 +104,21 @@ class MainWindow(QMainWindow):
         self.pump_window.start_pickup.connect(self.controller.pump.pickup)
         self.pump_window.start_dispense.connect(self.controller.pump.dispense)
         self.pump_window.start_clean.connect(self.controller.pump.clean_pump)
+        self.controller.pump.program_started.connect(self.pump_window.program_started)
+        self.controller.pump.program_finished.connect(self.pump_window.program_finished)
         self.controller.pump.changedState.connect(lambda open: self.pump_window.setVisible(open))
 
         self.controller.camera.new_frame.connect(self.update_display)
+        self.controller.ratiometric.processed.connect(self.show_processed)
         self.controller.camera.state_changed.connect(self.update_controls)
         self.controller.camera.opened.connect(self.video_view.set_size)
         self.video_view.roi_set.connect(self.controller.camera.set_roi)
         
         
-        self.move_stage_worker = PersistentWorkerThread(self.controller.stage.move_stage)
-        self.video_view.move_stage.connect(self.move_stage_worker.func)
+        self.stage_mover = StageMover(self.controller.stage, self)
+        self.video_view.move_stage.connect(self.stage_mover.move)
+        self.stage_mover.failed.connect(self.controller.report_error)
+        self.stage_mover.start()
 
         self.createUI()
         self.update_controls()
@@ -136,6 +175,22 @@ class MainWindow(QMainWindow):
         self.show_acquisition_act.setStatusTip('Show acquisition window')
         self.show_acquisition_act.triggered.connect(lambda: self.sweep_window.setVisible(not self.sweep_window.isVisible()))
 
+        self.show_display_act = add_action(QAction('Display', self))
+        self.show_display_act.setStatusTip('Show contrast settings of the video view')
+        self.show_display_act.triggered.connect(lambda: self.display_window.setVisible(not self.display_window.isVisible()))
+
+        self.show_histogram_act = add_action(QAction('Histogram', self))
+        self.show_histogram_act.setStatusTip('Show the live histogram and line profile')
+        self.show_histogram_act.triggered.connect(lambda: self.histogram_window.setVisible(not self.histogram_window.isVisible()))
+
+        self.show_events_act = add_action(QAction('Events', self))
+        self.show_events_act.setStatusTip('Show the live particle detection')
+        self.show_events_act.triggered.connect(lambda: self.events_window.setVisible(not self.events_window.isVisible()))
+
+        self.show_browser_act = add_action(QAction('Dataset Browser', self))
+        self.show_browser_act.setStatusTip('Browse saved acquisitions')
+        self.show_browser_act.triggered.connect(lambda: self.dataset_browser.setVisible(not self.dataset_browser.isVisible()))
+
         self.set_roi_act = add_action(QAction('Select ROI', self))
         self.set_roi_act.setStatusTip('Draw a rectangle to set ROI')
         self.set_roi_act.setCheckable(True)
@@ -169,6 +224,12 @@ class MainWindow(QMainWindow):
         self.video_act.setCheckable(True)
         self.video_act.toggled.connect(self.controller.toggle_video)
 
+        self.ratiometric_act = add_action(QAction('Ratiometric', self))
+        self.ratiometric_act.setStatusTip('Show the ratio of the next to the previous frames instead of the raw frames')
+        self.ratiometric_act.setCheckable(True)
+        self.ratiometric_act.toggled.connect(self.toggle_ratiometric)
+        self.video_act.toggled.connect(self.update_controls)
+
         self.grab_release_laser_act = add_action(QAction('Open Laser'))
         self.grab_release_laser_act.setCheckable(True)
         self.grab_release_laser_act.triggered.connect(self.controller.laser.toggle_laser)
@@ -180,10 +241,18 @@ class MainWindow(QMainWindow):
         self.change_setup_act = add_action(QAction('Setup Properties'))
         self.change_setup_act.triggered.connect(self.controller.set_setup_parameters)
 
+        self.resume_acquisition_act = add_action(QAction('Resume acquisition'))
+        self.resume_acquisition_act.setStatusTip('Continue an interrupted acquisition')
+        self.resume_acquisition_act.triggered.connect(self.resume_acquisition)
+
         self.cancel_acquisition_act = add_action(QAction('Cancel acquisition'))
-        self.cancel_acquisition_act.triggered.connect(self.controller.finish_acquisition)
+        self.cancel_acquisition_act.triggered.connect(self.controller.cancel)
+
 
 
+        self.open_recording_act = add_action(QAction('Open Recording', self))
+        self.open_recording_act.setStatusTip('Play back a recorded video')
+        self.open_recording_act.triggered.connect(self.open_recording)
 
         exit_act = add_action(QAction('E&xit', self))
         exit_act.setShortcut(QKeySequence.StandardKey.Quit)
@@ -195,6 +264,8 @@ class MainWindow(QMainWindow):
         #=========#
 
         file_menu = self.menuBar().addMenu('&File')
+        file_menu.addAction(self.open_recording_act)
+        file_menu.addSeparator()
         file_menu.addAction(exit_act)
 
         device_menu = self.menuBar().addMenu('&Device')
@@ -216,13 +287,20 @@ class MainWindow(QMainWindow):
         view_menu.addAction(self.show_acquisition_act)
         view_menu.addAction(self.pump_act)
         view_menu.addAction(self.laser_parameters_act)
+        view_menu.addAction(self.show_display_act)
+        view_menu.addAction(self.show_histogram_act)
+        view_menu.addAction(self.show_events_act)
+        view_menu.addAction(self.show_browser_act)
 
         capture_menu = self.menuBar().addMenu('&Capture')
+        capture_menu.addAction(self.ratiometric_act)
+        capture_menu.addSeparator()
         capture_menu.addAction(self.snap_raw_photo_act)
         capture_menu.addAction(self.snap_processed_photo_act)
         capture_menu.addSeparator()
         capture_menu.addAction(self.defocus_sweep_act)
         capture_menu.addAction(self.laser_sweep_act)
+        capture_menu.addAction(self.resume_acquisition_act)
         capture_menu.addAction(self.cancel_acquisition_act)
         
 
@@ -241,6 +319,7 @@ class MainWindow(QMainWindow):
         toolbar.addSeparator()
         toolbar.addAction(self.start_live_act)
         toolbar.addAction(self.video_act)
+        toolbar.addAction(self.ratiometric_act)
         toolbar.addAction(self.auto_expose_act)
         toolbar.addSeparator()
         toolbar.addAction(self.set_roi_act)
@@ -251,6 +330,11 @@ class MainWindow(QMainWindow):
         toolbar.addAction(self.show_acquisition_act)
 
         
+        self.playback_toolbar = QToolBar('Playback', self)
+        self.playback_toolbar.addWidget(self.playback_bar)
+        self.addToolBar(Qt.ToolBarArea.BottomToolBarArea, self.playback_toolbar)
+        self.playback_toolbar.hide()
+
         # button = QPushButton('Test', toolbar)
         # button.clicked.connect(self.test)
         # toolbar.addWidget(button)
@@ -260,19 +344,32 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(self.video_view)
         
 
-        self.statusBar().showMessage('Ready')
+        if len(self.controller.unfinished_acquisitions()) > 0:
+            self.statusBar().showMessage('An interrupted acquisition can be resumed from the Capture menu')
+        else:
+            self.statusBar().showMessage('Ready')
         self.acquisition_label = QLabel('', self.statusBar())
         self.statusBar().addPermanentWidget(self.acquisition_label)
+        self.controller.acquisition_progress.connect(lambda text, tooltip: (self.acquisition_label.setText(text), self.acquisition_label.setToolTip(tooltip)))
         self.statistics_label = QLabel('', self.statusBar())
         self.controller.camera.statistics_update.connect(lambda s1, s2: (self.statistics_label.setText(s1), self.statistics_label.setToolTip(s2)))
         self.statusBar().addPermanentWidget(self.statistics_label)
         self.statusBar().addPermanentWidget(QLabel('  '))
+        self.stage_label = QLabel('', self.statusBar())
+        self.controller.acquisition_estimate.connect(self.statusBar().showMessage)
+        self.controller.stage.xy_position_changed.connect(self.update_stage_label)
+        self.controller.stage.z_position_changed.connect(self.update_stage_label)
+        self.statusBar().addPermanentWidget(self.stage_label)
+        self.update_stage_label()
         self.camera_label = QLabel(self.statusBar())
         self.statusBar().addPermanentWidget(self.camera_label)
         self.controller.camera.label_update.connect(self.camera_label.setText)
     
     def closeEvent(self, event):
         self.closing = True
+        self.close_recording()
+        self.analyzer.stop()
+        self.stage_mover.stop()
         self.controller.cleanup()
         super().closeEvent(event)
     
@@ -331,6 +428,8 @@ class MainWindow(QMainWindow):
             self.start_live_act.setEnabled(valid_camera)
             self.start_live_act.setChecked(streaming)
             self.video_act.setEnabled(streaming)
+            # The recorded stream is chosen when recording starts
+            self.ratiometric_act.setEnabled(streaming and not self.video_act.isChecked())
             self.close_device_act.setEnabled(camera_open)
 
             # Captures
@@ -345,6 +444,7 @@ class MainWindow(QMainWindow):
             self.move_act.setEnabled(streaming and xy_stage_connected)
             self.move_act.setChecked(self.video_view.mode == 'move')
             self.set_roi_act.setChecked(self.video_view.mode == 'roi')
+            self.histogram_window.profile_button.setChecked(self.video_view.mode == 'profile')
             
             # Acquisition
             if acquiring:
@@ -357,6 +457,15 @@ class MainWindow(QMainWindow):
     
     
     
+    def update_stage_label(self):
+        stage = self.controller.stage
+        text = []
+        if stage.open and stage.xy_stage:
+            text.append('X: {:.1f} Y: {:.1f}'.format(*stage.xy_position))
+        if stage.open and stage.z_stage:
+            text.append(f'Z: {stage.z_position:.2f}')
+        self.stage_label.setText(' '.join(text) + ' micron' if text else '')
+
     def toggle_mode(self, mode):
         if self.video_view.mode == mode:
             self.video_view.mode = 'navigation'
@@ -366,9 +475,91 @@ class MainWindow(QMainWindow):
         self.update_controls()
         
     
+    def set_profile(self, line: np.ndarray):
+        self.analyzer.set_line(line)
+        self.update_controls()
+
     def update_display(self, frame: np.ndarray):
-        self.video_view.update_image(frame)
+        if self.player is None and not self.controller.ratiometric.enabled:
+            self.video_view.update_image(frame)
+            self.analyzer.add_frame(frame)
+
+    def show_processed(self, frame: np.ndarray):
+        if self.player is None and self.controller.ratiometric.enabled:
+            self.video_view.update_image(frame)
+            self.analyzer.add_frame(frame)
+
+    def save_events(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Events', QDir(self.controller.data_directory).absolutePath(), 'Event table (*.npz)')
+        if path:
+            count = self.controller.event_detector.save(path)
+            self.statusBar().showMessage(f'Saved {count} events')
+
+    def toggle_ratiometric(self, enabled):
+        processor = self.controller.ratiometric
+        if enabled:
+            n, ok = QInputDialog.getInt(self, 'Ratiometric', 'Frames per window', processor.n, 1, 500)
+            if not ok:
+                self.ratiometric_act.setChecked(False)
+                return
+            processor.set_n(n)
+            self.statusBar().showMessage(f'Ratiometric: comparing the next {n} to the previous {n} frames')
+        processor.set_enabled(enabled)
+
+    def open_recording(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Open Recording', self.controller.video_directory,
+                                              'Recordings (*.raw *.tif *.tiff *.npy)')
+        if not path:
+            return
+        self.close_recording()
+        try:
+            self.player = VideoPlayer(path, self)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, 'Open Recording', f'Cannot open {path}: {e}')
+            return
+        self.player.frame_changed.connect(self.show_recording_frame)
+        self.player.playing_changed.connect(self.playback_bar.set_playing)
+        self.player.failed.connect(self.playback_failed)
+        self.playback_bar.set_video(len(self.player), self.player.fps)
+        self.playback_toolbar.show()
+
+        height, width = self.player.source.shape
+        self.video_view.reset_zoom()
+        self.video_view.set_size(width, height, width, height, 0, 0)
+        self.player.seek(0)
+        self.statusBar().showMessage(f'Playing {QFileInfo(path).fileName()}, {len(self.player)} frames at {self.player.fps:g} fps')
+
+    def playback_failed(self, message):
+        # A method, so the prefetcher's signal is delivered on the GUI thread
+        QMessageBox.warning(self, 'Playback', message)
+
+    def show_recording_frame(self, frame: np.ndarray, index: int):
+        self.video_view.update_image(np.ascontiguousarray(frame)[..., np.newaxis])
+        self.analyzer.add_frame(frame)
+        self.playback_bar.set_position(index)
+
+    def close_recording(self):
+        if self.player is None:
+            return
+        self.player.close()
+        self.player.deleteLater()
+        self.player = None
+        self.playback_toolbar.hide()
+        self.playback_bar.set_playing(False)
+        self.video_view.reset_zoom()
+        if self.controller.camera.grabber.is_device_open:
+            self.controller.camera.emit_geometry()
     
+    def resume_acquisition(self):
+        directories = self.controller.unfinished_acquisitions()
+        if len(directories) == 0:
+            self.statusBar().showMessage('No interrupted acquisitions')
+            return
+        names = [directory.name for directory in directories]
+        name, ok = QInputDialog.getItem(self, 'Resume Acquisition', 'Acquisition', names, len(names) - 1, False)
+        if ok:
+            self.controller.resume_acquisition(directories[names.index(name)])
+
     def laser_sweep(self):
         band_radius = self.controller.laser.bandwith/2
         dialog = SweepDialog(title='Laser Sweep Data', limits=(390+band_radius, 850-band_radius, 390+band_radius, 850-band_radius), defaults=(500, 600, 10), unit='nm')
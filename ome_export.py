@@ -0,0 +1,105 @@
+import logging
+
+import numpy as np
+import tifffile as tiff
+from PySide6.QtCore import QThread, Signal
+
+TILE = (256, 256)
+
+
+def sweep_labels(setting):
+    """Values of a swept setting from its generate_metadata entry"""
+    if isinstance(setting, dict):
+        return np.linspace(setting['Start'], setting['Stop'], setting['Number'])
+    return np.array([setting])
+
+
+class OmeTiffExporter(QThread):
+    """Writes a saved acquisition to one tiled BigTIFF OME-TIFF, plane by plane.
+
+    The dimensions are TZCYX: T runs over the media and within every medium over
+    the shots of a point, Z over defocus and C over wavelength. Planes are read one
+    at a time from the raw files, so viewers can open any plane and the export
+    never holds more than a plane in memory.
+    """
+    progress = Signal(int, int)
+    failed = Signal(str)
+
+    def __init__(self, path, sources, plan, metadata, parent=None):
+        super().__init__(parent)
+        self.path = path
+        # One raw file per index of the split axis, or a single one under None
+        self.sources = sources
+        self.plan = plan
+        self.metadata = metadata
+        first = next(source for source in sources.values() if source is not None)
+        self.frames_per_point = first.shape[-3]
+        self.frame_shape = tuple(first.shape[-2:])
+        self.dtype = first.dtype
+
+    def size(self, name):
+        values = self.plan.values(name)
+        return len(values) if values is not None else 1
+
+    @property
+    def shape(self):
+        media, z, c = self.size('media'), self.size('defocus'), self.size('wavelen')
+        return (media*self.frames_per_point, z, c, *self.frame_shape)
+
+    def plane(self, medium, shot, z, c):
+        coords = {'media': medium, 'defocus': z, 'wavelen': c}
+        point = tuple(coords[name] for name in self.plan.names)
+        chunk = None
+        if self.plan.split_axis is not None:
+            chunk = point[self.plan.names.index(self.plan.split_axis)]
+        source = self.sources.get(chunk)
+        if source is None:
+            # Not acquired
+            return np.zeros(self.frame_shape, self.dtype)
+        return np.asarray(source[(*self.plan.data_index(point), shot)])
+
+    def planes(self):
+        for medium in range(self.size('media')):
+            for shot in range(self.frames_per_point):
+                for z in range(self.size('defocus')):
+                    for c in range(self.size('wavelen')):
+                        yield self.plane(medium, shot, z, c)
+
+    def tiles(self):
+        count = int(np.prod(self.shape[:3]))
+        height, width = self.frame_shape
+        for i, plane in enumerate(self.planes()):
+            for y in range(0, height, TILE[0]):
+                for x in range(0, width, TILE[1]):
+                    # Edge tiles are padded to full size
+                    tile = np.zeros(TILE, self.dtype)
+                    part = plane[y:y+TILE[0], x:x+TILE[1]]
+                    tile[:part.shape[0], :part.shape[1]] = part
+                    yield tile
+            self.progress.emit(i + 1, count)
+
+    def ome_metadata(self):
+        pixel_size = self.metadata['Camera.pixel_size [um]']/self.metadata['Setup.magnification']
+        metadata = {
+            'axes': 'TZCYX',
+            'PhysicalSizeX': pixel_size,
+            'PhysicalSizeXUnit': 'µm',
+            'PhysicalSizeY': pixel_size,
+            'PhysicalSizeYUnit': 'µm'}
+        wavelength = self.metadata.get('Laser.wavelength [nm]')
+        if isinstance(wavelength, (dict, int, float)):
+            metadata['Channel'] = {'Name': [f'{value:.1f} nm' for value in sweep_labels(wavelength)]}
+        return metadata
+
+    def run(self):
+        try:
+            with tiff.TiffWriter(self.path, bigtiff=True, ome=True) as file:
+                file.write(self.tiles(), shape=self.shape, dtype=self.dtype, tile=TILE,
+                           photometric='minisblack', metadata=self.ome_metadata())
+            logging.info(f'Exported {self.path}')
+        except Exception as e:
+            self.failed.emit(f'OME-TIFF export failed: {e}')
+        finally:
+            for source in self.sources.values():
+                if hasattr(source, 'close'):
+                    source.close()
@@ -0,0 +1,84 @@
+"""Multi-resolution copies of saved acquisitions for browsing.
+
+Level k holds every frame box filtered down by 2^k, as a .npy next to the data in
+<name>.pyramid/level_<k>.npy, shaped like the acquisition (medium, defocus,
+wavelength, shot, H/2^k, W/2^k). Level 0 is the raw data itself. The last level
+is small enough to be used as thumbnail.
+"""
+import numpy as np
+import yaml
+
+from dataset_reader import open_acquisition, base_path, data_files
+
+# Levels are halved until the longest side is at most this many pixels
+THUMBNAIL_SIZE = 128
+
+
+def pyramid_directory(path):
+    path = base_path(path)
+    return path.with_name(path.name + '.pyramid')
+
+
+def source_modified(path):
+    return max(file.stat().st_mtime for file in data_files(base_path(path)).values())
+
+
+def downsample(frame):
+    """Halve a frame with a 2x2 box filter"""
+    height, width = frame.shape[0]//2*2, frame.shape[1]//2*2
+    data = frame[:height, :width].astype(np.uint32)
+    total = data[0::2, 0::2] + data[1::2, 0::2] + data[0::2, 1::2] + data[1::2, 1::2]
+    return ((total + 2)//4).astype(frame.dtype)
+
+
+def level_count(frame_shape):
+    levels = 0
+    size = max(frame_shape)
+    while size > THUMBNAIL_SIZE:
+        size //= 2
+        levels += 1
+    return levels
+
+
+def levels(path):
+    """Number of levels of an up to date pyramid, None when it has to be (re)built"""
+    info = pyramid_directory(path) / 'pyramid.yaml'
+    if not info.exists():
+        return None
+    with open(info) as file:
+        state = yaml.safe_load(file)
+    if state.get('source_modified') != source_modified(path):
+        return None
+    return state['levels']
+
+
+def open_level(path, level):
+    return np.load(pyramid_directory(path) / f'level_{level}.npy', mmap_mode='r')
+
+
+def build_pyramid(path, progress=None):
+    """Write all levels, reading every raw frame once and keeping one in memory"""
+    directory = pyramid_directory(path)
+    directory.mkdir(exist_ok=True)
+    with open_acquisition(path) as data:
+        count = level_count(data.frame_shape)
+        leading = data.shape[:4]
+        outputs = []
+        shape = data.frame_shape
+        for level in range(1, count + 1):
+            shape = (shape[0]//2, shape[1]//2)
+            outputs.append(np.lib.format.open_memmap(directory / f'level_{level}.npy', mode='w+', dtype=data.dtype, shape=(*leading, *shape)))
+        total = int(np.prod(leading))
+        for i, index in enumerate(np.ndindex(*leading)):
+            frame = np.asarray(data[index])
+            for output in outputs:
+                frame = downsample(frame)
+                output[index] = frame
+            if progress is not None:
+                progress(i + 1, total)
+        for output in outputs:
+            output.flush()
+    # Written last, so an interrupted build is rebuilt
+    with open(directory / 'pyramid.yaml', 'w') as file:
+        yaml.dump({'levels': count, 'source_modified': source_modified(path)}, file)
+    return count
@@ -0,0 +1,143 @@
+"""Rolling ratiometric contrast of the live stream.
+
+Every frame is compared to the mean of the N frames before it: the ratio of
+the mean of frames t..t+N-1 to the mean of frames t-N..t-1, minus one. Static
+background cancels out and whatever landed or changed within N frames stands
+out. The two means are kept as running sums over a ring buffer of the last 2N
+frames, so a new frame costs the same whatever N is.
+"""
+from PySide6.QtCore import QThread, Signal
+
+import queue
+import numpy as np
+
+import processing as pc
+
+# Frames waiting for the worker, older frames are dropped when it falls behind
+QUEUE_DEPTH = 8
+
+
+class RollingRatio:
+    def __init__(self, n):
+        self.n = n
+        self.ring = None
+        self.position = 0
+        self.count = 0
+
+    def reset(self, shape):
+        self.ring = np.zeros((2*self.n, *shape), dtype=np.uint16)
+        # Integer sums stay exact however long the stream runs
+        self.previous_sum = np.zeros(shape, dtype=np.uint32)
+        self.next_sum = np.zeros(shape, dtype=np.uint32)
+        self.ratio = np.empty(shape, dtype=np.float32)
+        self.position = 0
+        self.count = 0
+
+    def add_frame(self, frame: np.ndarray):
+        """Add a uint16 frame, returns the contrast once 2N frames were seen, else None"""
+        if self.ring is None or self.ring.shape[1:] != frame.shape:
+            self.reset(frame.shape)
+        oldest = self.ring[self.position]
+        # Moves from the next to the previous window
+        middle = self.ring[(self.position + self.n) % (2*self.n)]
+        self.previous_sum += middle
+        self.previous_sum -= oldest
+        self.next_sum += frame
+        self.next_sum -= middle
+        oldest[...] = frame
+        self.position = (self.position + 1) % (2*self.n)
+        self.count += 1
+        if self.count < 2*self.n:
+            return None
+        # Pixels that were dark in the previous window get no contrast
+        self.ratio.fill(1)
+        np.divide(self.next_sum, self.previous_sum, out=self.ratio, where=self.previous_sum > 0)
+        self.ratio -= 1
+        return self.ratio
+
+
+class RatiometricProcessor(QThread):
+    """Turns live frames into ratiometric contrast on a worker thread.
+
+    processed carries the contrast as uint16 from float_to_mono, shaped like a
+    camera frame, so it can be displayed and recorded like one. contrast
+    carries the float contrast and the number of the frame it belongs to,
+    counted over the processed frames, and is only sent while something
+    wants it, see set_contrast_enabled. When frames are dropped the windows
+    start over, they would no longer hold consecutive frames.
+    """
+    processed = Signal(np.ndarray)
+    contrast = Signal(np.ndarray, int)
+    # Once per run of failing frames, handled on the GUI thread
+    failed = Signal(str)
+    def __init__(self, parent=None, n=10):
+        super().__init__(parent)
+        self.n = n
+        self.rolling = RollingRatio(n)
+        self.frames = queue.Queue(QUEUE_DEPTH)
+        self.enabled = False
+        self.dropped = 0
+        # A frame was dropped since the last one that was queued
+        self.gap = False
+        self.processed_frames = 0
+        # A float copy of every frame is only worth it when it is used
+        self.contrast_enabled = False
+        self.failing = False
+
+    def set_n(self, n):
+        self.n = n
+        self.frames.put(('n', n))
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if enabled:
+            # Start over, the frames in the windows are no longer consecutive
+            self.dropped = 0
+            self.gap = False
+            self.frames.put(('n', self.n))
+
+    def set_contrast_enabled(self, enabled):
+        self.contrast_enabled = enabled
+
+    def add_frame(self, frame: np.ndarray):
+        if not self.enabled:
+            return
+        try:
+            if self.gap:
+                self.frames.put_nowait(('restart', None))
+            self.frames.put_nowait(('frame', frame))
+            self.gap = False
+        except queue.Full:
+            self.dropped += 1
+            self.gap = True
+
+    def stop(self):
+        self.frames.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            kind, value = item
+            if kind == 'n':
+                self.rolling = RollingRatio(value)
+                continue
+            if kind == 'restart':
+                self.rolling = RollingRatio(self.rolling.n)
+                continue
+            try:
+                frame = value[..., 0] if value.ndim == 3 else value
+                ratio = self.rolling.add_frame(frame)
+                self.processed_frames += 1
+                if ratio is None:
+                    continue
+                if self.contrast_enabled:
+                    self.contrast.emit(ratio.copy(), self.processed_frames - self.rolling.n)
+                self.processed.emit(pc.float_to_mono(ratio)[..., np.newaxis])
+                self.failing = False
+            except Exception as e:
+                if not self.failing:
+                    self.failed.emit(f'Ratiometric processing failed: {e}')
+                self.failing = True
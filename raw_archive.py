@@ -0,0 +1,289 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from dataset_writer import DatasetWriter
+
+# File layout: MAGIC, header length (uint32), JSON header, then records of
+# RECORD followed by the compressed frame. Records are only appended, so a
+# file cut off by a crash is valid up to its last complete record.
+MAGIC = b'RAWZ'
+VERSION = 1
+HEADER_LENGTH = struct.Struct('<I')
+# Flat index of the point in the file, shot (MEAN_SHOT for the mean frame), compressed size
+RECORD = struct.Struct('<qiQ')
+MEAN_SHOT = -1
+SUFFIX = '.rawz'
+
+# shuffle: bytes of every pixel regrouped by significance, so the mostly empty
+# high bytes of 12 bit data compress well.
+# delta: every frame stored as the difference to the mean of its point, shuffled.
+FILTERS = ('shuffle', 'delta')
+
+
+def available_codecs():
+    codecs = []
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4 is not None:
+        codecs.append('lz4')
+    codecs.append('zlib')
+    return codecs
+
+
+def default_codec():
+    return available_codecs()[0]
+
+
+def compress(codec, data: bytes) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'lz4':
+        return lz4.frame.compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 1)
+    raise ValueError(f'Unknown codec {codec}')
+
+
+def decompress(codec, data: bytes) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lz4':
+        return lz4.frame.decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f'Unknown codec {codec}')
+
+
+def shuffle(array: np.ndarray) -> bytes:
+    planes = np.ascontiguousarray(array).view(np.uint8).reshape(-1, array.itemsize)
+    return np.ascontiguousarray(planes.T).tobytes()
+
+
+def unshuffle(data: bytes, dtype, shape) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+def encode_point(frames: np.ndarray, filter):
+    """Arrays to compress for the frames of one point, as (shot, array)"""
+    if filter == 'shuffle':
+        return list(enumerate(frames))
+    if filter == 'delta':
+        mean = np.rint(frames.mean(axis=0)).astype(np.int32)
+        deltas = frames.astype(np.int32) - mean
+        return [(MEAN_SHOT, mean)] + list(enumerate(deltas))
+    raise ValueError(f'Unknown filter {filter}')
+
+
+def flat_index(index, shape) -> int:
+    if len(shape) == 0:
+        return 0
+    return int(np.ravel_multi_index(index, shape))
+
+
+def read_header(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise RuntimeError(f'{file.name} is not a raw archive')
+    length, = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+    return json.loads(file.read(length))
+
+
+def scan_records(file):
+    """Offsets of the complete records after the header, and where the last one ends"""
+    index = {}
+    end = file.tell()
+    while True:
+        record = file.read(RECORD.size)
+        if len(record) < RECORD.size:
+            break
+        point, shot, size = RECORD.unpack(record)
+        offset = file.tell()
+        file.seek(size, os.SEEK_CUR)
+        if file.tell() > os.fstat(file.fileno()).st_size:
+            break
+        index[(point, shot)] = (offset, size)
+        end = file.tell()
+    return index, end
+
+
+def open_archive(path, header):
+    """Archive opened for appending, keeping the complete records of an earlier run"""
+    if path.exists():
+        file = open(path, 'r+b')
+        existing = read_header(file)
+        if existing != header:
+            file.close()
+            raise RuntimeError(f'Cannot resume: archive {path} was written with different settings')
+        _, end = scan_records(file)
+        file.truncate(end)
+        file.seek(end)
+        return file
+    file = open(path, 'wb')
+    data = json.dumps(header).encode()
+    file.write(MAGIC + HEADER_LENGTH.pack(len(data)) + data)
+    return file
+
+
+class ArchiveWriter(DatasetWriter):
+    """DatasetWriter that stores every frame as a separately compressed record.
+
+    The frames of a point are compressed in parallel on a thread pool; the
+    codecs release the GIL, so this keeps pace with the camera.
+    """
+    def __init__(self, destination, plan, journal=None, parent=None, codec=None, filter='shuffle', threads=None):
+        super().__init__(destination, plan, journal, parent)
+        self.codec = codec if codec is not None else default_codec()
+        if self.codec not in available_codecs():
+            raise RuntimeError(f'Compression {self.codec} is not installed')
+        if filter not in FILTERS:
+            raise ValueError(f'Unknown filter {filter}')
+        self.filter = filter
+        self.pool = ThreadPoolExecutor(threads)
+
+    @property
+    def format(self):
+        return f'rawz ({self.codec}, {self.filter})'
+
+    def path(self, chunk=None):
+        if chunk is None:
+            return self.destination.with_name(f'{self.destination.name}{SUFFIX}')
+        return self.destination.with_name(f'{self.destination.name}_{chunk}{SUFFIX}')
+
+    def header(self, frames):
+        return {
+            'version': VERSION,
+            'codec': self.codec,
+            'filter': self.filter,
+            'axes': self.plan.data_axes,
+            'data_shape': list(self.plan.data_shape),
+            'frames_per_point': frames.shape[0],
+            'frame_shape': list(frames.shape[1:]),
+            'dtype': frames.dtype.str}
+
+    def write_point(self, chunk, point, frames):
+        if chunk not in self.files:
+            self.files[chunk] = open_archive(self.path(chunk), self.header(frames))
+        file = self.files[chunk]
+        index = flat_index(self.plan.data_index(point), self.plan.data_shape)
+        arrays = encode_point(frames, self.filter)
+        payloads = self.pool.map(lambda item: compress(self.codec, shuffle(item[1])), arrays)
+        for (shot, _), payload in zip(arrays, payloads):
+            file.write(RECORD.pack(index, shot, len(payload)))
+            file.write(payload)
+        file.flush()
+        if self.journal is not None:
+            # Only claim points once their data is on disk
+            os.fsync(file.fileno())
+            self.journal.record_point(point)
+        self.points.add(tuple(point))
+        self.written += 1
+
+    def close_file(self, file):
+        file.close()
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.pool.shutdown()
+
+    def open_file(self, chunk=None):
+        return RawArchive(self.path(chunk))
+
+    def first_shots(self, chunk=None):
+        with RawArchive(self.path(chunk)) as archive:
+            return archive.first_shots()
+
+    def point(self, index, chunk=None):
+        with RawArchive(self.path(chunk)) as archive:
+            return archive.point(index)
+
+
+class RawArchive:
+    """Reader of a .rawz archive that only decompresses the frames asked for.
+
+    archive[i, j, ..., shot] gives a single frame, archive.point((i, j, ...))
+    all frames of a point. Missing points read as zeros.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.lock = threading.Lock()
+        self.header = read_header(self.file)
+        self.index, _ = scan_records(self.file)
+        self.codec = self.header['codec']
+        self.filter = self.header['filter']
+        self.axes = self.header['axes']
+        self.data_shape = tuple(self.header['data_shape'])
+        self.frames_per_point = self.header['frames_per_point']
+        self.frame_shape = tuple(self.header['frame_shape'])
+        self.dtype = np.dtype(self.header['dtype'])
+
+    @property
+    def shape(self):
+        return (*self.data_shape, self.frames_per_point, *self.frame_shape)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        *index, shot = key
+        return self.frame(tuple(index), shot)
+
+    def read(self, point, shot, dtype):
+        if (point, shot) not in self.index:
+            return None
+        offset, size = self.index[(point, shot)]
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(size)
+        return unshuffle(decompress(self.codec, data), dtype, self.frame_shape)
+
+    def frame(self, index, shot):
+        point = flat_index(index, self.data_shape)
+        if self.filter == 'delta':
+            mean = self.read(point, MEAN_SHOT, np.int32)
+            delta = self.read(point, shot, np.int32)
+            if mean is None or delta is None:
+                return np.zeros(self.frame_shape, self.dtype)
+            return (mean + delta).astype(self.dtype)
+        frame = self.read(point, shot, self.dtype)
+        if frame is None:
+            return np.zeros(self.frame_shape, self.dtype)
+        return frame
+
+    def point(self, index):
+        return np.stack([self.frame(index, shot) for shot in range(self.frames_per_point)])
+
+    def first_shots(self):
+        """First frame of every point, shaped (*data_shape, H, W)"""
+        images = np.zeros((*self.data_shape, *self.frame_shape), self.dtype)
+        for index in np.ndindex(*self.data_shape):
+            images[index] = self.frame(index, 0)
+        return images
@@ -0,0 +1,138 @@
+"""Background subtract every point of saved acquisitions, using all cores.
+
+    python reprocess.py D:/Data/week12 --workers 8
+
+Every acquisition <name> found gets <name>_processed.npy, shaped
+(medium, defocus, wavelength, H, W) as uint16 from float_to_mono, and
+<name>_processed.yaml with the metadata and a summary of the processing.
+Workers read the raw data memory mapped, one point at a time, and write to
+<name>_processed.partial.npy, which only replaces the output once every point
+succeeded. Points that were never acquired stay zero.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+import processing as pc
+from dataset_reader import open_acquisition, base_path, data_files
+
+SUFFIX = '_processed'
+
+
+def process_point(frames, averaging):
+    """Background subtracted image of one grid photo, as saved by save_processed_photo"""
+    n = len(frames) - averaging
+    if n < 1:
+        raise ValueError('Acquisition has no background positions')
+    background = pc.common_background(frames[-(n+1):])
+    image = np.mean(frames[:averaging], axis=0)
+    return pc.float_to_mono(pc.background_subtracted(image, background))
+
+
+def process_points(path, output, points):
+    """Worker: process a batch of points, one point in memory at a time"""
+    with open_acquisition(path) as data:
+        result = np.load(output, mmap_mode='r+')
+        for point in points:
+            result[point] = process_point(data[point], data.averaging)
+        result.flush()
+    return len(points)
+
+
+def find_acquisitions(paths):
+    """Saved acquisitions among the given files and directories"""
+    found = []
+    for path in paths:
+        path = Path(path)
+        candidates = sorted(path.rglob('*.yaml')) if path.is_dir() else [path]
+        for candidate in candidates:
+            base = base_path(candidate)
+            if base.name.endswith(SUFFIX):
+                continue
+            try:
+                data_files(base)
+            except FileNotFoundError:
+                continue
+            if base not in found:
+                found.append(base)
+    return found
+
+
+def batches(points, size):
+    for i in range(0, len(points), size):
+        yield points[i:i+size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Background subtract saved acquisitions')
+    parser.add_argument('paths', nargs='+', help='acquisition files or directories to search')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--batch', type=int, default=8, help='points per task')
+    parser.add_argument('--overwrite', action='store_true', help='process acquisitions that were already processed')
+    parser.add_argument('--summary', help='write a summary of all acquisitions to this YAML file')
+    args = parser.parse_args()
+
+    acquisitions = find_acquisitions(args.paths)
+    print(f'Found {len(acquisitions)} acquisitions')
+
+    summary = []
+    with ProcessPoolExecutor(args.workers) as pool:
+        for path in acquisitions:
+            output = path.with_name(path.name + SUFFIX + '.npy')
+            if output.exists() and not args.overwrite:
+                print(f'Skipping {path}, already processed')
+                continue
+            start = time.monotonic()
+            with open_acquisition(path) as data:
+                shape = data.shape
+                metadata = data.metadata
+                acquired = data.acquired
+            # Points a cancelled run never took are zeros, leave them zero in the output too
+            points = [point for point in np.ndindex(*shape[:3]) if acquired[point]]
+            partial = path.with_name(path.name + SUFFIX + '.partial.npy')
+            np.lib.format.open_memmap(partial, mode='w+', dtype=np.uint16, shape=(*shape[:3], *shape[4:])).flush()
+
+            futures = [pool.submit(process_points, path, partial, batch) for batch in batches(points, args.batch)]
+            done = 0
+            failed = None
+            for future in as_completed(futures):
+                try:
+                    done += future.result()
+                except Exception as e:
+                    failed = str(e)
+            duration = time.monotonic() - start
+            if failed is not None:
+                # Never leave a half written output that looks processed
+                partial.unlink()
+                print(f'{path}: failed: {failed}')
+            else:
+                os.replace(partial, output)
+                print(f'{path}: {done} points in {duration:.1f} s')
+
+            result = {
+                'Source': str(path),
+                'Points': done,
+                'Shape': list(shape[:3]) + list(shape[4:]),
+                'Duration [s]': round(duration, 1),
+                'Error': failed}
+            summary.append(result)
+            if failed is not None:
+                continue
+            with open(path.with_name(path.name + SUFFIX + '.yaml'), 'w') as file:
+                yaml.dump(dict(metadata, **{'Processing.' + key: value for key, value in result.items()}), file)
+
+    total = sum(result['Points'] for result in summary)
+    errors = sum(result['Error'] is not None for result in summary)
+    print(f'Processed {total} points of {len(summary)} acquisitions, {errors} failed')
+    if args.summary is not None:
+        with open(args.summary, 'w') as file:
+            yaml.dump(summary, file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+from collections import namedtuple
+import numpy as np
+
+# kind is 'set' (move axis to values[index]), 'capture' (grid photo at point) or
+# 'flush' (all points for this index of the split axis are done)
+Step = namedtuple('Step', ['kind', 'axis', 'index', 'value', 'point'])
+
+
+class SweepPlan:
+    """Flat list of device setpoints and captures compiled from sweep axes.
+
+    The axes are given outer to inner in canonical order, which fixes the layout of
+    the saved data. The execution order can be different; every capture carries its
+    canonical index so the data always ends up in the same place.
+    """
+    def __init__(self, axes, serpentine=False, order=None, split_axis=None):
+        self.axes = [(name, np.asarray(values)) for name, values in axes]
+        self.names = [name for name, _ in self.axes]
+        self.serpentine = serpentine
+        self.order = list(order) if order is not None else list(self.names)
+        if sorted(self.order) != sorted(self.names):
+            raise ValueError(f'Execution order {self.order} does not match axes {self.names}')
+        # Data is split in one file per value of this axis, only possible when it is outermost
+        self.requested_split_axis = split_axis
+        self.split_axis = split_axis if self.order[:1] == [split_axis] else None
+        self.steps = self.compile()
+
+    @property
+    def shape(self):
+        return tuple(len(values) for _, values in self.axes)
+
+    @property
+    def data_axes(self):
+        """Axes of a single saved file"""
+        return [name for name in self.names if name != self.split_axis]
+
+    @property
+    def data_shape(self):
+        return tuple(len(self.values(name)) for name in self.data_axes)
+
+    @property
+    def number_of_points(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def values(self, name):
+        for axis, values in self.axes:
+            if axis == name:
+                return values
+        return None
+
+    def data_index(self, point):
+        """Index of a point within its saved file"""
+        return tuple(i for name, i in zip(self.names, point) if name != self.split_axis)
+
+    def compile(self):
+        steps = []
+        current = {}
+        passes = {name: 0 for name in self.order}
+
+        def visit(depth, point):
+            if depth == len(self.order):
+                steps.append(Step('capture', None, None, None, tuple(point[name] for name in self.names)))
+                return
+            name = self.order[depth]
+            values = self.values(name)
+            indices = list(range(len(values)))
+            if self.serpentine and passes[name] % 2 == 1:
+                indices.reverse()
+            passes[name] += 1
+            for i in indices:
+                # Serpentine turns leave the axis where it is
+                if current.get(name) != i:
+                    steps.append(Step('set', name, i, values[i], None))
+                    current[name] = i
+                point[name] = i
+                visit(depth + 1, point)
+                if depth == 0 and name == self.split_axis:
+                    steps.append(Step('flush', name, i, values[i], None))
+
+        visit(0, {})
+        return steps
+
+    def reordered(self, costs):
+        """Same plan with the axes that are most expensive to move outermost.
+
+        A requested split axis stays outermost, its files are written one after another.
+        """
+        order = sorted(self.order, key=lambda name: (name != self.requested_split_axis, -costs.get(name, 0)))
+        return SweepPlan(self.axes, self.serpentine, order, self.requested_split_axis)
+
+    def moves(self):
+        """Number of setpoint changes per axis"""
+        counts = {name: 0 for name in self.names}
+        for step in self.steps:
+            if step.kind == 'set':
+                counts[step.axis] += 1
+        return counts
+
+    def to_dict(self) -> dict:
+        return {
+            'axes': [[name, values.tolist()] for name, values in self.axes],
+            'order': list(self.order),
+            'serpentine': bool(self.serpentine),
+            'split_axis': self.requested_split_axis}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls([(name, values) for name, values in data['axes']], data['serpentine'], data['order'], data['split_axis'])
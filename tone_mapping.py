@@ -0,0 +1,98 @@
+"""Conversion of 16 bit frames to 8 bit for display and export.
+
+All settings (window, gamma) are baked into a lookup table with an entry per
+16 bit value, so mapping a frame is a single np.take into a reused buffer.
+"""
+import numpy as np
+
+LEVELS = 65536
+# Auto contrast ignores the darkest and brightest pixels, in percent
+AUTO_PERCENTILES = (0.1, 99.9)
+# Auto contrast looks at every n-th pixel in both directions
+AUTO_STRIDE = 4
+
+
+def histogram(frame, stride=AUTO_STRIDE):
+    """Counts of every 16 bit value in a subsampled frame.
+
+    8 bit values v count as v*257, the 16 bit value they are mapped by.
+    """
+    values = np.ravel(frame[::stride, ::stride])
+    if values.dtype == np.uint8:
+        values = values.astype(np.uint16)*257
+    return np.bincount(values, minlength=LEVELS)
+
+
+def percentile_window(counts, percentiles=AUTO_PERCENTILES):
+    """Values at the given percentiles of a histogram"""
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    if total == 0:
+        return 0, LEVELS - 1
+    low, high = np.searchsorted(cumulative, [total*percentiles[0]/100, total*percentiles[1]/100])
+    return int(low), int(max(high, low + 1))
+
+
+class ToneMapper:
+    """Window/level and gamma mapping of 16 bit frames to 8 bit.
+
+    With auto contrast on, the window follows the percentiles of every mapped frame.
+    """
+    def __init__(self, low=0, high=LEVELS - 1, gamma=1.0, auto=False):
+        self.low = low
+        self.high = high
+        self.gamma = gamma
+        self.auto = auto
+        self.lut = None
+        self.lut8 = None
+        self.buffer = None
+
+    def set_window(self, low, high):
+        low, high = int(np.clip(low, 0, LEVELS - 2)), int(np.clip(high, 1, LEVELS - 1))
+        if (low, high) != (self.low, self.high):
+            self.low, self.high = low, max(high, low + 1)
+            self.lut = None
+
+    def set_level(self, level, width):
+        self.set_window(level - width/2, level + width/2)
+
+    def set_gamma(self, gamma):
+        if gamma != self.gamma:
+            self.gamma = gamma
+            self.lut = None
+
+    def set_auto(self, auto):
+        self.auto = auto
+
+    def fixed(self, frames):
+        """Mapper without auto contrast, with the window auto contrast would give over all frames"""
+        mapper = ToneMapper(self.low, self.high, self.gamma)
+        if self.auto:
+            counts = sum(histogram(frame) for frame in frames)
+            mapper.set_window(*percentile_window(counts))
+        return mapper
+
+    def build_lut(self):
+        values = np.clip((np.arange(LEVELS, dtype=np.float32) - self.low)/(self.high - self.low), 0, 1)
+        if self.gamma != 1:
+            values **= 1/self.gamma
+        self.lut = np.round(values*255).astype(np.uint8)
+        # 8 bit frames are treated as the top byte of a 16 bit value
+        self.lut8 = self.lut[np.arange(256)*257]
+
+    def apply(self, frame: np.ndarray, statistics=None) -> np.ndarray:
+        """8 bit version of a frame, valid until the next call.
+
+        Auto contrast uses the percentiles of statistics, e.g. the whole frame a
+        crop was taken from, or of the frame itself when it is None.
+        """
+        statistics = frame if statistics is None else statistics
+        if self.auto and statistics.dtype in (np.uint8, np.uint16):
+            self.set_window(*percentile_window(histogram(statistics)))
+        if self.lut is None:
+            self.build_lut()
+        lut = self.lut8 if frame.dtype == np.uint8 else self.lut
+        if self.buffer is None or self.buffer.shape != frame.shape:
+            self.buffer = np.empty(frame.shape, dtype=np.uint8)
+        np.take(lut, frame, out=self.buffer)
+        return self.buffer
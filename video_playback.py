@@ -0,0 +1,305 @@
+"""Recording videos to disk and playing them back frame by frame.
+
+Recordings are streamed to a raw file, <name>.raw, holding the frames back to
+back, with <name>.yaml giving the frame shape, dtype and frame rate. Playback
+memory maps raw recordings, .npy stacks and uncompressed multi page TIFFs, so
+only the frames around the playback position are ever read.
+"""
+from collections import OrderedDict
+from pathlib import Path
+import os
+import queue
+import shutil
+
+import numpy as np
+import tifffile as tiff
+import yaml
+from PySide6.QtCore import QObject, QThread, QTimer, QElapsedTimer, QMutex, QMutexLocker, QWaitCondition, Qt, Signal
+
+# Frames read ahead of the playback position
+PREFETCH = 16
+DEFAULT_FPS = 30.0
+RAW_SUFFIX = '.raw'
+# Frames waiting for the disk before the recording drops them
+RECORD_QUEUE_DEPTH = 64
+
+
+def read_info(path):
+    """Contents of the sidecar <name>.yaml of a recording, empty if there is none"""
+    info = Path(path).with_suffix('.yaml')
+    if not info.exists():
+        return {}
+    with open(info) as file:
+        return yaml.safe_load(file) or {}
+
+
+def move_file(source, destination):
+    """Move a file, also to another drive, replacing what is at the destination"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    shutil.move(source, destination)
+
+
+class VideoRecorder(QThread):
+    """Appends frames to a raw recording on a worker thread, so recordings are not limited by memory"""
+    failed = Signal(str)
+    def __init__(self, path, fps, metadata=None, parent=None):
+        super().__init__(parent)
+        self.path = Path(path)
+        self.fps = fps
+        # Stored in the sidecar next to the video description
+        self.metadata = metadata or {}
+        self.file = open(self.path, 'wb')
+        self.shape = None
+        self.dtype = None
+        self.frames = 0
+        self.dropped = 0
+        # Frames of another size, after the ROI changed while recording
+        self.resized = 0
+        self.queue = queue.Queue(RECORD_QUEUE_DEPTH)
+
+    def write(self, frame: np.ndarray):
+        """Queue a frame, dropped when the disk falls behind"""
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.write_frame(frame)
+            except OSError as e:
+                self.failed.emit(f'Writing the recording failed: {e}')
+                break
+
+    def write_frame(self, frame: np.ndarray):
+        frame = np.squeeze(frame, axis=-1) if frame.ndim == 3 else frame
+        if self.shape is None:
+            self.shape = frame.shape
+            self.dtype = frame.dtype
+            self.write_info()
+        elif frame.shape != self.shape:
+            self.resized += 1
+            return
+        self.file.write(np.ascontiguousarray(frame, dtype=self.dtype).tobytes())
+        self.frames += 1
+
+    def write_info(self):
+        with open(self.path.with_suffix('.yaml'), 'w') as file:
+            yaml.dump(dict(self.metadata, **{
+                'Video.frames': self.frames,
+                'Video.shape': list(self.shape),
+                'Video.dtype': str(self.dtype),
+                'Camera.fps': float(self.fps)}), file)
+
+    def close(self):
+        """Write what is still queued, returns the number of frames recorded"""
+        if self.isRunning():
+            self.queue.put(None)
+            self.wait()
+        self.file.close()
+        if self.shape is not None:
+            self.write_info()
+        return self.frames
+
+
+class VideoSource:
+    """Frames of a recording, decoded one at a time.
+
+    Raw recordings (.raw), .npy stacks and uncompressed TIFFs are memory mapped;
+    other TIFFs are decoded page by page. Frames can be read from several threads.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tif = None
+        # A TiffFile has one file handle, the prefetcher and a seek must take turns
+        self.mutex = QMutex()
+        info = read_info(self.path)
+        if self.path.suffix == RAW_SUFFIX:
+            shape = tuple(info['Video.shape'])
+            dtype = np.dtype(info['Video.dtype'])
+            # Counted from the file size, so recordings that were cut off still open
+            count = self.path.stat().st_size//(dtype.itemsize*int(np.prod(shape)))
+            self.frames = np.memmap(self.path, dtype=dtype, mode='r', shape=(count, *shape))
+        elif self.path.suffix == '.npy':
+            self.frames = np.load(self.path, mmap_mode='r')
+        else:
+            try:
+                self.frames = tiff.memmap(self.path)
+            except ValueError:
+                # Compressed or not contiguous
+                self.frames = None
+                self.tif = tiff.TiffFile(self.path)
+        if self.frames is not None and self.frames.ndim == 2:
+            self.frames = self.frames[np.newaxis]
+
+        self.fps = float(info.get('Camera.fps') or DEFAULT_FPS)
+
+    def __len__(self):
+        if self.frames is not None:
+            return len(self.frames)
+        with QMutexLocker(self.mutex):
+            return len(self.tif.pages)
+
+    def frame(self, index) -> np.ndarray:
+        with QMutexLocker(self.mutex):
+            if self.frames is not None:
+                frame = np.array(self.frames[index])
+            else:
+                frame = self.tif.pages[index].asarray()
+        if frame.ndim == 3 and frame.shape[-1] == 1:
+            frame = frame[..., 0]
+        return frame
+
+    @property
+    def shape(self):
+        if self.frames is not None:
+            return self.frames.shape[1:3]
+        with QMutexLocker(self.mutex):
+            return self.tif.pages[0].shape[:2]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def close(self):
+        if self.tif is not None:
+            self.tif.close()
+        self.frames = None
+
+
+class FramePrefetcher(QThread):
+    """Reads the frames after the playback position into a small cache"""
+    failed = Signal(str)
+    def __init__(self, source: VideoSource, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.cache = OrderedDict()
+        self.position = 0
+        self.running = True
+        self.mutex = QMutex()
+        self.wanted = QWaitCondition()
+
+    def window(self):
+        return range(self.position, min(self.position + PREFETCH, len(self.source)))
+
+    def request(self, index):
+        with QMutexLocker(self.mutex):
+            self.position = index
+            # Drop what is behind the playback position
+            for cached in list(self.cache):
+                if cached < index - 1 or cached >= index + PREFETCH:
+                    del self.cache[cached]
+            self.wanted.wakeAll()
+
+    def get(self, index):
+        with QMutexLocker(self.mutex):
+            frame = self.cache.get(index)
+        if frame is None:
+            # Not read ahead yet, e.g. after seeking
+            frame = self.source.frame(index)
+            with QMutexLocker(self.mutex):
+                self.cache[index] = frame
+        return frame
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.running = False
+            self.wanted.wakeAll()
+        self.wait()
+
+    def run(self):
+        while True:
+            self.mutex.lock()
+            missing = [i for i in self.window() if i not in self.cache]
+            while self.running and len(missing) == 0:
+                self.wanted.wait(self.mutex)
+                missing = [i for i in self.window() if i not in self.cache]
+            if not self.running:
+                self.mutex.unlock()
+                break
+            index = missing[0]
+            self.mutex.unlock()
+
+            try:
+                frame = self.source.frame(index)
+            except Exception as e:
+                self.failed.emit(f'Reading frame {index} failed: {e}')
+                break
+
+            with QMutexLocker(self.mutex):
+                if index in self.window():
+                    self.cache[index] = frame
+
+
+class VideoPlayer(QObject):
+    """Plays a recording at its frame rate, skipping frames when display falls behind"""
+    frame_changed = Signal(np.ndarray, int)
+    playing_changed = Signal(bool)
+    failed = Signal(str)
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.source = VideoSource(path)
+        self.fps = self.source.fps
+        self.position = 0
+        self.start_position = 0
+
+        self.prefetcher = FramePrefetcher(self.source, self)
+        self.prefetcher.failed.connect(self.failed)
+        self.prefetcher.start()
+
+        self.clock = QElapsedTimer()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+
+    def __len__(self):
+        return len(self.source)
+
+    @property
+    def playing(self):
+        return self.timer.isActive()
+
+    def play(self):
+        if self.position >= len(self) - 1:
+            self.position = 0
+        self.start_position = self.position
+        self.clock.start()
+        # Check twice per frame, the shown frame follows from the elapsed time
+        self.timer.start(max(1, int(500/self.fps)))
+        self.playing_changed.emit(True)
+
+    def pause(self):
+        self.timer.stop()
+        self.playing_changed.emit(False)
+
+    def set_fps(self, fps):
+        self.fps = fps
+        if self.playing:
+            self.play()
+
+    def tick(self):
+        index = self.start_position + int(self.clock.elapsed()*self.fps/1000)
+        if index >= len(self):
+            self.seek(len(self) - 1)
+            self.pause()
+        elif index != self.position:
+            self.seek(index)
+
+    def seek(self, index):
+        self.position = int(np.clip(index, 0, len(self) - 1))
+        if self.playing:
+            # Continue at the new position
+            self.start_position = self.position
+            self.clock.restart()
+        self.prefetcher.request(self.position + 1)
+        self.frame_changed.emit(self.prefetcher.get(self.position), self.position)
+
+    def close(self):
+        self.timer.stop()
+        self.prefetcher.stop()
+        self.source.close()
@@ -3,6 +3,11 @@ from .laser_window import LaserWindow
 from .video_view import VideoView
 from .sweep import SweepWindow
 from .pump_window import PumpWindow
+from .dataset_browser import DatasetBrowser
+from .playback_bar import PlaybackBar
+from .display_window import DisplayWindow
+from .histogram_window import HistogramWindow
+from .events_window import EventsWindow
 
 __all__ = [
     "SweepDialog",
@@ -10,5 +15,10 @@ __all__ = [
     "LaserWindow",
     "VideoView",
     "SweepWindow",
-    "PumpWindow"
+    "PumpWindow",
+    "DatasetBrowser",
+    "PlaybackBar",
+    "DisplayWindow",
+    "HistogramWindow",
+    "EventsWindow"
 ]
\ No newline at end of file
@@ -0,0 +1,245 @@
+from PySide6.QtCore import Qt, QThread, Signal, QSize
+from PySide6.QtGui import QIcon, QPixmap, QImage
+from PySide6.QtWidgets import QDockWidget, QWidget, QListWidget, QListWidgetItem, QSlider, QLabel, QFormLayout, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog
+
+from pathlib import Path
+import numpy as np
+import yaml
+
+from .video_view import VideoView
+from dataset_reader import open_acquisition, AXES
+from acquisition_catalog import AcquisitionCatalog, DEFAULT_DATABASE
+import pyramid
+
+
+class PyramidBuilder(QThread):
+    """Builds the pyramid of an acquisition in the background"""
+    progress = Signal(int, int)
+    built = Signal(str)
+    failed = Signal(str)
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        try:
+            pyramid.build_pyramid(self.path, self.progress.emit)
+            self.built.emit(str(self.path))
+        except Exception as e:
+            self.failed.emit(f'Building the pyramid of {Path(self.path).name} failed: {e}')
+
+
+class ThumbnailLoader(QThread):
+    """Reads the coarsest pyramid level of acquisitions, for their thumbnails"""
+    loaded = Signal(str, np.ndarray)
+    def __init__(self, paths, parent=None):
+        super().__init__(parent)
+        self.paths = paths
+        self.cancelled = False
+
+    def run(self):
+        for path in self.paths:
+            if self.cancelled:
+                break
+            try:
+                count = pyramid.levels(path)
+                if count is not None and count > 0:
+                    self.loaded.emit(str(path), np.array(pyramid.open_level(path, count)[0, 0, 0, 0]))
+            except (OSError, ValueError, KeyError, yaml.YAMLError):
+                continue
+
+
+def to_pixmap(frame):
+    """8 bit pixmap of a frame, stretched between its minimum and maximum"""
+    frame = np.asarray(frame, dtype=np.float32)
+    low, high = frame.min(), frame.max()
+    image = np.ascontiguousarray((frame - low)*(255/max(high - low, 1))).astype(np.uint8)
+    height, width = image.shape
+    return QPixmap.fromImage(QImage(image.data, width, height, width, QImage.Format_Grayscale8))
+
+
+class DatasetBrowser(QDockWidget):
+    """Saved acquisitions from the catalog, with sliders to scrub through their axes.
+
+    Frames are read from the pyramid level that matches the zoom of the view, so
+    scrubbing a zoomed out view never touches the full resolution data.
+    """
+    def __init__(self, parent):
+        super().__init__(parent=parent)
+        self.setWindowTitle("Dataset Browser")
+        self._widget = QWidget(self)
+
+        self.catalog = None
+        self.data = None
+        self.path = None
+        self.levels = None
+        self.level_data = {}
+        self.builders = {}
+        self.thumbnails = None
+
+        self.list = QListWidget()
+        self.list.setIconSize(QSize(96, 96))
+        self.list.currentItemChanged.connect(self.select)
+
+        self.add_button = QPushButton('Add Folder')
+        self.add_button.clicked.connect(self.add_folder)
+        self.refresh_button = QPushButton('Refresh')
+        self.refresh_button.clicked.connect(self.refresh)
+
+        self.view = VideoView(self)
+        self.view.setMinimumSize(320, 240)
+        self.view.zoom_changed.connect(self.show_frame)
+
+        self.sliders = {}
+        self.labels = {}
+        axes_layout = QFormLayout()
+        for axis in AXES:
+            slider = QSlider(Qt.Orientation.Horizontal)
+            slider.valueChanged.connect(self.show_frame)
+            label = QLabel()
+            label.setMinimumWidth(60)
+            row = QHBoxLayout()
+            row.addWidget(slider)
+            row.addWidget(label)
+            axes_layout.addRow(axis.capitalize(), row)
+            self.sliders[axis] = slider
+            self.labels[axis] = label
+
+        self.status = QLabel()
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.add_button)
+        button_layout.addWidget(self.refresh_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.list)
+        layout.addLayout(button_layout)
+        layout.addWidget(self.view, stretch=1)
+        layout.addLayout(axes_layout)
+        layout.addWidget(self.status)
+        self._widget.setLayout(layout)
+
+        self.setWidget(self._widget)
+        self.visibilityChanged.connect(lambda visible: visible and self.refresh())
+
+    def open_catalog(self):
+        if self.catalog is None:
+            self.catalog = AcquisitionCatalog(DEFAULT_DATABASE)
+        return self.catalog
+
+    def refresh(self):
+        current = self.path
+        self.list.blockSignals(True)
+        self.list.clear()
+        for row in self.open_catalog().query():
+            path = Path(row['path'])
+            item = QListWidgetItem(f"{path.name}\n{row['timestamp'][:16].replace('T', ' ')}")
+            item.setData(Qt.ItemDataRole.UserRole, str(path))
+            item.setToolTip(f"{path}\n{row['axes'] or 'single point'}, {row['frames']} frames")
+            self.list.addItem(item)
+            if current is not None and path == current:
+                self.list.setCurrentItem(item)
+        self.list.blockSignals(False)
+        # Reading every pyramid would stall the GUI on large catalogs
+        if self.thumbnails is not None:
+            self.thumbnails.cancelled = True
+        self.thumbnails = self.load_thumbnails([self.list.item(i).data(Qt.ItemDataRole.UserRole) for i in range(self.list.count())])
+
+    def load_thumbnails(self, paths):
+        loader = ThumbnailLoader(paths, self)
+        loader.loaded.connect(self.set_thumbnail)
+        loader.finished.connect(loader.deleteLater)
+        loader.start()
+        return loader
+
+    def set_thumbnail(self, path, frame):
+        for i in range(self.list.count()):
+            item = self.list.item(i)
+            if item.data(Qt.ItemDataRole.UserRole) == path:
+                item.setIcon(QIcon(to_pixmap(frame)))
+
+    def add_folder(self):
+        directory = QFileDialog.getExistingDirectory(self, 'Add Folder to Catalog')
+        if directory:
+            updated = self.open_catalog().scan(directory)
+            self.status.setText(f'Indexed {updated} acquisitions')
+            self.refresh()
+
+    def select(self, item, previous=None):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.level_data = {}
+        if item is None:
+            return
+        self.path = Path(item.data(Qt.ItemDataRole.UserRole))
+        try:
+            self.data = open_acquisition(self.path)
+        except (OSError, ValueError, KeyError, yaml.YAMLError) as e:
+            self.status.setText(f'Cannot open {self.path.name}: {e}')
+            return
+
+        for axis, length in zip(AXES, self.data.shape):
+            slider = self.sliders[axis]
+            slider.blockSignals(True)
+            slider.setRange(0, length - 1)
+            slider.setValue(0)
+            slider.setEnabled(length > 1)
+            slider.blockSignals(False)
+
+        self.levels = pyramid.levels(self.path)
+        if self.levels is None:
+            self.build(self.path)
+
+        height, width = self.data.frame_shape
+        self.view.reset_zoom()
+        self.view.set_size(width, height, width, height, 0, 0)
+        self.show_frame()
+
+    def build(self, path):
+        if str(path) in self.builders:
+            return
+        builder = PyramidBuilder(path, self)
+        # Methods, so the builder's signals are delivered on the GUI thread
+        builder.progress.connect(self.build_progress)
+        builder.built.connect(self.built)
+        builder.failed.connect(self.status.setText)
+        builder.finished.connect(lambda: self.builders.pop(str(path), None))
+        self.builders[str(path)] = builder
+        builder.start()
+
+    def build_progress(self, i, n):
+        self.status.setText(f'Building pyramid {i}/{n}')
+
+    def built(self, path):
+        self.status.setText('')
+        self.load_thumbnails([path])
+        path = Path(path)
+        if path == self.path:
+            self.levels = pyramid.levels(path)
+            self.level_data = {}
+            self.show_frame()
+
+    def visible_level(self):
+        """Coarsest level that still has a pixel per screen pixel"""
+        if self.levels is None or self.view.current_scale >= 1:
+            return 0
+        level = int(np.floor(np.log2(1/self.view.current_scale)))
+        return min(level, self.levels)
+
+    def show_frame(self):
+        if self.data is None:
+            return
+        index = tuple(self.sliders[axis].value() for axis in AXES)
+        for axis, i in zip(AXES, index):
+            value = self.data.coords[axis][i]
+            self.labels[axis].setText(f'{value:g}' if np.isfinite(value) else '')
+
+        level = self.visible_level()
+        if level == 0:
+            frame = self.data[index]
+        else:
+            if level not in self.level_data:
+                self.level_data[level] = pyramid.open_level(self.path, level)
+            frame = self.level_data[level][index]
+        self.view.update_image(np.ascontiguousarray(frame)[..., np.newaxis], 2**level)
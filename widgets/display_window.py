@@ -0,0 +1,43 @@
+from PySide6.QtCore import Signal
+from PySide6.QtWidgets import QFormLayout, QSpinBox, QDoubleSpinBox, QDockWidget, QWidget, QCheckBox
+
+from tone_mapping import ToneMapper, LEVELS
+
+
+class DisplayWindow(QDockWidget):
+    """Window, gamma and auto contrast of a tone mapper"""
+    changed = Signal()
+    def __init__(self, parent, tone_mapper: ToneMapper):
+        super().__init__(parent=parent)
+        self.setWindowTitle("Display")
+        self._widget = QWidget(self)
+        self.tone_mapper = tone_mapper
+
+        self.auto = QCheckBox()
+        self.auto.setToolTip('Stretch between the 0.1 and 99.9 percentiles of every frame')
+        self.auto.toggled.connect(self.update_mapper)
+        self.low = QSpinBox(minimum=0, maximum=LEVELS - 2, singleStep=256)
+        self.low.valueChanged.connect(self.update_mapper)
+        self.high = QSpinBox(minimum=1, maximum=LEVELS - 1, singleStep=256, value=LEVELS - 1)
+        self.high.valueChanged.connect(self.update_mapper)
+        self.gamma = QDoubleSpinBox(minimum=0.1, maximum=5, singleStep=0.1, decimals=2, value=1)
+        self.gamma.valueChanged.connect(self.update_mapper)
+
+        layout = QFormLayout()
+        layout.addRow("Auto contrast", self.auto)
+        layout.addRow("Black", self.low)
+        layout.addRow("White", self.high)
+        layout.addRow("Gamma", self.gamma)
+
+        self._widget.setLayout(layout)
+        self.setWidget(self._widget)
+
+    def update_mapper(self):
+        auto = self.auto.isChecked()
+        self.low.setEnabled(not auto)
+        self.high.setEnabled(not auto)
+        self.tone_mapper.set_auto(auto)
+        if not auto:
+            self.tone_mapper.set_window(self.low.value(), self.high.value())
+        self.tone_mapper.set_gamma(self.gamma.value())
+        self.changed.emit()
@@ -0,0 +1,60 @@
+from PySide6.QtCore import Signal
+from PySide6.QtWidgets import QDockWidget, QWidget, QFormLayout, QVBoxLayout, QHBoxLayout, QCheckBox, QDoubleSpinBox, QLabel, QPushButton
+
+import numpy as np
+
+from .histogram_window import Plot
+from event_detection import EventDetector, HISTOGRAM_RANGE
+
+
+class EventsWindow(QDockWidget):
+    """Settings and results of the live event detection"""
+    save_requested = Signal()
+    def __init__(self, parent, detector: EventDetector):
+        super().__init__(parent=parent)
+        self.setWindowTitle("Events")
+        self._widget = QWidget(self)
+        self.detector = detector
+
+        self.enabled = QCheckBox()
+        self.enabled.setToolTip('Detect spots in the ratiometric frames')
+        self.enabled.toggled.connect(self.detector.set_enabled)
+        self.sigma = QDoubleSpinBox(minimum=0.5, maximum=20, singleStep=0.5, decimals=1, value=2*detector.sigma, suffix=' px')
+        self.sigma.setToolTip('Size of the particles')
+        self.sigma.valueChanged.connect(lambda value: setattr(self.detector, 'sigma', value/2))
+        self.threshold = QDoubleSpinBox(minimum=0.0001, maximum=1, singleStep=0.001, decimals=4, value=detector.threshold)
+        self.threshold.setToolTip('Minimum band-passed contrast of an event')
+        self.threshold.valueChanged.connect(lambda value: setattr(self.detector, 'threshold', value))
+
+        self.histogram = Plot(self)
+        self.histogram.setToolTip(f'Contrast of all events, from {-HISTOGRAM_RANGE} to {HISTOGRAM_RANGE}')
+        self.count_label = QLabel('No events')
+
+        self.clear_button = QPushButton('Clear')
+        self.clear_button.clicked.connect(self.detector.clear)
+        self.save_button = QPushButton('Save')
+        self.save_button.clicked.connect(self.save_requested)
+
+        settings = QFormLayout()
+        settings.addRow("Detect", self.enabled)
+        settings.addRow("Size", self.sigma)
+        settings.addRow("Threshold", self.threshold)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.clear_button)
+        buttons.addWidget(self.save_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(settings)
+        layout.addWidget(self.histogram, stretch=1)
+        layout.addWidget(self.count_label)
+        layout.addLayout(buttons)
+        self._widget.setLayout(layout)
+        self.setWidget(self._widget)
+
+        self.detector.updated.connect(self.update_events)
+
+    def update_events(self, count: int, histogram: np.ndarray):
+        self.histogram.set_values(histogram, 0.5)
+        dropped = f', {self.detector.dropped} frames skipped' if self.detector.dropped else ''
+        self.count_label.setText(f'{count} events{dropped}')
@@ -0,0 +1,72 @@
+from PySide6.QtCore import Qt, Signal, QPointF
+from PySide6.QtGui import QPainter, QPen, QPolygonF, QColor
+from PySide6.QtWidgets import QDockWidget, QWidget, QVBoxLayout, QLabel, QPushButton
+
+import numpy as np
+
+
+class Plot(QWidget):
+    """Line plot of a 1D array, scaled to fit"""
+    def __init__(self, parent=None, log=False):
+        super().__init__(parent)
+        self.log = log
+        self.values = None
+        self.marker = None
+        self.setMinimumSize(200, 100)
+
+    def set_values(self, values, marker=None):
+        self.values = values
+        # Position of a vertical line, as a fraction of the width
+        self.marker = marker
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        if self.values is None or len(self.values) < 2:
+            return
+        values = np.log1p(self.values) if self.log else np.asarray(self.values, dtype=np.float64)
+        low, high = (0, values.max()) if self.log else (values.min(), values.max())
+        width, height = self.width() - 1, self.height() - 1
+        x = np.linspace(0, width, len(values))
+        y = height - (values - low)/max(high - low, 1e-12)*height
+        painter.setPen(QPen(Qt.white, 1))
+        painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(x, y)]))
+        if self.marker is not None:
+            painter.setPen(QPen(QColor(255, 64, 64), 1))
+            painter.drawLine(QPointF(self.marker*width, 0), QPointF(self.marker*width, height))
+
+
+class HistogramWindow(QDockWidget):
+    """Live intensity histogram, exposure headroom and a line profile"""
+    draw_profile = Signal()
+    def __init__(self, parent):
+        super().__init__(parent=parent)
+        self.setWindowTitle("Histogram")
+        self._widget = QWidget(self)
+
+        self.histogram = Plot(self, log=True)
+        self.exposure_label = QLabel()
+        self.profile = Plot(self)
+        self.profile_label = QLabel('Draw a line in the view to see its profile')
+        self.profile_button = QPushButton('Draw Profile')
+        self.profile_button.setCheckable(True)
+        self.profile_button.clicked.connect(self.draw_profile)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.histogram, stretch=1)
+        layout.addWidget(self.exposure_label)
+        layout.addWidget(self.profile_button)
+        layout.addWidget(self.profile, stretch=1)
+        layout.addWidget(self.profile_label)
+        self._widget.setLayout(layout)
+        self.setWidget(self._widget)
+
+    def update_histogram(self, counts: np.ndarray, maximum: int, saturated: float):
+        self.histogram.set_values(counts, maximum/65535)
+        headroom = 100*(1 - maximum/65535)
+        self.exposure_label.setText(f'Max {maximum} ({headroom:.0f}% headroom), {100*saturated:.2f}% saturated')
+
+    def update_profile(self, values: np.ndarray):
+        self.profile.set_values(values)
+        self.profile_label.setText(f'{len(values)} px, min {values.min()}, max {values.max()}, mean {values.mean():.0f}')
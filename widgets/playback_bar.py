@@ -0,0 +1,63 @@
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QPushButton, QSlider, QLabel, QDoubleSpinBox
+
+
+class PlaybackBar(QWidget):
+    """Controls of a recording shown in the video view"""
+    play_toggled = Signal(bool)
+    seek = Signal(int)
+    fps_changed = Signal(float)
+    close_requested = Signal()
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.play_button = QPushButton('Play')
+        self.play_button.setCheckable(True)
+        self.play_button.toggled.connect(self.play_toggled)
+
+        self.slider = QSlider(Qt.Orientation.Horizontal)
+        # Follow the slider while dragging, so scrubbing shows every position
+        self.slider.valueChanged.connect(self.seek)
+
+        self.frame_label = QLabel()
+        self.frame_label.setMinimumWidth(100)
+
+        self.fps_spinbox = QDoubleSpinBox()
+        self.fps_spinbox.setRange(0.1, 1000)
+        self.fps_spinbox.setDecimals(1)
+        self.fps_spinbox.setSuffix(' fps')
+        self.fps_spinbox.valueChanged.connect(self.fps_changed)
+
+        self.close_button = QPushButton('Close')
+        self.close_button.clicked.connect(self.close_requested)
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.play_button)
+        layout.addWidget(self.slider, stretch=1)
+        layout.addWidget(self.frame_label)
+        layout.addWidget(self.fps_spinbox)
+        layout.addWidget(self.close_button)
+        self.setLayout(layout)
+
+    def set_video(self, frames, fps):
+        self.slider.blockSignals(True)
+        self.slider.setRange(0, frames - 1)
+        self.slider.setValue(0)
+        self.slider.blockSignals(False)
+        self.fps_spinbox.blockSignals(True)
+        self.fps_spinbox.setValue(fps)
+        self.fps_spinbox.blockSignals(False)
+        self.set_position(0)
+
+    def set_position(self, index):
+        self.slider.blockSignals(True)
+        self.slider.setValue(index)
+        self.slider.blockSignals(False)
+        self.frame_label.setText(f'{index + 1} / {self.slider.maximum() + 1}')
+
+    def set_playing(self, playing):
+        self.play_button.blockSignals(True)
+        self.play_button.setChecked(playing)
+        self.play_button.setText('Pause' if playing else 'Play')
+        self.play_button.blockSignals(False)
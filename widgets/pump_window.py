@@ -1,5 +1,5 @@
 from PySide6.QtCore import Signal, QRegularExpression
-from PySide6.QtWidgets import QFormLayout, QSpinBox, QDockWidget, QWidget, QPushButton, QCheckBox, QGroupBox, QVBoxLayout, QLineEdit, QComboBox, QButtonGroup, QHBoxLayout
+from PySide6.QtWidgets import QFormLayout, QSpinBox, QDockWidget, QWidget, QPushButton, QCheckBox, QGroupBox, QVBoxLayout, QLineEdit, QComboBox, QButtonGroup, QHBoxLayout, QLabel
 from PySide6.QtGui import QRegularExpressionValidator
 
 class PumpWindow(QDockWidget):
@@ -38,9 +38,11 @@ class PumpWindow(QDockWidget):
         self.clean_ports.setValidator(validator)
         self.clean_button = QPushButton("Clean")
         self.clean_button.released.connect(self.clean)
+        self.clean_status = QLabel()
         clean_layout = QVBoxLayout()
         clean_layout.addWidget(self.clean_ports)
         clean_layout.addWidget(self.clean_button)
+        clean_layout.addWidget(self.clean_status)
 
         main_layout = QVBoxLayout()
         layout = QFormLayout()
@@ -76,4 +78,19 @@ class PumpWindow(QDockWidget):
         ports.discard(1)
         ports.discard(7)
         ports.discard(0)
-        self.start_clean.emit(list(ports))
\ No newline at end of file
+        self.start_clean.emit(list(ports))
+
+    def set_controls_enabled(self, enabled):
+        for control in (self.port, self.volume, self.pickup_button, self.dispense_button, self.clean_ports, self.clean_button):
+            control.setEnabled(enabled)
+
+    def program_started(self, duration):
+        # The pump is busy until the program is done
+        self.set_controls_enabled(False)
+        minutes, seconds = divmod(int(duration), 60)
+        self.clean_status.setText(f'Cleaning, about {minutes}:{seconds:02d} min')
+
+    def program_finished(self):
+        self.set_controls_enabled(True)
+        self.update_controls(self.port.currentText())
+        self.clean_status.clear()
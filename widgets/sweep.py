@@ -1,5 +1,5 @@
 from PySide6.QtCore import Signal, QRegularExpression
-from PySide6.QtWidgets import QFormLayout, QDoubleSpinBox, QSpinBox, QDockWidget, QWidget, QPushButton, QCheckBox, QGroupBox, QVBoxLayout, QLineEdit
+from PySide6.QtWidgets import QFormLayout, QDoubleSpinBox, QSpinBox, QDockWidget, QWidget, QPushButton, QCheckBox, QGroupBox, QVBoxLayout, QLineEdit, QComboBox
 from PySide6.QtGui import QRegularExpressionValidator
 
 class SweepWindow(QDockWidget):
@@ -33,6 +33,29 @@ class SweepWindow(QDockWidget):
         validator = QRegularExpressionValidator(QRegularExpression(r"^\d*$"))
         self.media.setValidator(validator)
 
+        # Background grid
+        self.background_num = QSpinBox(minimum=1, maximum=24, value=3)
+        self.background_pattern = QComboBox()
+        self.background_pattern.addItems(['quadrant', 'square', 'ring'])
+        self.background_spacing = QDoubleSpinBox(minimum=0.5, maximum=50, singleStep=0.5, value=4, decimals=1, suffix=f" micron")
+
+        self.serpentine = QCheckBox('Serpentine order')
+        self.serpentine.setToolTip('Alternate the direction of inner sweeps to avoid moving back to the start')
+
+        self.optimize_order = QCheckBox('Optimize axis order')
+        self.optimize_order.setToolTip('Sweep the axes that are fastest to move in the innermost loop')
+        self.optimize_order.setChecked(True)
+
+        # Storage
+        self.compress = QCheckBox()
+        self.compress.setToolTip('Store the raw frames losslessly compressed in a .rawz archive')
+        self.compress.toggled.connect(self.update_controls)
+        self.compression_filter = QComboBox()
+        self.compression_filter.addItems(['shuffle', 'delta'])
+        self.compression_filter.setToolTip('shuffle: group the bytes of every pixel\ndelta: store shots as difference to their mean')
+        self.ome_tiff = QCheckBox()
+        self.ome_tiff.setToolTip('Also export all planes to a tiled OME-TIFF after the acquisition')
+
         self.startButton = QPushButton('Start')
         self.startButton.clicked.connect(self.sweep)
 
@@ -61,10 +84,28 @@ class SweepWindow(QDockWidget):
         media_group.setLayout(layout)
 
 
+        background_group = QGroupBox("Background")
+        layout = QFormLayout()
+        layout.addRow("Positions", self.background_num)
+        layout.addRow("Pattern", self.background_pattern)
+        layout.addRow("Spacing", self.background_spacing)
+        background_group.setLayout(layout)
+
+        storage_group = QGroupBox("Storage")
+        layout = QFormLayout()
+        layout.addRow("Compress", self.compress)
+        layout.addRow("Filter", self.compression_filter)
+        layout.addRow("OME-TIFF", self.ome_tiff)
+        storage_group.setLayout(layout)
+
         layout = QVBoxLayout()
         layout.addWidget(laser_group)
         layout.addWidget(defocus_group)
         layout.addWidget(media_group)
+        layout.addWidget(background_group)
+        layout.addWidget(storage_group)
+        layout.addWidget(self.serpentine)
+        layout.addWidget(self.optimize_order)
         layout.addWidget(self.startButton)
         layout.addStretch(-1)
         self._widget.setLayout(layout)
@@ -86,11 +127,19 @@ class SweepWindow(QDockWidget):
 
         self.media.setEnabled(media)
 
+        self.compression_filter.setEnabled(self.compress.isChecked())
+
         self.startButton.setEnabled(laser or defocus or media)
 
 
     def sweep(self):
         params = dict()
+        params['serpentine'] = self.serpentine.isChecked()
+        params['optimize_order'] = self.optimize_order.isChecked()
+        params['background'] = (self.background_num.value(), self.background_pattern.currentText(), self.background_spacing.value())
+        params['archive'] = self.compression_filter.currentText() if self.compress.isChecked() else None
+        params['ome_tiff'] = self.ome_tiff.isChecked()
+
         if self.media_sweep.isChecked():
             media = [int(char) for char in self.media.text()]
             params['media'] = media
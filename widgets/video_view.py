@@ -1,13 +1,17 @@
-from PySide6.QtCore import QRect, QMargins, Qt, QPoint, Signal
+from PySide6.QtCore import QRect, QMargins, Qt, QPoint, QLineF, Signal
 from PySide6.QtGui import QPixmap, QImage, QPen, QBrush
-from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsRectItem
+from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsRectItem, QGraphicsLineItem
 
 from numpy.typing import NDArray
 import numpy as np
 
+from tone_mapping import ToneMapper
+
 class VideoView(QGraphicsView):
     roi_set = Signal(QRect)
     move_stage = Signal(np.ndarray)
+    zoom_changed = Signal(float)
+    profile_set = Signal(np.ndarray)
     def __init__(self, parent=None):
         super().__init__(parent)
         self._scene = QGraphicsScene(self)
@@ -26,6 +30,11 @@ class VideoView(QGraphicsView):
         self.roi_graphic.setPen(QPen(Qt.red, 2))
         self._scene.addItem(self.roi_graphic)
 
+        self.profile_graphic = QGraphicsLineItem()
+        self.profile_graphic.setZValue(1)
+        self.profile_graphic.setPen(QPen(Qt.yellow, 0))
+        self._scene.addItem(self.profile_graphic)
+
         self.setMinimumSize(640, 480)
         self.setScene(self._scene)
         self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
@@ -36,6 +45,14 @@ class VideoView(QGraphicsView):
         self.displacement_thresh = 10
 
         self._mode = "navigation"
+        # Maps 16 bit frames to the 8 bit image, may be shared with other views or exports
+        self.tone_mapper = ToneMapper()
+        self.last_frame = None
+        # Position of the frame on the sensor, in sensor pixels
+        self.frame_offset = QPoint(0, 0)
+        # Panning shows a different part of a still frame
+        self.horizontalScrollBar().valueChanged.connect(self.refresh)
+        self.verticalScrollBar().valueChanged.connect(self.refresh)
     
     @property
     def mode(self) -> str:
@@ -45,7 +62,7 @@ class VideoView(QGraphicsView):
     def mode(self, new_mode: str):
         if (new_mode == "navigation" or new_mode =="move"):
             self.setDragMode(QGraphicsView.ScrollHandDrag)
-        elif (new_mode == "roi"):
+        elif (new_mode == "roi" or new_mode == "profile"):
             self.setDragMode(QGraphicsView.NoDrag)
         else:
             raise ValueError(f"Unexpected input: mode {new_mode} unknown")
@@ -58,22 +75,44 @@ class VideoView(QGraphicsView):
         self.max_roi_width = max_width
         self.max_roi_height = max_height
         self.background.setRect(QRect(0, 0, max_width, max_height))
-        self.camera_display.setOffset(QPoint(offset_x, offset_y))
+        self.frame_offset = QPoint(offset_x, offset_y)
         self.scale(0.25,0.25)
         self.current_scale *= 0.25
         self.update_margins()
         self.centerOn(self.background.boundingRect().center())
+        # Before announcing the zoom, listeners may show another frame
+        self.refresh()
+        self.zoom_changed.emit(self.current_scale)
         
 
-    def update_image(self, frame):
-        height, width, channels = np.shape(frame)
-            
-        if frame.dtype == np.uint16:
-            self.camera_display.setPixmap(QPixmap.fromImage(QImage(frame.data, width, height, 2*channels*width, QImage.Format_Grayscale16)))
-        elif frame.dtype == np.uint8:
-            self.camera_display.setPixmap(QPixmap.fromImage(QImage(frame.data, width, height, channels*width, QImage.Format_Grayscale8)))
+    def update_image(self, frame, scale=1):
+        """Show a frame, scale is the size of a frame pixel in scene pixels.
 
-        
+        Only the visible part is converted, at about one frame pixel per screen
+        pixel, so the cost does not grow with the sensor size.
+        """
+        self.last_frame = (frame, scale)
+        height, width = np.shape(frame)[:2]
+        x0, y0, x1, y1 = self.get_bounds(width, height, scale)
+        if x1 <= x0 or y1 <= y0:
+            self.camera_display.setPixmap(QPixmap())
+            return
+
+        # Frame pixels per screen pixel, the crop is aligned to it so panning does not shimmer
+        step = max(1, int(1/(self.current_scale*scale)))
+        x0, y0 = x0 - x0 % step, y0 - y0 % step
+        # Auto contrast follows the whole frame, not just the visible part
+        image = self.tone_mapper.apply(frame[y0:y1:step, x0:x1:step, 0], statistics=frame[..., 0])
+        image_height, image_width = image.shape
+
+        self.camera_display.setScale(scale*step)
+        self.camera_display.setPos((self.frame_offset.x() + x0)*scale, (self.frame_offset.y() + y0)*scale)
+        self.camera_display.setPixmap(QPixmap.fromImage(QImage(image.data, image_width, image_height, image_width, QImage.Format_Grayscale8)))
+
+    def refresh(self):
+        """Show the last frame again, e.g. after the tone mapping or the visible part changed"""
+        if self.last_frame is not None:
+            self.update_image(*self.last_frame)
 
     def wheelEvent(self, event):
         """
@@ -91,6 +130,7 @@ class VideoView(QGraphicsView):
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.update_margins()
+        self.refresh()
 
     def zoom_in(self):
         """
@@ -99,6 +139,8 @@ class VideoView(QGraphicsView):
         self.scale(self.zoom_factor, self.zoom_factor)
         self.current_scale *= self.zoom_factor
         self.update_margins()
+        self.refresh()
+        self.zoom_changed.emit(self.current_scale)
 
     def zoom_out(self):
         """
@@ -107,6 +149,8 @@ class VideoView(QGraphicsView):
         self.scale(1 / self.zoom_factor, 1 / self.zoom_factor)
         self.current_scale /= self.zoom_factor
         self.update_margins()
+        self.refresh()
+        self.zoom_changed.emit(self.current_scale)
     
     def reset_zoom(self):
         """
@@ -115,14 +159,17 @@ class VideoView(QGraphicsView):
         self.resetTransform()
         self.update_margins()
         self.current_scale = 1.0
+        self.refresh()
+        self.zoom_changed.emit(self.current_scale)
     
-    def get_bounds(self):
-        bounds = np.array(self.mapToScene(self.viewport().rect()).boundingRect().getCoords(), dtype=np.int16)
-        bounds[0] = max(bounds[0], 0)
-        bounds[1] = max(bounds[1], 0)
-        bounds[2] = min(bounds[2], self.camera_display.pixmap().width() - 1)
-        bounds[3] = min(bounds[3], self.camera_display.pixmap().height() - 1)
-        return bounds
+    def get_bounds(self, width, height, scale=1):
+        """Visible part of a width x height frame, as (x0, y0, x1, y1) in frame pixels"""
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        x0, y0, x1, y1 = rect.getCoords()
+        x0, x1 = x0/scale - self.frame_offset.x(), x1/scale - self.frame_offset.x()
+        y0, y1 = y0/scale - self.frame_offset.y(), y1/scale - self.frame_offset.y()
+        return (int(np.clip(np.floor(x0), 0, width)), int(np.clip(np.floor(y0), 0, height)),
+                int(np.clip(np.ceil(x1) + 1, 0, width)), int(np.clip(np.ceil(y1) + 1, 0, height)))
     
     def update_margins(self):
         """
@@ -146,6 +193,10 @@ class VideoView(QGraphicsView):
                 self.start_point.setX(np.round(np.clip(self.start_point.x(), 0, self.max_roi_width)/16)*16)
                 self.start_point.setY(np.round(np.clip(self.start_point.y(), 0, self.max_roi_height)/16)*16)
                 self.roi_graphic.show()
+            if self.mode == "profile":
+                self.start_point = self.mapToScene(event.pos())
+                self.profile_graphic.setLine(QLineF(self.start_point, self.start_point))
+                self.profile_graphic.show()
             if self.mode == "navigation":
                 super().mousePressEvent(event)
     
@@ -164,6 +215,9 @@ class VideoView(QGraphicsView):
                 end_point = self.calculate_endpoint(end_point)
                 rect = QRect(self.start_point, end_point).normalized()
                 self.roi_graphic.setRect(rect)
+
+            if self.mode == "profile":
+                self.profile_graphic.setLine(QLineF(self.start_point, self.mapToScene(event.pos())))
         return super().mouseMoveEvent(event)
     
     def mouseReleaseEvent(self, event):
@@ -171,6 +225,14 @@ class VideoView(QGraphicsView):
             if self.start_point is not None:
                 if self.mode == "move":
                     self.start_point = None
+                if self.mode == "profile":
+                    # The line stays visible, its profile follows the live frames
+                    line = self.profile_graphic.line()
+                    scale = self.last_frame[1] if self.last_frame is not None else 1
+                    offset = np.array([self.frame_offset.x(), self.frame_offset.y()]*2)
+                    self.start_point = None
+                    self.mode = "navigation"
+                    self.profile_set.emit(np.array([line.x1(), line.y1(), line.x2(), line.y2()])/scale - offset)
                 if self.mode == "roi":
                     # Update the graphic
                     end_point = self.mapToScene(event.pos()).toPoint()
@@ -183,7 +245,7 @@ class VideoView(QGraphicsView):
                     self.start_point = None  # Reset start point
                     self.roi_set.emit(rect)
                     self.roi_graphic.hide()
-                    self.camera_display.setOffset(rect.topLeft())
+                    self.frame_offset = rect.topLeft()
         return super().mouseReleaseEvent(event)
 
     def calculate_endpoint(self, end_point):